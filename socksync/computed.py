@@ -0,0 +1,264 @@
+import heapq
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right
+from typing import Callable, Iterable, List, Dict, Optional
+
+from socksync.groups import LocalGroup, LocalVariable, LocalList, _synchronized
+
+
+class Aggregator(ABC):
+    def __init__(self, key: Callable[[any], any] = None):
+        self._key = key or (lambda item: item)
+
+    @property
+    @abstractmethod
+    def result(self) -> any:
+        pass
+
+    @abstractmethod
+    def reset(self, items: Iterable[any]):
+        pass
+
+    @abstractmethod
+    def add(self, item: any):
+        pass
+
+    @abstractmethod
+    def remove(self, item: any):
+        pass
+
+
+class Sum(Aggregator):
+    def __init__(self, key: Callable[[any], any] = None):
+        super().__init__(key)
+        self._total = 0
+
+    @property
+    def result(self) -> any:
+        return self._total
+
+    def reset(self, items: Iterable[any]):
+        self._total = sum(self._key(item) for item in items)
+
+    def add(self, item: any):
+        self._total += self._key(item)
+
+    def remove(self, item: any):
+        self._total -= self._key(item)
+
+
+class Count(Aggregator):
+    def __init__(self, predicate: Callable[[any], bool] = None):
+        super().__init__(predicate or (lambda item: True))
+        self._count = 0
+
+    @property
+    def result(self) -> int:
+        return self._count
+
+    def reset(self, items: Iterable[any]):
+        self._count = sum(1 for item in items if self._key(item))
+
+    def add(self, item: any):
+        if self._key(item):
+            self._count += 1
+
+    def remove(self, item: any):
+        if self._key(item):
+            self._count -= 1
+
+
+class _Reversed:
+    __slots__ = ("value",)
+
+    def __init__(self, value: any):
+        self.value = value
+
+    def __lt__(self, other: '_Reversed') -> bool:
+        return other.value < self.value
+
+
+class Min(Aggregator):
+    def __init__(self, key: Callable[[any], any] = None):
+        super().__init__(key)
+        self._heap: List[any] = []
+        # Removed keys stay in the heap until they reach the top, keys need to be hashable for that.
+        self._removed: Dict[any, int] = {}
+        self._removed_count = 0
+
+    @property
+    def result(self) -> Optional[any]:
+        while self._heap:
+            top = self._unwrap(self._heap[0])
+            if not self._removed.get(top):
+                return top
+            self._discard_removed(top)
+            heapq.heappop(self._heap)
+        return None
+
+    def reset(self, items: Iterable[any]):
+        self._heap = [self._wrap(self._key(item)) for item in items]
+        heapq.heapify(self._heap)
+        self._removed.clear()
+        self._removed_count = 0
+
+    def add(self, item: any):
+        heapq.heappush(self._heap, self._wrap(self._key(item)))
+
+    def remove(self, item: any):
+        key = self._key(item)
+        self._removed[key] = self._removed.get(key, 0) + 1
+        self._removed_count += 1
+        if self._removed_count > len(self._heap) // 2:
+            self._compact()
+
+    def _discard_removed(self, key: any):
+        self._removed_count -= 1
+        if self._removed[key] == 1:
+            del self._removed[key]
+        else:
+            self._removed[key] -= 1
+
+    def _compact(self):
+        heap = []
+        for entry in self._heap:
+            key = self._unwrap(entry)
+            if self._removed.get(key):
+                self._discard_removed(key)
+            else:
+                heap.append(entry)
+        heapq.heapify(heap)
+        self._heap = heap
+
+    def _wrap(self, key: any) -> any:
+        return key
+
+    def _unwrap(self, entry: any) -> any:
+        return entry
+
+
+class Max(Min):
+    def _wrap(self, key: any) -> any:
+        return _Reversed(key)
+
+    def _unwrap(self, entry: any) -> any:
+        return entry.value
+
+
+class TopK(Aggregator):
+    def __init__(self, k: int, key: Callable[[any], any] = None):
+        super().__init__(key)
+        self._k = k
+        # All items sorted by key, with their keys next to them so positions can be found with a binary search.
+        self._keys: List[any] = []
+        self._items: List[any] = []
+
+    @property
+    def result(self) -> List[any]:
+        return self._items[:-self._k - 1:-1] if self._k > 0 else []
+
+    def reset(self, items: Iterable[any]):
+        entries = sorted(((self._key(item), item) for item in items), key=lambda entry: entry[0])
+        self._keys = [key for key, _ in entries]
+        self._items = [item for _, item in entries]
+
+    def add(self, item: any):
+        key = self._key(item)
+        i = bisect_right(self._keys, key)
+        self._keys.insert(i, key)
+        self._items.insert(i, item)
+
+    def remove(self, item: any):
+        key = self._key(item)
+        for i in range(bisect_left(self._keys, key), bisect_right(self._keys, key)):
+            if self._items[i] == item:
+                self._keys.pop(i)
+                self._items.pop(i)
+                return
+
+
+def _apply_mutation(aggregator: Aggregator, op: str, old: any, new: any):
+    if op == "insert":
+        aggregator.add(new)
+    elif op == "delete":
+        aggregator.remove(old)
+    elif op == "set":
+        aggregator.remove(old)
+        aggregator.add(new)
+    else:
+        aggregator.reset(new)
+
+
+class ComputedVariable(LocalVariable):
+    __slots__ = ("_source", "_aggregator")
+
+    def __init__(self, name: str, source: LocalList, aggregator: Aggregator):
+        super().__init__(name)
+        self._source = source
+        self._aggregator = aggregator
+        with source._locked():
+            aggregator.reset(source.items)
+            self._value = aggregator.result
+            source.add_mutation_listener(self._source_mutated)
+
+    @_synchronized
+    def _source_mutated(self, op: str, index: Optional[int], old: any, new: any):
+        _apply_mutation(self._aggregator, op, old, new)
+        result = self._aggregator.result
+        if result != self.value:
+            self.value = result
+
+
+class ComputedList(LocalList):
+    __slots__ = ("_source", "_aggregator")
+
+    def __init__(self, name: str, source: LocalList, aggregator: Aggregator, max_page_size: int = 25):
+        super().__init__(name, max_page_size=max_page_size)
+        self._source = source
+        self._aggregator = aggregator
+        with source._locked():
+            aggregator.reset(source.items)
+            self._items.extend(aggregator.result)
+            source.add_mutation_listener(self._source_mutated)
+
+    @_synchronized
+    def _source_mutated(self, op: str, index: Optional[int], old: any, new: any):
+        _apply_mutation(self._aggregator, op, old, new)
+        result = self._aggregator.result
+
+        # One item entering or leaving (like in a top k) only needs a delete and an insert instead of setting every item
+        # after it.
+        if len(result) == len(self._items) and result != self._items:
+            i = next(i for i in range(len(result)) if result[i] != self._items[i])
+            if result[i + 1:] == self._items[i:-1]:
+                self.delete(len(self._items) - 1)
+                self.insert(i, result[i])
+                return
+            if result[i:-1] == self._items[i + 1:]:
+                self.delete(i)
+                self.insert(len(self._items), result[-1])
+                return
+
+        for i in range(min(len(result), len(self._items))):
+            if result[i] != self._items[i]:
+                self.set(i, result[i])
+        while len(self._items) > len(result):
+            self.delete(len(self._items) - 1)
+        for i in range(len(self._items), len(result)):
+            self.insert(i, result[i])
+
+
+class DerivedVariable(LocalVariable):
+    __slots__ = ("_function",)
+
+    def __init__(self, name: str, sources: List[LocalGroup], function: Callable[[], any]):
+        super().__init__(name, function())
+        self._function = function
+        for source in sources:
+            source.add_mutation_listener(self._source_mutated)
+
+    @_synchronized
+    def _source_mutated(self, op: str, index: Optional[int], old: any, new: any):
+        value = self._function()
+        if value != self.value:
+            self.value = value
@@ -0,0 +1,186 @@
+import asyncio
+import time
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from typing import Callable, Dict, List, Iterable, Iterator, Tuple, Optional, Set
+from weakref import WeakSet, ref
+
+from socksync.groups import RemoteGroup, RemoteFunction, RemoteVariable
+
+_SockSyncSocket = 'SockSyncSocket'
+
+
+class FleetResult:
+    __slots__ = ("results", "errors", "missing")
+
+    def __init__(self):
+        self.results: Dict[_SockSyncSocket, any] = {}
+        self.errors: Dict[_SockSyncSocket, BaseException] = {}
+        # Sockets that didn't return before the deadline.
+        self.missing: List[_SockSyncSocket] = []
+
+    @property
+    def complete(self) -> bool:
+        return not self.errors and not self.missing
+
+    def _add(self, socket: _SockSyncSocket, future: Future):
+        if not future.done() or future.cancelled():
+            self.missing.append(socket)
+        elif future.exception() is not None:
+            self.errors[socket] = future.exception()
+        else:
+            self.results[socket] = future.result()
+
+
+class _Fleet:
+    __slots__ = ("_name", "_sockets", "__weakref__")
+
+    _type = None
+    _group_class = RemoteGroup
+
+    def __init__(self, name: str, sockets: Iterable[_SockSyncSocket] = ()):
+        self._name = name
+        # The group for each socket lives in that socket's registry, so a dropped socket simply leaves the fleet.
+        self._sockets: Set[_SockSyncSocket] = WeakSet()
+        for socket in sockets:
+            self.add_socket(socket)
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def sockets(self) -> List[_SockSyncSocket]:
+        return list(self._sockets)
+
+    def add_socket(self, socket: _SockSyncSocket):
+        self._group(socket)
+        self._sockets.add(socket)
+
+    def remove_socket(self, socket: _SockSyncSocket):
+        self._sockets.discard(socket)
+
+    def _group(self, socket: _SockSyncSocket) -> RemoteGroup:
+        group = socket._registry[self._type].get(self._name)
+        if not isinstance(group, self._group_class):
+            group = self._new_group(socket)
+        elif not group.subscribed:
+            group.subscribe()
+        return group
+
+    def _groups(self) -> List[Tuple[_SockSyncSocket, RemoteGroup]]:
+        return [(socket, self._group(socket)) for socket in list(self._sockets)]
+
+    def _new_group(self, socket: _SockSyncSocket) -> RemoteGroup:
+        return self._group_class(self._name, socket)
+
+
+class FleetFunction(_Fleet):
+    __slots__ = ()
+
+    _type = "function"
+    _group_class = RemoteFunction
+
+    def call(self, timeout: float = None, **kwargs) -> FleetResult:
+        calls = self._start_calls(kwargs)
+        for _ in self._completed(calls, timeout):
+            pass
+
+        result = FleetResult()
+        for future, socket in calls.items():
+            result._add(socket, future)
+        return result
+
+    async def call_async(self, timeout: float = None, **kwargs) -> FleetResult:
+        calls = {}
+        for socket, function in self._groups():
+            future, = await function._start_calls_async([kwargs])
+            calls[asyncio.wrap_future(future)] = (socket, future)
+
+        if calls:
+            _, pending = await asyncio.wait(list(calls), timeout=timeout)
+            for wrapped in pending:
+                calls[wrapped][1].cancel()
+
+        result = FleetResult()
+        for socket, future in calls.values():
+            result._add(socket, future)
+        return result
+
+    def as_completed(self, timeout: float = None, **kwargs) -> Iterator[Tuple[_SockSyncSocket, Future]]:
+        return self._completed(self._start_calls(kwargs), timeout)
+
+    def _start_calls(self, kwargs: dict) -> Dict[Future, _SockSyncSocket]:
+        # Every socket is sent the call before waiting on any of them, so the whole fleet takes one round trip.
+        return {function._start_calls([kwargs])[0]: socket for socket, function in self._groups()}
+
+    @staticmethod
+    def _completed(calls: Dict[Future, _SockSyncSocket],
+                   timeout: Optional[float]) -> Iterator[Tuple[_SockSyncSocket, Future]]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        pending = set(calls)
+        try:
+            while pending:
+                remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+                done, pending = wait(pending, remaining, FIRST_COMPLETED)
+                if not done:
+                    break
+                for future in done:
+                    yield calls[future], future
+        finally:
+            # Cancelling frees the call slots, a late return is then answered with a bad id error.
+            for future in pending:
+                future.cancel()
+
+
+class FleetVariable(_Fleet):
+    __slots__ = ("_path", "_change_listeners", "_variable_changed")
+
+    _type = "var"
+    _group_class = RemoteVariable
+
+    # Called with the fleet and the socket whose value changed.
+    ChangeListener = Callable[['FleetVariable', _SockSyncSocket], None]
+
+    def __init__(self, name: str, sockets: Iterable[_SockSyncSocket] = (), path: str = None):
+        self._path = path
+        self._change_listeners: List[FleetVariable.ChangeListener] = []
+
+        # The variables outlive the fleet, so they only get a weak reference to it.
+        fleet = ref(self)
+
+        def variable_changed(variable: RemoteVariable):
+            f = fleet()
+            if f is not None and variable._socket in f._sockets:
+                for listener in list(f._change_listeners):
+                    listener(f, variable._socket)
+
+        self._variable_changed = variable_changed
+        super().__init__(name, sockets)
+
+    @property
+    def path(self) -> Optional[str]:
+        return self._path
+
+    @property
+    def values(self) -> Dict[_SockSyncSocket, any]:
+        return {socket: variable.value for socket, variable in self._groups()}
+
+    def get(self):
+        for _, variable in self._groups():
+            variable.get()
+
+    def add_change_listener(self, listener: ChangeListener):
+        self._change_listeners.append(listener)
+
+    def remove_change_listener(self, listener: ChangeListener):
+        if listener in self._change_listeners:
+            self._change_listeners.remove(listener)
+
+    def add_socket(self, socket: _SockSyncSocket):
+        super().add_socket(socket)
+        variable = self._group(socket)
+        if self._variable_changed not in variable._change_listeners:
+            variable.add_change_listener(self._variable_changed)
+
+    def _new_group(self, socket: _SockSyncSocket) -> RemoteGroup:
+        return RemoteVariable(self._name, socket, path=self._path)
@@ -1,18 +1,43 @@
+import asyncio
+import json
+import logging
 import math
 import time
 from abc import ABC, abstractmethod
-from threading import Thread
-from typing import Set, Callable, Dict, Optional, List, Tuple, Iterable
+from contextlib import contextmanager
+from functools import wraps
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from threading import Thread, Lock, RLock, Timer
+from typing import Set, Callable, Dict, Optional, List, Tuple, Iterable, Deque
 from uuid import uuid4
+from weakref import WeakSet, WeakKeyDictionary
 
 from django.core.paginator import Paginator
 
 from socksync.errors import SockSyncErrors
+from socksync import profiling, socksync
+from socksync.utils import ListFilter, dict_without_none, get_path, encode_frame, moved_index
 
 _SockSyncSocket = 'SockSyncSocket'
+_Store = 'RedisStore'
+
+_logger = logging.getLogger(__name__)
+
+
+def _synchronized(method):
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._locked():
+            return method(self, *args, **kwargs)
+
+    return wrapper
 
 
 class Group(ABC):
+    __slots__ = ("_name", "_type", "_receive_functions", "_send_functions", "__weakref__")
+
     ReceiveFunction = Callable[[dict, _SockSyncSocket], None]
     SendFunction = Callable[[dict, _SockSyncSocket], Optional[dict]]
 
@@ -69,19 +94,29 @@ class Group(ABC):
     def _register_send(self, func: str, function: SendFunction = None):
         self._send_functions[func] = function or (lambda args, socket: {})
 
+    def _accepts(self, func: str) -> bool:
+        return func in self._receive_functions
+
     def _send_func(self, func: str, socket: _SockSyncSocket = None, args: dict = None):
         for s in [socket] if socket is not None else self._get_sockets():
-            data = self._send_functions[func](args, s)
+            with profiling.stage("send_function", func):
+                data = self._send_functions[func](args, s)
             if data is not None:
-                s._send_json({'func': func, **self._to_json(), **data})
+                self._send_to(s, {'func': func, **self._to_json(), **data})
 
     def _send_json(self, data: dict, socket: _SockSyncSocket = None):
         for s in [socket] if socket is not None else self._get_sockets():
-            s._send_json({**self._to_json(), **data})
+            self._send_to(s, {**self._to_json(), **data})
 
-    @staticmethod
-    def _send_error(error_code: int, message: str, socket: _SockSyncSocket):
-        socket._send_error(error_code, message)
+    def _send_to(self, socket: _SockSyncSocket, data: dict):
+        socket._send_json(data)
+
+    def _socket_disconnected(self, socket: _SockSyncSocket):
+        pass
+
+    def _send_error(self, error_code: int, message: str, socket: _SockSyncSocket):
+        # Goes through _send_to like any other frame, so a local group queues it behind what it already queued.
+        self._send_to(socket, {"func": "error", "error_code": error_code, "message": message})
 
     def _to_json(self) -> dict:
         return {
@@ -91,20 +126,77 @@ class Group(ABC):
 
 
 class RemoteGroup(Group, ABC):
+    __slots__ = ("_socket", "_subscribed", "_change_listeners", "_waiters", "_waiters_lock")
+
+    ChangeListener = Callable[['RemoteGroup'], None]
+
     def __init__(self, name: str, type_: str, socket: _SockSyncSocket):
         super().__init__(name, type_)
         self._socket = socket
         self._subscribed = False
+        self._change_listeners: List[RemoteGroup.ChangeListener] = []
+        self._waiters: List[Tuple[Future, Optional[Callable[[RemoteGroup], bool]]]] = []
+        self._waiters_lock = Lock()
         socket.register_group(self)
 
+    def add_change_listener(self, listener: ChangeListener):
+        self._change_listeners.append(listener)
+
+    def remove_change_listener(self, listener: ChangeListener):
+        if listener in self._change_listeners:
+            self._change_listeners.remove(listener)
+
+    async def wait_for_change(self, timeout: float = None) -> 'RemoteGroup':
+        return await self._wait(None, timeout)
+
+    async def wait_until(self, predicate: Callable[['RemoteGroup'], bool], timeout: float = None) -> 'RemoteGroup':
+        if predicate(self):
+            return self
+        return await self._wait(predicate, timeout)
+
+    async def _wait(self, predicate: Optional[Callable[['RemoteGroup'], bool]], timeout: Optional[float]):
+        # Changes are received on the consumer's thread, so waiters are concurrent futures that get wrapped for the
+        # caller's event loop.
+        future = Future()
+        with self._waiters_lock:
+            self._waiters.append((future, predicate))
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        finally:
+            with self._waiters_lock:
+                self._waiters = [w for w in self._waiters if w[0] is not future]
+
+    def _changed(self):
+        for listener in list(self._change_listeners):
+            try:
+                listener(self)
+            except Exception:
+                _logger.exception(f"Change listener for {self._type} {self._name} failed.")
+
+        with self._waiters_lock:
+            waiters, self._waiters = self._waiters, []
+        for future, predicate in waiters:
+            if future.done():
+                continue
+            try:
+                ready = predicate is None or predicate(self)
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            if ready:
+                future.set_result(self)
+            else:
+                with self._waiters_lock:
+                    self._waiters.append((future, predicate))
+
     def _get_sockets(self) -> List[_SockSyncSocket]:
         return [self._socket]
 
     def _is_subscribed(self, socket: _SockSyncSocket):
         return self._socket == socket and self.subscribed
 
-    def subscribe(self):
-        self._send_json({'func': "subscribe"})
+    def subscribe(self, snapshot: bool = False):
+        self._send_json({'func': "subscribe", **self._subscribe_args(snapshot)})
         self._subscribed = True
         self._socket._add_subscription(self)
 
@@ -117,25 +209,158 @@ class RemoteGroup(Group, ABC):
     def subscribed(self) -> bool:
         return self._subscribed
 
+    def _subscribe_args(self, snapshot: bool) -> dict:
+        return {'get': self._get_args()} if snapshot and "get" in self._send_functions else {}
+
+    def _get_args(self, args: dict = None) -> dict:
+        return self._send_functions["get"]({} if args is None else args, self._socket)
+
 
 class LocalGroup(Group, ABC):
+    __slots__ = ("_subscriber_sockets", "_lock", "_lock_depth", "_outbox", "_outbox_lock", "_draining",
+                 "_mutation_listeners", "_mutations", "_notifying")
+
+    # Called with the kind of change, the index (for lists), the old and the new value. Listeners are called in the
+    # order of the changes, but only after the group is unlocked, so they can safely lock other groups.
+    MutationListener = Callable[[str, Optional[int], any, any], None]
+
     def __init__(self, name: str, type_: str):
         super().__init__(name, type_)
-        self._subscriber_sockets: Set[_SockSyncSocket] = set()
+        # Sockets are only weakly referenced so that a dropped connection can never be kept alive (or keep receiving
+        # updates) through a group it forgot to unsubscribe from.
+        self._subscriber_sockets: Set[_SockSyncSocket] = WeakSet()
+
+        # The state of a group (including its subscribers) is only read and changed while holding _lock, so it can be
+        # used from any thread. Frames are queued in the outbox while holding it and handed to the sender once it's
+        # released, one drain of the outbox at a time. That keeps the order of the changes without anyone waiting on a
+        # socket while changing the group.
+        self._lock = RLock()
+        self._lock_depth = 0
+        self._outbox: Deque[Tuple[_SockSyncSocket, str, str]] = deque()
+        self._outbox_lock = Lock()
+        self._draining = False
+        # Replaced instead of changed, so every queued change keeps the listeners there were when it was made.
+        self._mutation_listeners: List[LocalGroup.MutationListener] = []
+        self._mutations: Deque[Tuple[List[LocalGroup.MutationListener], tuple]] = deque()
+        self._notifying = False
 
         self._register_receive("subscribe", self._socket_subscribed, False)
         self._register_receive("unsubscribe", self._socket_unsubscribed, True)
 
-    def _socket_subscribed(self, _, socket: _SockSyncSocket):
+    @_synchronized
+    def add_mutation_listener(self, listener: MutationListener):
+        self._mutation_listeners = self._mutation_listeners + [listener]
+
+    @_synchronized
+    def remove_mutation_listener(self, listener: MutationListener):
+        self._mutation_listeners = [existing for existing in self._mutation_listeners if existing is not listener]
+
+    def _mutated(self, op: str, index: int = None, old: any = None, new: any = None):
+        if self._mutation_listeners:
+            self._mutations.append((self._mutation_listeners, (op, index, old, new)))
+
+    def _notify(self):
+        # Like the outbox, the changes are handed to the listeners by one thread at a time.
+        while True:
+            with self._outbox_lock:
+                if self._notifying or not self._mutations:
+                    return
+                self._notifying = True
+
+            try:
+                while self._mutations:
+                    listeners, args = self._mutations.popleft()
+                    for listener in listeners:
+                        try:
+                            listener(*args)
+                        except Exception:
+                            _logger.exception(f"Mutation listener for {self._type} {self._name} failed.")
+            finally:
+                with self._outbox_lock:
+                    self._notifying = False
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                outermost = self._lock_depth == 0
+        if outermost:
+            self._drain()
+            self._notify()
+
+    def _post(self, socket: _SockSyncSocket, text: str, func: str):
+        self._outbox.append((socket, text, func))
+
+    def _drain(self):
+        with self._outbox_lock:
+            if self._draining or not self._outbox:
+                return
+            self._draining = True
+
+        sender = socksync._sender
+        if sender is None:
+            self._send_outbox()
+        else:
+            sender.submit(self._send_outbox)
+
+    def _send_outbox(self):
+        # Also sends whatever is queued meanwhile, until the outbox is empty.
+        while True:
+            with self._outbox_lock:
+                if not self._outbox:
+                    self._draining = False
+                    return
+                socket, text, func = self._outbox.popleft()
+
+            try:
+                socket._send_encoded(text, func, (self._type, self._name))
+            except Exception:
+                _logger.exception(f"Sending to a subscriber of {self._type} {self._name} failed.")
+
+    def _handle_func(self, func: str, data: dict, socket: _SockSyncSocket):
+        with self._locked():
+            super()._handle_func(func, data, socket)
+
+    def _send_to(self, socket: _SockSyncSocket, data: dict):
+        self._post(socket, encode_frame(data), data["func"])
+
+    def _socket_subscribed(self, data: Optional[dict], socket: _SockSyncSocket):
         self._subscriber_sockets.add(socket)
         socket._add_subscriber(self)
 
+        # A subscribe can carry the arguments of a get so the initial snapshot doesn't need a second request.
+        if data is not None and "get" in data:
+            if not isinstance(data["get"], dict):
+                self._send_error(SockSyncErrors.ERROR_OTHER, "get must be an object.", socket)
+                return
+            self._handle_func("get", {**data["get"], **self._to_json(), "func": "get"}, socket)
+
+    @_synchronized
     def _socket_unsubscribed(self, _, socket: _SockSyncSocket):
-        self._subscriber_sockets.remove(socket)
+        self._subscriber_sockets.discard(socket)
         socket._remove_subscriber(self)
 
+    # A suspended socket (idle or not answering pings) stays subscribed, but is left out of every fan-out until it's
+    # resumed and brought up to date again.
+    @_synchronized
+    def _socket_suspended(self, socket: _SockSyncSocket):
+        self._subscriber_sockets.discard(socket)
+
+    @_synchronized
+    def _socket_resumed(self, socket: _SockSyncSocket):
+        self._subscriber_sockets.add(socket)
+        self._resync(socket)
+
+    def _resync(self, socket: _SockSyncSocket):
+        pass
+
     def _get_sockets(self) -> List[_SockSyncSocket]:
-        return [s for s in self._subscriber_sockets]
+        with self._lock:
+            return list(self._subscriber_sockets)
 
     def _is_subscribed(self, socket: _SockSyncSocket):
         return socket in self._subscriber_sockets
@@ -146,68 +371,178 @@ class LocalGroup(Group, ABC):
 
 
 class RemoteVariable(RemoteGroup):
-    def __init__(self, name: str, socket: _SockSyncSocket, subscribe: bool = True):
+    __slots__ = ("_value", "_path")
+
+    def __init__(self, name: str, socket: _SockSyncSocket, subscribe: bool = True, path: str = None):
         super().__init__(name, "var", socket)
         self._value = None
+        self._path = path
         self._register_receive("set", self._recv_set, True, ["value"])
-        self._register_send("get")
+        self._register_send("get", lambda args, socket: dict_without_none({"path": self._path}))
 
         if subscribe:
-            self.subscribe()
-            self.get()
+            self.subscribe(snapshot=True)
 
     @property
     def value(self) -> any:
         return self._value
 
+    @property
+    def path(self) -> Optional[str]:
+        return self._path
+
+    def _subscribe_args(self, snapshot: bool) -> dict:
+        return dict_without_none({**super()._subscribe_args(snapshot), "path": self._path})
+
     def get(self):
         self._send_func("get")
 
     def _recv_set(self, data: dict, _):
         self._value = data["value"]
+        self._changed()
 
 
 class LocalVariable(LocalGroup):
-    def __init__(self, name: str, value: any = None):
+    __slots__ = ("_value", "_storage", "_paths", "_sent")
+
+    def __init__(self, name: str, value: any = None, store: _Store = None):
         super().__init__(name, "var")
         self._value = value
+        self._storage = None if store is None else store.variable(self, value)
+        # Sockets that subscribed to a part of the value (like "balances.BTC") and the last value sent for each of those
+        # parts, so that a change only reaches the sockets whose part actually changed.
+        self._paths: Dict[_SockSyncSocket, str] = WeakKeyDictionary()
+        self._sent: Dict[str, str] = {}
 
         self._register_receive_send("get", "set", True)
-        self._register_send("set", lambda args, socket: {'value': self._value})
+        self._register_send("set", self._send_set)
 
     @property
     def value(self) -> any:
-        return self._value
+        return self._value if self._storage is None else self._storage.get()
 
     @value.setter
+    @_synchronized
     def value(self, value):
-        self._value = value
-        self._send_func("set")
+        old = self.value
+        if self._storage is None:
+            self._value = value
+        else:
+            self._storage.set(value)
+        self._send_value()
+        self._mutated("set", None, old, value)
+
+    @_synchronized
+    def _store_changed(self, op: str, index: int = None, value: any = None):
+        self._send_value()
+        self._mutated("set", None, None, self.value)
+
+    def _send_value(self):
+        value = self.value
+        sockets_by_path: Dict[Optional[str], List[_SockSyncSocket]] = {}
+        for socket in self._get_sockets():
+            sockets_by_path.setdefault(self._paths.get(socket), []).append(socket)
+
+        sent = {}
+        for path, sockets in sockets_by_path.items():
+            data = self._set_data(value, path)
+            encoded_value = json.dumps(data["value"])
+            if path is not None:
+                sent[path] = encoded_value
+                if self._sent.get(path) == encoded_value:
+                    continue
+
+            text = encode_frame({"func": "set", **self._to_json(), **data})
+            for socket in sockets:
+                self._post(socket, text, "set")
+        self._sent = sent
+
+    def _socket_subscribed(self, data: Optional[dict], socket: _SockSyncSocket):
+        path = None if data is None else data.get("path")
+        if path is None:
+            self._paths.pop(socket, None)
+        elif not isinstance(path, str):
+            raise ValueError("path must be a string.")
+        else:
+            self._paths[socket] = path
+            self._sent.setdefault(path, json.dumps(get_path(self.value, path)))
+        super()._socket_subscribed(data, socket)
+
+    @_synchronized
+    def _socket_unsubscribed(self, _, socket: _SockSyncSocket):
+        super()._socket_unsubscribed(_, socket)
+        self._paths.pop(socket, None)
+
+    def _resync(self, socket: _SockSyncSocket):
+        self._send_func("set", socket, {})
+
+    def _send_set(self, args: dict, socket: _SockSyncSocket) -> Optional[dict]:
+        path = (args or {}).get("path", self._paths.get(socket))
+        if path is not None and not isinstance(path, str):
+            raise ValueError("path must be a string.")
+        return self._set_data(self.value, path)
+
+    @staticmethod
+    def _set_data(value: any, path: Optional[str]) -> dict:
+        if path is None:
+            return {"value": value}
+        return {"value": get_path(value, path), "path": path}
 
 
 class RemoteList(RemoteGroup):
-    def __init__(self, name: str, socket: _SockSyncSocket, page_size: int = 25, subscribe: bool = True):
+    __slots__ = ("_items", "_offset", "_limit", "_page", "_page_size", "_total_item_count", "_filter", "_ranged",
+                 "_requested_page", "_cache", "_cache_pages", "_prefetch_pages", "_key_field", "_requested_limit",
+                 "_max_limit")
+
+    def __init__(self, name: str, socket: _SockSyncSocket, page_size: int = 25, subscribe: bool = True,
+                 filter_: dict = None, cache_pages: int = 0, prefetch_pages: int = 0, key_field: str = None):
         super().__init__(name, "list", socket)
+        # The items of the range the other side keeps up to date for us. Without prefetching this is the current page.
         self._items = []
+        self._offset = 0
+        self._limit = page_size
         self._page = 0
         self._page_size = page_size
         self._total_item_count = 0
-
-        self._register_receive("set_all", self._recv_set_all, True, ["page", "page_size", "total_item_count", "items"])
+        self._filter = filter_
+        self._ranged = False
+        self._requested_page: Optional[int] = None
+
+        # Pages that are no longer part of the synced range, most recently used last.
+        self._cache: Dict[int, List[any]] = OrderedDict()
+        self._cache_pages = cache_pages
+        self._prefetch_pages = prefetch_pages
+        self._key_field = key_field
+        # The limit of the last range we asked for, and the most the other side has been willing to send.
+        self._requested_limit: Optional[int] = None
+        self._max_limit: Optional[int] = None
+
+        self._register_receive("set_all", self._recv_set_all, True, ["total_item_count", "items"])
+        self._register_receive("set_range", self._recv_set_range, True,
+                               ["offset", "limit", "total_item_count", "keep", "before", "after"])
+        self._register_receive("extend", self._recv_extend, True, ["items"])
         self._register_receive("set_count", self._recv_set_count, True, ["total_item_count"])
         self._register_receive("set", self._recv_set, True, ["index", "value"])
         self._register_receive("insert", self._recv_insert, True, ["index", "value"])
         self._register_receive("delete", self._recv_delete, True, ["index"])
 
-        self._register_send("get", lambda args, socket: {"page": args["page"], "page_size": self._page_size})
+        self._register_send("get", self._send_get)
 
         if subscribe:
-            self.subscribe()
-            self.get()
+            self.subscribe(snapshot=True)
 
     @property
     def items(self) -> Iterable[any]:
-        return (i for i in self._items)
+        if self._ranged or (self._prefetch_pages == 0 and self._offset == self._page * self._page_size):
+            return (i for i in self._items)
+
+        start = self._page * self._page_size - self._offset
+        if 0 <= start < len(self._items):
+            return (i for i in self._items[start:start + self._page_size])
+        if self._page in self._cache:
+            self._cache.move_to_end(self._page)
+            return (i for i in self._cache[self._page])
+        return (i for i in [])
 
     @property
     def page(self) -> int:
@@ -221,37 +556,211 @@ class RemoteList(RemoteGroup):
     def page_size(self) -> int:
         return self._page_size
 
+    @property
+    def offset(self) -> int:
+        return self._offset
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
     @property
     def count(self) -> int:
         return self._total_item_count
 
+    @property
+    def cached_pages(self) -> List[int]:
+        return list(self._cache.keys())
+
+    @property
+    def filter(self) -> Optional[dict]:
+        return self._filter
+
+    def set_filter(self, filter_: Optional[dict]):
+        self._filter = filter_
+        self._ranged = False
+        self._cache.clear()
+        self._request_page(0, True)
+
     def get(self):
-        self._send_func("get", args={"page": self.page})
+        if self._ranged:
+            self.get_range(self._offset, self._limit)
+        else:
+            self._request_page(self._page, True)
 
     def get_page(self, page: int):
-        page = max(0, min(page, self.pages - 1))
-        self._send_func("get", args={"page": page})
+        self._request_page(max(0, min(page, self.pages - 1)))
+
+    def get_range(self, offset: int, limit: int = None):
+        self._ranged = True
+        self._send_func("get", args={"offset": max(0, offset), "limit": self._limit if limit is None else limit})
+
+    def grow(self, count: int):
+        self.get_range(self._offset, self._limit + count)
+
+    def slide(self, count: int):
+        self.get_range(self._offset + count, self._limit)
+
+    def _request_page(self, page: int, force: bool = False):
+        self._ranged = False
+        args = self._page_args(page)
+        self._show_page(page)
+        if force or "page" in args or args["offset"] != self._offset or args["limit"] != self._limit:
+            self._send_func("get", args=args)
+
+    def _page_args(self, page: int) -> dict:
+        if self._prefetch_pages == 0:
+            return {"page": page, "page_size": self._page_size}
+
+        prefetch = self._prefetch_pages
+        if self._max_limit is not None and self._page_size > 0:
+            # Prefetch fewer pages once the other side caps ranges, the page itself always has to fit.
+            prefetch = min(prefetch, (self._max_limit // self._page_size - 1) // 2)
+            if prefetch < 0:
+                return {"page": page, "page_size": self._page_size}
+
+        first_page = max(0, page - prefetch)
+        last_page = page + prefetch
+        if self._total_item_count > 0:
+            last_page = max(first_page, min(last_page, self.pages - 1))
+        return {"offset": first_page * self._page_size, "limit": (last_page - first_page + 1) * self._page_size}
+
+    def _get_args(self, args: dict = None) -> dict:
+        if self._ranged:
+            return super()._get_args({"offset": self._offset, "limit": self._limit})
+
+        self._show_page(self._page)
+        return super()._get_args(self._page_args(self._page))
+
+    def _show_page(self, page: int):
+        start = page * self._page_size - self._offset
+        if 0 <= start < len(self._items) or page in self._cache:
+            self._page = page
+            self._requested_page = None
+        else:
+            self._requested_page = page
+
+    def _cache_range(self):
+        if self._cache_pages <= 0 or self._ranged or self._page_size <= 0:
+            return
+
+        first_page = math.ceil(self._offset / self._page_size)
+        for page in range(first_page, self.pages):
+            start = page * self._page_size - self._offset
+            end = min(start + self._page_size, self._total_item_count - self._offset)
+            if end > len(self._items) or start >= end:
+                break
+            self._cache[page] = self._items[start:end]
+            self._cache.move_to_end(page)
+
+    def _range_changed(self):
+        if self._requested_page is not None:
+            self._page = self._requested_page
+            self._requested_page = None
+
+        # Pages inside the synced range are always read from it, so they don't need to be cached.
+        if self._page_size > 0:
+            first_page = self._offset // self._page_size
+            last_page = (self._offset + max(len(self._items), 1) - 1) // self._page_size
+            for page in range(first_page, last_page + 1):
+                self._cache.pop(page, None)
+
+        while len(self._cache) > max(self._cache_pages, 0):
+            self._cache.popitem(last=False)
+
+    def _invalidate_shifted_pages(self, index: int):
+        if self._page_size <= 0:
+            return
+
+        # Everything after the synced range shifted. Index 0 is also used for changes before our range, so in that case
+        # nothing before it can be trusted either.
+        end = self._offset + self._limit
+        for page in list(self._cache.keys()):
+            if page * self._page_size >= end or (index == 0 and page * self._page_size < self._offset):
+                self._cache.pop(page)
+
+    def _send_get(self, args: dict, _) -> dict:
+        self._requested_limit = args.get("limit")
+        return dict_without_none({**args, "filter": self._filter})
+
+    def _range_capped(self, data: dict):
+        # A range smaller than asked for might not hold all of the page that should be shown, ask again for a range that
+        # fits.
+        if self._requested_limit is None or data["limit"] >= self._requested_limit:
+            return
+        self._max_limit = data["limit"]
+        if self._ranged or self._prefetch_pages == 0:
+            return
+
+        page = self._page if self._requested_page is None else self._requested_page
+        start = page * self._page_size - self._offset
+        end = min(start + self._page_size, self.count - self._offset)
+        if not 0 <= start < end <= min(self._limit, self.count - self._offset) and page not in self._cache \
+                and page * self._page_size < self.count:
+            self._request_page(page, True)
 
     def _recv_set_all(self, data: dict, _):
-        self._page = data["page"]
-        self._page_size = data["page_size"]
+        self._cache_range()
+        if "offset" in data:
+            self._offset = data["offset"]
+            self._limit = data.get("limit", self._limit)
+            self._ranged = self._ranged or self._prefetch_pages == 0
+        else:
+            self._page_size = data.get("page_size", self._page_size)
+            self._limit = self._page_size
+            self._page = data.get("page", 0)
+            self._requested_page = None
+            self._offset = self._page * self._page_size
+            self._ranged = False
         self._total_item_count = data["total_item_count"]
         self._items.clear()
         for item in data["items"]:
             self._items.append(item)
+        self._range_changed()
+        if "offset" in data and "limit" in data:
+            self._range_capped(data)
+        self._changed()
+
+    def _recv_extend(self, data: dict, _):
+        self._items.extend(data["items"])
+        self._range_changed()
+        self._changed()
+
+    def _recv_set_range(self, data: dict, _):
+        self._cache_range()
+        keep_start, keep_end = data["keep"]
+        self._offset = data["offset"]
+        self._limit = data["limit"]
+        self._total_item_count = data["total_item_count"]
+        self._items[:] = data["before"] + self._items[keep_start:keep_end] + data["after"]
+        self._range_changed()
+        self._range_capped(data)
+        self._changed()
 
     def _recv_set_count(self, data: dict, _):
         self._total_item_count = data["total_item_count"]
+        for page in list(self._cache.keys()):
+            if page >= self.pages:
+                self._cache.pop(page)
+        self._changed()
 
     def _recv_set(self, data: dict, socket: _SockSyncSocket):
-        if data["index"] >= len(self._items):
-            self._send_error(SockSyncErrors.ERROR_BAD_INDEX, f"{data['index']} is out of bounds.", socket)
+        index = data["index"]
+        if self._key_field is not None and "key" in data:
+            index = next((i for i, item in enumerate(self._items)
+                          if isinstance(item, dict) and item.get(self._key_field) == data["key"]), index)
+
+        if index >= len(self._items):
+            self._send_error(SockSyncErrors.ERROR_BAD_INDEX, f"{index} is out of bounds.", socket)
             return
 
-        self._items[data["index"]] = data["value"]
+        self._items[index] = data["value"]
+        self._changed()
 
     def _recv_insert(self, data: dict, _):
         self._items.insert(data["index"], data["value"])
+        self._invalidate_shifted_pages(data["index"])
+        self._changed()
 
     def _recv_delete(self, data: dict, socket: _SockSyncSocket):
         if data["index"] >= len(self._items):
@@ -259,109 +768,807 @@ class RemoteList(RemoteGroup):
             return
 
         self._items.pop(data["index"])
+        self._invalidate_shifted_pages(data["index"])
+        self._changed()
+
+
+class _ListView:
+    __slots__ = ("_list", "filter", "indices", "sockets")
+
+    def __init__(self, list_: 'LocalList', filter_: Optional[ListFilter] = None):
+        self._list = list_
+        self.filter = filter_
+        self.sockets: Set[_SockSyncSocket] = WeakSet()
+
+        # Sorted indices into the source list of the items that match the filter, or None if every item is visible.
+        self.indices: Optional[List[int]] = None
+        if filter_ is not None:
+            self.indices = [i for i, item in enumerate(list_._items) if filter_.matches(item)]
+
+    def __len__(self) -> int:
+        return len(self._list._items) if self.indices is None else len(self.indices)
+
+    def __getitem__(self, i):
+        if self.indices is None:
+            return self._list._items[i]
+        if isinstance(i, slice):
+            return [self._list._items[j] for j in self.indices[i]]
+        return self._list._items[self.indices[i]]
+
+    def _shift(self, start: int, amount: int):
+        for j in range(start, len(self.indices)):
+            self.indices[j] += amount
+
+    def _insert(self, index: int, value: any) -> Optional[Tuple[str, int]]:
+        if self.indices is None:
+            return "insert", index
+
+        j = bisect_left(self.indices, index)
+        self._shift(j, 1)
+        if not self.filter.matches(value):
+            return None
+        self.indices.insert(j, index)
+        return "insert", j
+
+    def _delete(self, index: int) -> Optional[Tuple[str, int]]:
+        if self.indices is None:
+            return "delete", index
+
+        j = bisect_left(self.indices, index)
+        visible = j < len(self.indices) and self.indices[j] == index
+        if visible:
+            self.indices.pop(j)
+        self._shift(j, -1)
+        return ("delete", j) if visible else None
+
+    def _set(self, index: int, value: any) -> Optional[Tuple[str, int]]:
+        if self.indices is None:
+            return "set", index
+
+        j = bisect_left(self.indices, index)
+        visible = j < len(self.indices) and self.indices[j] == index
+        matches = self.filter.matches(value)
+        if visible and matches:
+            return "set", j
+        if visible:
+            self.indices.pop(j)
+            return "delete", j
+        if matches:
+            self.indices.insert(j, index)
+            return "insert", j
+        return None
+
+
+class _ListWindow:
+    __slots__ = ("offset", "limit", "view", "synced", "paged")
+
+    def __init__(self, offset: int, limit: int, view: _ListView, synced: bool = False, paged: bool = True):
+        self.offset = offset
+        self.limit = limit
+        self.view = view
+        # Whether the socket has been sent the items in this window, only then can it be moved by sending a range.
+        self.synced = synced
+        self.paged = paged
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.limit
 
 
 class LocalList(LocalGroup):
-    def __init__(self, name: str, items: List[any] = None, max_page_size: int = 25):
+    __slots__ = ("_items", "_max_page_size", "_subscriber_pages", "_views", "_batch_interval", "_pending",
+                 "_pending_lock", "_flush_timer")
+
+    _DELTA_FUNCS = {"set_count", "set", "insert", "delete"}
+
+    def __init__(self, name: str, items: List[any] = None, max_page_size: int = 25, batch_interval: float = None,
+                 store: _Store = None):
         super().__init__(name, "list")
         self._items = []
-        if items is not None:
+        if store is not None:
+            self._items = store.list(self, items)
+        elif items is not None:
             for item in items:
                 self._items.append(item)
 
         self._max_page_size = max_page_size
-        self._subscriber_pages: Dict[_SockSyncSocket, (int, int)] = {}
+        self._subscriber_pages: Dict[_SockSyncSocket, _ListWindow] = WeakKeyDictionary()
+        # One view per distinct filter, so each change is only tested once per filter no matter how many sockets use it.
+        self._views: Dict[Optional[str], _ListView] = {None: _ListView(self)}
 
-        self._register_receive_send("get", "set_all", True)
+        # With a batch interval, changes are held back per socket and then sent either as they are or as a single
+        # set_all of the socket's window, whichever is smaller.
+        self._batch_interval = batch_interval
+        self._pending: Dict[_SockSyncSocket, List[dict]] = WeakKeyDictionary()
+        self._pending_lock = Lock()
+        self._flush_timer: Optional[Timer] = None
+
+        self._register_receive("get", self._recv_get, True)
 
         self._register_send("set_all", self._send_set_all)
-        self._register_send("set_count", lambda args, socket: {"total_item_count": len(self._items)})
-        self._register_send("set", self._send_set)
-        self._register_send("insert", self._send_insert)
-        self._register_send("delete", self._send_delete)
+        self._register_send("set_range", self._send_set_range)
 
     @property
     def items(self) -> Iterable[any]:
-        return (i for i in self._items)
+        with self._lock:
+            return iter(list(self._items))
 
+    @_synchronized
     def set(self, index, value):
+        index = self._catch_up(self._normalize_index(index))
+        old = self._items[index]
         self._items[index] = value
-        self._send_func("set", args={'index': index})
+        self._send_changes(lambda view: view._set(index, value))
+        self._mutated("set", index, old, value)
 
+    @_synchronized
     def insert(self, index, value):
+        index = max(0, min(index + len(self._items) if index < 0 else index, len(self._items)))
+        index = self._catch_up(index, True)
         self._items.insert(index, value)
-        self._send_func("insert", args={"index": index, "value": value})
+        self._send_changes(lambda view: view._insert(index, value))
+        self._mutated("insert", index, None, value)
 
+    @_synchronized
     def append(self, value):
-        self.insert(len(self._items) - 1, value)
+        self._catch_up()
+        self.insert(len(self._items), value)
 
+    @_synchronized
     def delete(self, index):
-        self._items.pop(index)
-        self._send_func("delete", args={"index": index})
+        index = self._catch_up(self._normalize_index(index))
+        old = self._items.pop(index)
+        self._send_changes(lambda view: view._delete(index))
+        self._mutated("delete", index, old)
+
+    @_synchronized
+    def _store_changed(self, op: str, index: int = None, value: any = None):
+        if op == "set":
+            self._send_changes(lambda view: view._set(index, value))
+        elif op == "insert":
+            self._send_changes(lambda view: view._insert(index, value))
+        elif op == "delete":
+            self._send_changes(lambda view: view._delete(index))
+        else:
+            for view in self._views.values():
+                if view.filter is not None:
+                    view.indices = [i for i, item in enumerate(self._items) if view.filter.matches(item)]
+            for socket in self._get_sockets():
+                window = self._subscriber_pages.get(socket)
+                if window is not None:
+                    self._send_to(socket, self._window_snapshot(window))
+
+        # Changes made by another worker already happened in the store, so the old value is gone.
+        if op == "insert":
+            self._mutated("insert", index, None, value)
+        else:
+            # Listeners run later, by then the items may have changed again.
+            self._mutated("reload", None, None, list(self._items))
+
+    @_synchronized
+    def flush(self):
+        with self._pending_lock:
+            pending, self._pending = self._pending, WeakKeyDictionary()
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+
+        for socket, frames in list(pending.items()):
+            self._send_compacted(socket, frames)
+
+    def _send_to(self, socket: _SockSyncSocket, data: dict):
+        batched = self._batch_interval is not None and data["func"] in self._DELTA_FUNCS
+        if not batched:
+            # Anything else (like a set_all) has to arrive after the changes that came before it.
+            self._flush_socket(socket)
+
+        if data["func"] == "set_all":
+            self._post_set_all(socket, data)
+            return
+        if not batched:
+            super()._send_to(socket, data)
+            return
+
+        with self._pending_lock:
+            self._pending.setdefault(socket, []).append(data)
+            if self._flush_timer is None:
+                self._flush_timer = Timer(self._batch_interval, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def _post_set_all(self, socket: _SockSyncSocket, data: dict, text: str = None):
+        chunk_size = socket.bulk_chunk_size
+        items = data["items"]
+        if chunk_size is None or len(items) <= chunk_size:
+            self._post(socket, encode_frame(data) if text is None else text, "set_all")
+            return
 
-    def _socket_subscribed(self, _, socket: _SockSyncSocket):
-        super()._socket_subscribed(_, socket)
-        self._subscriber_pages[socket] = (0, self._max_page_size)
+        # Big windows are sent in pieces, so frames of other groups (like function returns) can go out in between.
+        chunk_size = max(1, chunk_size)
+        self._post(socket, encode_frame({**data, "items": items[:chunk_size]}), "set_all")
+        for start in range(chunk_size, len(items), chunk_size):
+            extend = {"func": "extend", **self._to_json(), "items": items[start:start + chunk_size]}
+            self._post(socket, encode_frame(extend), "extend")
 
+    def _flush_socket(self, socket: _SockSyncSocket):
+        if self._batch_interval is None:
+            return
+        with self._pending_lock:
+            frames = self._pending.pop(socket, None)
+        if frames:
+            self._send_compacted(socket, frames)
+
+    def _send_compacted(self, socket: _SockSyncSocket, frames: List[dict]):
+        window = self._subscriber_pages.get(socket)
+        if window is None:
+            return
+
+        # Only the last count matters.
+        counts = [frame for frame in frames if frame["func"] == "set_count"]
+        frames = [frame for frame in frames if frame["func"] != "set_count"] + counts[-1:]
+        encoded = [encode_frame(frame) for frame in frames]
+
+        snapshot = self._window_snapshot(window)
+        encoded_snapshot = encode_frame(snapshot)
+        if len(encoded_snapshot) < sum(len(frame) for frame in encoded):
+            self._post_set_all(socket, snapshot, encoded_snapshot)
+        else:
+            for frame, text in zip(frames, encoded):
+                self._post(socket, text, frame["func"])
+
+    def _window_snapshot(self, window: _ListWindow) -> dict:
+        if window.paged:
+            bounds = {"page": window.offset // window.limit if window.limit > 0 else 0, "page_size": window.limit}
+        else:
+            bounds = {"offset": window.offset, "limit": window.limit}
+
+        return dict_without_none({
+            "func": "set_all",
+            **self._to_json(),
+            **bounds,
+            "total_item_count": len(window.view),
+            "items": window.view[window.offset:window.end],
+            "filter": None if window.view.filter is None else window.view.filter.expression
+        })
+
+    def _catch_up(self, index: int = None, inserting: bool = False) -> Optional[int]:
+        # The caller took the index from the items as this worker last saw them, so the changes other workers made
+        # since are applied first and the index is moved along. Only done once, by the outermost change, and only for
+        # stores that are shared between workers.
+        catch_up = getattr(self._items, "catch_up", None)
+        if catch_up is None or self._lock_depth > 1:
+            return index
+
+        # Each change is sent on before the next one is applied, as the frames are built from the items.
+        moved = index
+        for op, at, value in catch_up():
+            self._store_changed(op, at, value)
+            if moved is not None and op != "reload":
+                moved = moved_index(moved, op, at, inserting)
+        if index is not None and moved is None:
+            raise IndexError("list item was deleted by another worker")
+        return moved
+
+    def _normalize_index(self, index: int) -> int:
+        if not -len(self._items) <= index < len(self._items):
+            raise IndexError("list index out of range")
+        return index + len(self._items) if index < 0 else index
+
+    def _send_changes(self, change: Callable[[_ListView], Optional[Tuple[str, int]]]):
+        for key, view in list(self._views.items()):
+            if key is not None and len(view.sockets) == 0:
+                self._views.pop(key)
+                continue
+
+            result = change(view)
+            if result is None:
+                continue
+
+            # Sockets showing the same window of a view get the same frames, so they're built (and encoded) once for
+            # each distinct window instead of once per socket.
+            func, view_index = result
+            cohorts: Dict[Tuple[int, int], List[_SockSyncSocket]] = {}
+            for socket in list(view.sockets):
+                window = self._subscriber_pages.get(socket)
+                if window is not None:
+                    cohorts.setdefault((window.offset, window.limit), []).append(socket)
+
+            for sockets in cohorts.values():
+                frames = self._change_frames(func, view_index, self._subscriber_pages[sockets[0]])
+                self._send_frames(sockets, frames)
+
+    def _send_frames(self, sockets: List[_SockSyncSocket], frames: List[dict]):
+        if self._batch_interval is not None:
+            for socket in sockets:
+                for frame in frames:
+                    self._send_to(socket, frame)
+            return
+
+        encoded = [(encode_frame(frame), frame["func"]) for frame in frames]
+        for socket in sockets:
+            for text, func in encoded:
+                self._post(socket, text, func)
+
+    def _socket_subscribed(self, data: Optional[dict], socket: _SockSyncSocket):
+        self._set_window(socket, _ListWindow(0, self._max_page_size, self._views[None]))
+        super()._socket_subscribed(data, socket)
+
+    @_synchronized
     def _socket_unsubscribed(self, _, socket: _SockSyncSocket):
         super()._socket_unsubscribed(_, socket)
-        self._subscriber_pages.pop(socket)
+        window = self._subscriber_pages.pop(socket, None)
+        if window is not None:
+            window.view.sockets.discard(socket)
+
+    @_synchronized
+    def _socket_suspended(self, socket: _SockSyncSocket):
+        super()._socket_suspended(socket)
+        window = self._subscriber_pages.get(socket)
+        if window is not None:
+            window.view.sockets.discard(socket)
+        with self._pending_lock:
+            self._pending.pop(socket, None)
+
+    def _resync(self, socket: _SockSyncSocket):
+        window = self._subscriber_pages.get(socket)
+        if window is None:
+            return
+        # The view might have been dropped while nobody was looking at it.
+        view = self._get_view(None if window.view.filter is None else window.view.filter.expression)
+        self._set_window(socket, _ListWindow(window.offset, window.limit, view, True, window.paged))
+        self._send_to(socket, self._window_snapshot(self._subscriber_pages[socket]))
+
+    def _get_view(self, filter_expression: Optional[dict]) -> _ListView:
+        if filter_expression is None:
+            return self._views[None]
+
+        filter_ = ListFilter(filter_expression)
+        if filter_.key not in self._views:
+            self._views[filter_.key] = _ListView(self, filter_)
+        return self._views[filter_.key]
+
+    def _set_window(self, socket: _SockSyncSocket, window: _ListWindow):
+        # Changes held back for the socket are relative to its current window, so they go out before it's replaced.
+        self._flush_socket(socket)
+        old_window = self._subscriber_pages.get(socket)
+        if old_window is not None and old_window.view is not window.view:
+            old_window.view.sockets.discard(socket)
+        window.view.sockets.add(socket)
+        self._subscriber_pages[socket] = window
+
+    def _recv_get(self, data: dict, socket: _SockSyncSocket):
+        self._send_func("set_range" if "offset" in data or "limit" in data else "set_all", socket, data)
 
     def _send_set_all(self, args: dict, socket: _SockSyncSocket) -> Optional[dict]:
+        view = self._get_view(args.get("filter"))
+        if "offset" in args or "limit" in args:
+            offset = max(0, args.get("offset", 0))
+            limit = min(self._max_page_size, args.get("limit", self._max_page_size))
+            self._set_window(socket, _ListWindow(offset, limit, view, True, False))
+            return dict_without_none({
+                "offset": offset,
+                "limit": limit,
+                "total_item_count": len(view),
+                "items": view[offset:offset + limit],
+                "filter": args.get("filter")
+            })
+
         page = args.get("page", 0)
         page_size = min(self._max_page_size, args.get("page_size", self._max_page_size))
-        self._subscriber_pages[socket] = (page, page_size)
-        return {
+        self._set_window(socket, _ListWindow(page * page_size, page_size, view, True))
+        return dict_without_none({
             "page": page,
             "page_size": page_size,
-            "total_item_count": len(self._items),
-            "items": [v for v in Paginator(self._items, page_size).get_page(page + 1)]
-        }
+            "total_item_count": len(view),
+            "items": [v for v in Paginator(view, page_size).get_page(page + 1)],
+            "filter": args.get("filter")
+        })
+
+    def _send_set_range(self, args: dict, socket: _SockSyncSocket) -> Optional[dict]:
+        offset = max(0, args.get("offset", 0))
+        limit = min(self._max_page_size, args.get("limit", self._max_page_size))
+        view = self._get_view(args.get("filter"))
+        old_window = self._subscriber_pages.get(socket)
+
+        # Only the items the socket doesn't already have are sent, the overlap with its current window is kept.
+        if old_window is not None and old_window.synced and old_window.view is view:
+            keep_start = max(old_window.offset, offset)
+            keep_end = min(old_window.end, offset + limit, len(view))
+            if keep_start < keep_end:
+                self._set_window(socket, _ListWindow(offset, limit, view, True, False))
+                return dict_without_none({
+                    "offset": offset,
+                    "limit": limit,
+                    "total_item_count": len(view),
+                    "keep": [keep_start - old_window.offset, keep_end - old_window.offset],
+                    "before": view[offset:keep_start],
+                    "after": view[keep_end:offset + limit],
+                    "filter": args.get("filter")
+                })
+
+        self._send_func("set_all", socket, {**args, "offset": offset, "limit": limit})
+        return None
+
+    def _change_frames(self, func: str, i: int, window: _ListWindow) -> List[dict]:
+        if func == "set":
+            return self._set_frames(i, window)
+        if func == "insert":
+            return self._insert_frames(i, window)
+        return self._delete_frames(i, window)
+
+    def _frame(self, func: str, **data) -> dict:
+        return {"func": func, **self._to_json(), **data}
+
+    def _set_frames(self, i: int, window: _ListWindow) -> List[dict]:
+        if window.offset <= i < window.end:
+            return [self._frame("set", index=i - window.offset, value=window.view[i])]
+        return []
+
+    def _insert_frames(self, i: int, window: _ListWindow) -> List[dict]:
+        view = window.view
+        frames = [self._frame("set_count", total_item_count=len(view))]
+        if i >= window.end or window.offset >= len(view):
+            return frames
+
+        # The window was already full before the insert, so its last item got pushed out.
+        if window.end < len(view):
+            frames.append(self._frame("delete", index=window.limit - 1))
+
+        if i < window.offset:
+            frames.append(self._frame("insert", index=0, value=view[window.offset]))
+        else:
+            frames.append(self._frame("insert", index=i - window.offset, value=view[i]))
+        return frames
+
+    def _delete_frames(self, i: int, window: _ListWindow) -> List[dict]:
+        view = window.view
+        frames = [self._frame("set_count", total_item_count=len(view))]
+        if i >= window.end or window.offset > len(view):
+            return frames
+
+        frames.append(self._frame("delete", index=0 if i < window.offset else i - window.offset))
+        if window.end - 1 < len(view):
+            frames.append(self._frame("insert", index=window.limit - 1, value=view[window.end - 1]))
+        return frames
+
+
+class SortedLocalList(LocalList):
+    __slots__ = ("_key", "_keys")
+
+    def __init__(self, name: str, items: List[any] = None, key: Callable[[any], any] = None, max_page_size: int = 25,
+                 batch_interval: float = None, store: _Store = None):
+        self._key = key or (lambda value: value)
+        super().__init__(name, sorted(items or [], key=self._key), max_page_size, batch_interval, store)
+        # Keys are cached next to the items so positions can be found with a binary search instead of calling key on
+        # every item.
+        self._keys = [self._key(item) for item in self._items]
+
+    @_synchronized
+    def add(self, value) -> int:
+        self._catch_up()
+        key = self._key(value)
+        index = bisect_right(self._keys, key)
+        self._keys.insert(index, key)
+        super().insert(index, value)
+        return index
+
+    @_synchronized
+    def index(self, value) -> int:
+        key = self._key(value)
+        for i in range(bisect_left(self._keys, key), bisect_right(self._keys, key)):
+            if self._items[i] == value:
+                return i
+        raise ValueError(f"{value} is not in list")
+
+    @_synchronized
+    def remove(self, value):
+        self._catch_up()
+        self.delete(self.index(value))
+
+    @_synchronized
+    def set(self, index, value) -> int:
+        index = self._catch_up(self._normalize_index(index))
+        key = self._key(value)
+        if (index == 0 or self._keys[index - 1] <= key) and \
+                (index == len(self._keys) - 1 or key <= self._keys[index + 1]):
+            self._keys[index] = key
+            super().set(index, value)
+            return index
+
+        self.delete(index)
+        return self.add(value)
 
-    def _send_set(self, args: dict, socket: _SockSyncSocket) -> Optional[dict]:
-        i = args["index"]
-        socket_i, page_size, page_start, page_end = self._get_socket_index(i, socket)
-        if page_start <= i < page_end:
-            return {
-                "index": socket_i,
-                "value": self._items[i]
-            }
-
-    def _send_insert(self, args: dict, socket: _SockSyncSocket) -> Optional[dict]:
-        self._send_func("set_count", socket)
-        i = args["index"]
-        socket_i, page_size, page_start, page_end = self._get_socket_index(i, socket)
-        if i >= page_end:
-            return None
+    def insert(self, index, value):
+        raise TypeError("Items in a sorted list are placed by their key, use add() instead.")
 
-        if page_end <= len(self._items):
-            self._send_json({"func": "delete", "index": page_size - 1}, socket)
+    def append(self, value):
+        self.add(value)
 
-        if i < page_start:
-            return {"index": 0, "value": self._items[page_start]}
+    @_synchronized
+    def delete(self, index):
+        index = self._catch_up(self._normalize_index(index))
+        self._keys.pop(index)
+        super().delete(index)
+
+    @_synchronized
+    def _store_changed(self, op: str, index: int = None, value: any = None):
+        # The other worker placed the item by its key already.
+        if op == "set":
+            self._keys[index] = self._key(value)
+        elif op == "insert":
+            self._keys.insert(index, self._key(value))
+        elif op == "delete":
+            self._keys.pop(index)
         else:
-            return {"index": socket_i, "value": self._items[i]}
-
-    def _send_delete(self, args: dict, socket: _SockSyncSocket) -> Optional[dict]:
-        self._send_func("set_count", socket)
-        i = args["index"]
-        socket_i, page_size, page_start, page_end = self._get_socket_index(i, socket)
-        if i >= page_end:
+            self._keys = [self._key(item) for item in self._items]
+        super()._store_changed(op, index, value)
+
+
+class KeyedLocalList(LocalList):
+    __slots__ = ("_key_field", "_positions", "_positions_valid_to")
+
+    def __init__(self, name: str, items: List[dict] = None, key_field: str = "id", max_page_size: int = 25,
+                 batch_interval: float = None, store: _Store = None):
+        if items is not None and len({item[key_field] for item in items}) != len(items):
+            raise ValueError(f"{key_field} must be unique.")
+
+        super().__init__(name, items, max_page_size, batch_interval, store)
+        self._key_field = key_field
+        # Key -> index, None until the first lookup so that a restored list doesn't have to load every item. Only
+        # indexes below _positions_valid_to are guaranteed to be correct, anything after an insert or delete is
+        # re-indexed lazily the next time it's looked up.
+        self._positions: Optional[Dict[any, int]] = None
+        self._positions_valid_to = 0
+
+    @_synchronized
+    def __contains__(self, key) -> bool:
+        return self._find(key) is not None
+
+    @_synchronized
+    def index(self, key) -> int:
+        index = self._find(key)
+        if index is None:
+            raise KeyError(key)
+        return index
+
+    @_synchronized
+    def get(self, key) -> dict:
+        return self._items[self.index(key)]
+
+    @_synchronized
+    def update(self, key, value: dict):
+        self._catch_up()
+        self.set(self.index(key), value)
+
+    @_synchronized
+    def remove(self, key):
+        self._catch_up()
+        self.delete(self.index(key))
+
+    @_synchronized
+    def add(self, value: dict):
+        self._catch_up()
+        self.insert(len(self._items), value)
+
+    def append(self, value: dict):
+        self.add(value)
+
+    @_synchronized
+    def set(self, index, value: dict):
+        index = self._catch_up(self._normalize_index(index))
+        key = value[self._key_field]
+        old_key = self._items[index][self._key_field]
+        if key != old_key:
+            if self._find(key) is not None:
+                raise ValueError(f"{key} is already in the list.")
+            self._positions.pop(old_key, None)
+        if self._positions is not None:
+            self._positions[key] = index
+        super().set(index, value)
+
+    @_synchronized
+    def insert(self, index, value: dict):
+        index = max(0, min(index + len(self._items) if index < 0 else index, len(self._items)))
+        index = self._catch_up(index, True)
+        key = value[self._key_field]
+        if self._find(key) is not None:
+            raise ValueError(f"{key} is already in the list.")
+
+        appended = index == len(self._items) and self._positions_valid_to == len(self._items)
+        self._positions_valid_to = len(self._items) + 1 if appended else min(self._positions_valid_to, index)
+        self._positions[key] = index
+        super().insert(index, value)
+
+    @_synchronized
+    def delete(self, index):
+        index = self._catch_up(self._normalize_index(index))
+        if self._positions is not None:
+            self._positions.pop(self._items[index][self._key_field], None)
+            self._positions_valid_to = min(self._positions_valid_to, index)
+        super().delete(index)
+
+    def _find(self, key) -> Optional[int]:
+        if self._positions is None:
+            self._positions = {}
+            self._positions_valid_to = 0
+            self._reindex()
+        index = self._positions.get(key)
+        if index is None:
+            return None
+        if index >= self._positions_valid_to:
+            self._reindex()
+            index = self._positions[key]
+        # Keys that another worker replaced or deleted are only dropped once they're looked up.
+        if index >= len(self._items) or self._items[index][self._key_field] != key:
+            del self._positions[key]
             return None
+        return index
+
+    def _reindex(self):
+        for i in range(self._positions_valid_to, len(self._items)):
+            self._positions[self._items[i][self._key_field]] = i
+        self._positions_valid_to = len(self._items)
+
+    @_synchronized
+    def _store_changed(self, op: str, index: int = None, value: any = None):
+        # Only the positions from the changed index on can be wrong now, they are found again when they're looked up.
+        if op not in ("set", "insert", "delete"):
+            self._positions = None
+        elif self._positions is not None:
+            if op != "delete":
+                self._positions[value[self._key_field]] = index
+            self._positions_valid_to = min(self._positions_valid_to, index)
+        super()._store_changed(op, index, value)
+
+    def _set_frames(self, i: int, window: _ListWindow) -> List[dict]:
+        frames = super()._set_frames(i, window)
+        for frame in frames:
+            frame["key"] = frame["value"][self._key_field]
+        return frames
+
+
+class RemoteStream(RemoteGroup):
+    __slots__ = ("_items", "_tail", "_sequence", "_resyncing")
+
+    def __init__(self, name: str, socket: _SockSyncSocket, tail: int = 25, subscribe: bool = True):
+        super().__init__(name, "stream", socket)
+        self._items: Deque[any] = deque(maxlen=tail)
+        self._tail = tail
+        # Sequence number of the next item expected from the other side, None until the first one arrives.
+        self._sequence: Optional[int] = None
+        self._resyncing = False
+
+        self._register_receive("set_all", self._recv_set_all, True, ["sequence", "items"])
+        self._register_receive("append", self._recv_append, True, ["sequence", "items"])
+        self._register_send("get", lambda args, socket: {"tail": self._tail})
 
-        if i < page_start:
-            self._send_json({"func": "delete", "index": 0})
-        else:
-            self._send_json({"func": "delete", "index": socket_i})
+        if subscribe:
+            self.subscribe(snapshot=True)
+
+    @property
+    def items(self) -> Iterable[any]:
+        return (i for i in self._items)
+
+    @property
+    def tail(self) -> int:
+        return self._tail
+
+    @property
+    def sequence(self) -> Optional[int]:
+        return self._sequence
+
+    def get(self):
+        self._send_func("get")
+
+    def _recv_set_all(self, data: dict, _):
+        self._items = deque(data["items"], maxlen=self._tail)
+        self._sequence = data["sequence"] + len(data["items"])
+        self._resyncing = False
+        self._changed()
+
+    def _recv_append(self, data: dict, _):
+        sequence, items = data["sequence"], data["items"]
+        if self._sequence is not None and sequence > self._sequence and not self._resyncing:
+            # Some items never arrived, keep going with what we have until the snapshot replaces it.
+            self._resyncing = True
+            self.get()
+
+        # Items already in the snapshot may arrive again in an append that was sent before it.
+        skip = 0 if self._sequence is None else max(0, self._sequence - sequence)
+        if skip >= len(items):
+            return
+
+        self._items.extend(items[skip:])
+        self._sequence = sequence + len(items)
+        self._changed()
+
+
+class LocalStream(LocalGroup):
+    __slots__ = ("_items", "_sequence", "_batch_interval", "_pending", "_pending_sequence", "_pending_lock",
+                 "_flush_timer")
+
+    def __init__(self, name: str, capacity: int = 1000, batch_interval: float = None):
+        super().__init__(name, "stream")
+        # Only the last capacity items are kept, older ones drop off the front as new ones are appended.
+        self._items: Deque[any] = deque(maxlen=capacity)
+        self._sequence = 0
+
+        # With a batch interval, appended items are collected and sent as one append frame per interval.
+        self._batch_interval = batch_interval
+        self._pending: List[any] = []
+        self._pending_sequence = 0
+        self._pending_lock = Lock()
+        self._flush_timer: Optional[Timer] = None
+
+        self._register_receive_send("get", "set_all", True)
+        self._register_send("set_all", self._send_set_all)
+
+    @property
+    def items(self) -> Iterable[any]:
+        with self._lock:
+            return iter(list(self._items))
+
+    @property
+    def capacity(self) -> int:
+        return self._items.maxlen
+
+    @property
+    def sequence(self) -> int:
+        return self._sequence
+
+    def append(self, value):
+        self.extend([value])
+
+    @_synchronized
+    def extend(self, values: Iterable[any]):
+        values = list(values)
+        if not values:
+            return
+
+        with self._pending_lock:
+            sequence = self._sequence
+            self._items.extend(values)
+            self._sequence += len(values)
+
+            if self._batch_interval is not None:
+                if not self._pending:
+                    self._pending_sequence = sequence
+                self._pending.extend(values)
+                if self._flush_timer is None:
+                    self._flush_timer = Timer(self._batch_interval, self.flush)
+                    self._flush_timer.daemon = True
+                    self._flush_timer.start()
+                return
+
+        self._send_append(sequence, values)
 
-        if page_end - 1 < len(self._items):
-            self._send_json({"func": "insert", "index": page_size - 1, "value": self._items[page_end - 1]}, socket)
+    @_synchronized
+    def flush(self):
+        with self._pending_lock:
+            pending, self._pending = self._pending, []
+            sequence = self._pending_sequence
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
 
-    def _get_socket_index(self, i: int, socket: _SockSyncSocket) -> Tuple[Optional[int], int, int, int]:
-        page, page_size = self._subscriber_pages[socket]
-        page_start = page * page_size
-        page_end = page * page_size + page_size
-        return i - page * page_size, page_size, page_start, page_end
+        if pending:
+            self._send_append(sequence, pending)
+
+    def _send_append(self, sequence: int, values: List[any]):
+        sockets = self._get_sockets()
+        if not sockets:
+            return
+
+        # Every subscriber gets the same frame, so it's only encoded once.
+        text = encode_frame({"func": "append", **self._to_json(), "sequence": sequence, "items": values})
+        for socket in sockets:
+            self._post(socket, text, "append")
+
+    def _send_set_all(self, args: dict, _) -> Optional[dict]:
+        tail = max(0, min(int(args.get("tail", self.capacity)), self.capacity))
+        with self._pending_lock:
+            items = list(self._items)[max(0, len(self._items) - tail):] if tail > 0 else []
+            return {"sequence": self._sequence - len(items), "items": items}
 
 
 # class SockSyncModelList(SockSyncList):
@@ -384,13 +1591,16 @@ class LocalList(LocalGroup):
 
 
 class RemoteFunction(RemoteGroup):
+    __slots__ = ("_calls", "_calls_lock")
+
     def __init__(self, name: str, socket: _SockSyncSocket, subscribe: bool = True):
         super().__init__(name, "function", socket)
-        self._calls: Set[str] = set()
-        self._returns: Dict[str, any] = {}
+        self._calls: Dict[str, Future] = {}
+        self._calls_lock = Lock()
 
         self._register_receive("return", self._recv_return, True, ["id"])
         self._register_send("call", lambda args, socket: {"id": args["id"], "args": args["args"]})
+        self._register_send("call_many", lambda args, socket: {"calls": args["calls"]})
 
         if subscribe:
             self.subscribe()
@@ -399,37 +1609,184 @@ class RemoteFunction(RemoteGroup):
         if not self.subscribed:
             return None
 
-        id_ = str(uuid4())
-        self._calls.add(id_)
-        self._send_func("call", args={"id": id_, "args": kwargs})
+        return self._start_calls([kwargs])[0].result()
 
-        while id_ not in self._returns:
-            time.sleep(.25)
+    def call_many(self, calls: List[dict]) -> List[any]:
+        if not self.subscribed:
+            return [None for _ in calls]
 
-        return_data = self._returns[id_]
-        self._returns.pop(id_)
-        self._calls.remove(id_)
+        return [future.result() for future in self._start_calls(calls)]
 
-        return return_data
+    async def call_async(self, **kwargs):
+        if not self.subscribed:
+            return None
+
+        futures = await self._start_calls_async([kwargs])
+        return await asyncio.wrap_future(futures[0])
+
+    async def call_many_async(self, calls: List[dict]) -> List[any]:
+        if not self.subscribed:
+            return [None for _ in calls]
+
+        futures = await self._start_calls_async(calls)
+        return list(await asyncio.gather(*(asyncio.wrap_future(future) for future in futures)))
+
+    async def _start_calls_async(self, calls: List[dict]) -> List[Future]:
+        if self._socket._call_slots is None:
+            return self._start_calls(calls)
+        # Waiting for a free call slot blocks, so keep it off the event loop.
+        return await asyncio.get_event_loop().run_in_executor(None, self._start_calls, calls)
+
+    def _start_calls(self, calls: List[dict]) -> List[Future]:
+        slots = self._socket._call_slots
+        futures = []
+        batch = []
+        for args in calls:
+            # Send what we have so far before waiting for a slot, so those calls can finish and free their slots.
+            if slots is not None and not slots.acquire(blocking=False):
+                self._send_calls(batch)
+                batch = []
+                slots.acquire()
+
+            id_ = str(uuid4())
+            future = Future()
+            with self._calls_lock:
+                self._calls[id_] = future
+            future.add_done_callback(lambda _, call_id=id_: self._call_done(call_id))
+            futures.append(future)
+            batch.append({"id": id_, "args": args})
+
+        self._send_calls(batch)
+        return futures
+
+    def _send_calls(self, batch: List[dict]):
+        if len(batch) == 1:
+            self._send_func("call", args=batch[0])
+        elif len(batch) > 1:
+            self._send_func("call_many", args={"calls": batch})
+
+    def _call_done(self, id_: str):
+        with self._calls_lock:
+            self._calls.pop(id_, None)
+        if self._socket._call_slots is not None:
+            self._socket._call_slots.release()
+
+    def _socket_disconnected(self, socket: _SockSyncSocket):
+        with self._calls_lock:
+            futures = list(self._calls.values())
+        for future in futures:
+            if not future.done():
+                future.set_exception(ConnectionError(f"Socket disconnected before {self._name} returned."))
 
     def _recv_return(self, data: dict, socket: _SockSyncSocket):
         id_ = data["id"]
-        if id_ not in self._calls:
+        with self._calls_lock:
+            future = self._calls.get(id_)
+        if future is None or future.done():
             self._send_error(SockSyncErrors.ERROR_BAD_ID, f"{id_} is not a valid function call.", socket)
+            return
 
-        self._returns[id_] = data.get("value", None)
+        future.set_result(data.get("value", None))
 
 
 class LocalFunction(LocalGroup):
-    def __init__(self, name: str, function: Callable = None):
+    __slots__ = ("function", "_cache", "_cache_enabled", "_cache_ttl", "_cache_size", "_cache_lock", "_in_flight")
+
+    def __init__(self, name: str, function: Callable = None, cache: bool = False, cache_ttl: float = None,
+                 cache_size: int = 128):
         super().__init__(name, "function")
         self.function = function
 
+        self._cache_enabled = cache
+        self._cache_ttl = cache_ttl
+        self._cache_size = cache_size
+        # Canonical args -> (expiry time, return value), least recently used first.
+        self._cache: Dict[str, Tuple[Optional[float], any]] = OrderedDict()
+        self._cache_lock = Lock()
+        # Calls that are still running, so identical calls arriving in the meantime wait for the same result.
+        self._in_flight: Dict[str, Future] = {}
+
         self._register_receive("call", self._recv_call, True, ["id"])
+        self._register_receive("call_many", self._recv_call_many, True, ["calls"])
         self._register_send("return", lambda args, socket: {"id": args["id"], "value": args["value"]})
 
+    def invalidate(self, **kwargs):
+        key = self._cache_key(kwargs)
+        with self._cache_lock:
+            self._cache.pop(key, None)
+            self._in_flight.pop(key, None)
+
+    def invalidate_all(self):
+        with self._cache_lock:
+            self._cache.clear()
+            self._in_flight.clear()
+
     def _recv_call(self, data: dict, socket: _SockSyncSocket):
-        Thread(target=self._function_call_wrapper, args=(data["id"], data, socket)).start()
+        if not self._cache_enabled:
+            Thread(target=self._function_call_wrapper, args=(data["id"], data, socket)).start()
+            return
+
+        args = data.get("args", {})
+        key = self._cache_key(args)
+        with self._cache_lock:
+            if key in self._cache:
+                expires, value = self._cache[key]
+                if expires is None or time.monotonic() < expires:
+                    self._cache.move_to_end(key)
+                    self._send_func("return", socket, {"id": data["id"], "value": value})
+                    return
+                self._cache.pop(key)
+
+            future = self._in_flight.get(key)
+            start = future is None
+            if start:
+                future = Future()
+                self._in_flight[key] = future
+
+        future.add_done_callback(lambda f: self._send_result(data["id"], f, socket))
+        if start:
+            Thread(target=self._cached_call, args=(key, args, future)).start()
+
+    def _recv_call_many(self, data: dict, socket: _SockSyncSocket):
+        for call in data["calls"]:
+            if "id" not in call:
+                self._send_error(SockSyncErrors.ERROR_MISSING_FIELD, f"id is required.", socket)
+                continue
+            self._recv_call(call, socket)
+
+    def _cached_call(self, key: str, args: dict, future: Future):
+        try:
+            value = self.function(**args)
+        except Exception as e:
+            with self._cache_lock:
+                if self._in_flight.get(key) is future:
+                    self._in_flight.pop(key)
+            future.set_exception(e)
+            return
+
+        with self._cache_lock:
+            # Don't cache a result that was invalidated while it was being computed.
+            if self._in_flight.get(key) is future:
+                self._in_flight.pop(key)
+                expires = None if self._cache_ttl is None else time.monotonic() + self._cache_ttl
+                self._cache[key] = (expires, value)
+                self._cache.move_to_end(key)
+                while len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+        future.set_result(value)
+
+    @_synchronized
+    def _send_result(self, id_: str, future: Future, socket: _SockSyncSocket):
+        if future.exception() is not None:
+            self._send_error(SockSyncErrors.ERROR_OTHER, f"{future.exception()}", socket)
+        else:
+            self._send_func("return", socket, {"id": id_, "value": future.result()})
+
+    @staticmethod
+    def _cache_key(args: dict) -> str:
+        return json.dumps(args, sort_keys=True, separators=(",", ":"))
 
     def _function_call_wrapper(self, id_: str, data: dict, socket: _SockSyncSocket):
-        self._send_func("return", socket, {"id": id_, "value": self.function(**data.get("args", {}))})
+        value = self.function(**data.get("args", {}))
+        with self._locked():
+            self._send_func("return", socket, {"id": id_, "value": value})
@@ -0,0 +1,129 @@
+import cProfile
+import pstats
+import random
+import time
+from contextlib import nullcontext
+from threading import Lock, local
+from typing import Dict, List, Optional, Tuple
+
+# Stages that hooks are told about: "dispatch" (handling a received message), "send_function" (building the data of an
+# outgoing func), "encode" (json encoding a frame) and "send" (handing a frame to the websocket).
+_hooks: List['ProfilingHook'] = []
+_sample_rate = 1.0
+_local = local()
+_no_stage = nullcontext()
+
+
+class ProfilingHook:
+    def before(self, stage: str, detail: Optional[str]):
+        pass
+
+    def after(self, stage: str, detail: Optional[str], elapsed: float):
+        pass
+
+
+def add_hook(hook: ProfilingHook):
+    global _hooks
+    _hooks = _hooks + [hook]
+
+
+def remove_hook(hook: ProfilingHook):
+    global _hooks
+    _hooks = [h for h in _hooks if h is not hook]
+
+
+def set_sample_rate(rate: float):
+    global _sample_rate
+    _sample_rate = rate
+
+
+def stage(name: str, detail: str = None):
+    # With no hooks this is all a stage costs, so they can stay in the hot paths.
+    if not _hooks:
+        return _no_stage
+    return _Stage(name, detail)
+
+
+class _Stage:
+    __slots__ = ("_name", "_detail", "_hooks", "_start")
+
+    def __init__(self, name: str, detail: Optional[str]):
+        self._name = name
+        self._detail = detail
+        self._hooks: Optional[List[ProfilingHook]] = None
+        self._start = 0.0
+
+    def __enter__(self):
+        # Whether to sample is decided by the outermost stage, everything inside it goes along with that.
+        depth = getattr(_local, "depth", 0)
+        if depth == 0:
+            _local.sampled = random.random() < _sample_rate
+        _local.depth = depth + 1
+
+        if _local.sampled:
+            self._hooks = _hooks
+            for hook in self._hooks:
+                hook.before(self._name, self._detail)
+            self._start = time.perf_counter()
+
+    def __exit__(self, *_):
+        if self._hooks is not None:
+            elapsed = time.perf_counter() - self._start
+            for hook in reversed(self._hooks):
+                hook.after(self._name, self._detail, elapsed)
+        _local.depth -= 1
+
+
+class SamplingProfiler(ProfilingHook):
+    def __init__(self, stages: Tuple[str, ...] = ("dispatch", "send")):
+        # Sampled calls of these stages run under cProfile, every stage is timed.
+        self._stages = stages
+        self._lock = Lock()
+        self._profiles: List[cProfile.Profile] = []
+        self._local = local()
+        self._timings: Dict[Tuple[str, Optional[str]], List[float]] = {}
+
+    @property
+    def timings(self) -> Dict[Tuple[str, Optional[str]], Tuple[int, float]]:
+        with self._lock:
+            return {key: (int(count), total) for key, (count, total) in self._timings.items()}
+
+    def before(self, stage: str, detail: Optional[str]):
+        if stage not in self._stages:
+            return
+
+        # cProfile only profiles the thread that enabled it, so every thread gets its own.
+        depth = getattr(self._local, "depth", 0)
+        self._local.depth = depth + 1
+        if depth == 0:
+            profile = getattr(self._local, "profile", None)
+            if profile is None:
+                profile = self._local.profile = cProfile.Profile()
+                with self._lock:
+                    self._profiles.append(profile)
+            profile.enable()
+
+    def after(self, stage: str, detail: Optional[str], elapsed: float):
+        with self._lock:
+            timing = self._timings.setdefault((stage, detail), [0, 0.0])
+            timing[0] += 1
+            timing[1] += elapsed
+
+        if stage not in self._stages:
+            return
+
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            self._local.profile.disable()
+
+    def dump_stats(self, path: str):
+        # Writes a pstats file, which snakeviz, gprof2dot or pstats itself can read.
+        with self._lock:
+            profiles = list(self._profiles)
+        if not profiles:
+            raise ValueError("Nothing has been profiled yet.")
+
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(path)
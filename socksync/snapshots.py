@@ -0,0 +1,162 @@
+import json
+import mmap
+import os
+import struct
+from collections.abc import MutableSequence
+from typing import List, Optional, Iterator
+
+_LocalGroup = 'LocalGroup'
+
+_MAGIC = b"SOCKSYNC\x01"
+_OFFSET = struct.Struct("<Q")
+
+
+def _encode(value: any) -> bytes:
+    return json.dumps(value, separators=(",", ":")).encode()
+
+
+def save_snapshot(path: str, groups: List[_LocalGroup], version: any = None):
+    # Layout: magic, then per list a table of item offsets followed by the encoded items, then the json header and
+    # finally the offset of the header. The offset tables are what allow single items to be read without the rest.
+    header = {"version": version, "groups": {}}
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(_MAGIC)
+        for group in groups:
+            key = f"{group.type}:{group.name}"
+            if group.type == "var":
+                header["groups"][key] = {"value": group.value}
+                continue
+            if group.type != "list":
+                raise ValueError(f"{group.type} groups can't be saved in a snapshot.")
+
+            items = [_encode(item) for item in group.items]
+            table = f.tell()
+            offsets = [table + _OFFSET.size * (len(items) + 1)]
+            for item in items:
+                offsets.append(offsets[-1] + len(item))
+
+            f.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+            for item in items:
+                f.write(item)
+            header["groups"][key] = {"table": table, "count": len(items)}
+
+        header_offset = f.tell()
+        f.write(_encode(header))
+        f.write(_OFFSET.pack(header_offset))
+        f.flush()
+        os.fsync(f.fileno())
+
+    # Groups restored from the previous snapshot keep reading the old file through their mapping.
+    os.replace(temp_path, path)
+
+
+class SnapshotStore:
+    def __init__(self, path: str):
+        self._path = path
+        self._buffer: Optional[mmap.mmap] = None
+        self._header = {"version": None, "groups": {}}
+
+        if not os.path.exists(path):
+            return
+
+        with open(path, "rb") as f:
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._buffer) < len(_MAGIC) + _OFFSET.size or self._buffer[:len(_MAGIC)] != _MAGIC:
+            raise ValueError(f"{path} is not a snapshot.")
+
+        header_offset, = _OFFSET.unpack_from(self._buffer, len(self._buffer) - _OFFSET.size)
+        self._header = json.loads(self._buffer[header_offset:len(self._buffer) - _OFFSET.size])
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def version(self) -> any:
+        return self._header["version"]
+
+    @property
+    def groups(self) -> List[str]:
+        return list(self._header["groups"].keys())
+
+    def variable(self, group: _LocalGroup, default: any = None) -> 'SnapshotValue':
+        saved = self._header["groups"].get(f"{group.type}:{group.name}")
+        return SnapshotValue(default if saved is None else saved["value"])
+
+    def list(self, group: _LocalGroup, items: List[any] = None) -> MutableSequence:
+        saved = self._header["groups"].get(f"{group.type}:{group.name}")
+        if saved is None:
+            return [] if items is None else list(items)
+        return MappedList(self._buffer, saved["table"], saved["count"])
+
+
+class SnapshotValue:
+    __slots__ = ("_value",)
+
+    def __init__(self, value: any):
+        self._value = value
+
+    def get(self) -> any:
+        return self._value
+
+    def set(self, value: any):
+        self._value = value
+
+
+class MappedList(MutableSequence):
+    def __init__(self, buffer: mmap.mmap, table: int, count: int):
+        self._buffer = buffer
+        self._table = table
+        self._count = count
+        # None until the first change, so that restoring doesn't depend on the number of items. Afterwards it holds the
+        # index in the snapshot of every item still stored there, and the item itself in a tuple otherwise.
+        self._slots: Optional[List[any]] = None
+
+    def __len__(self) -> int:
+        return self._count if self._slots is None else len(self._slots)
+
+    def __iter__(self) -> Iterator[any]:
+        for i in range(len(self)):
+            yield self._get(i)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._get(i) for i in range(*index.indices(len(self)))]
+        return self._get(self._normalize_index(index))
+
+    def __setitem__(self, index: int, value: any):
+        index = self._normalize_index(index)
+        self._materialize()[index] = (value,)
+
+    def __delitem__(self, index: int):
+        index = self._normalize_index(index)
+        del self._materialize()[index]
+
+    def insert(self, index: int, value: any):
+        self._materialize().insert(index, (value,))
+
+    def _normalize_index(self, index: int) -> int:
+        if not -len(self) <= index < len(self):
+            raise IndexError("list index out of range")
+        return index + len(self) if index < 0 else index
+
+    def _materialize(self) -> List[any]:
+        if self._slots is None:
+            self._slots = list(range(self._count))
+        return self._slots
+
+    def _get(self, i: int) -> any:
+        if self._slots is None:
+            return self._load(i)
+
+        slot = self._slots[i]
+        if isinstance(slot, tuple):
+            return slot[0]
+        value = self._load(slot)
+        self._slots[i] = (value,)
+        return value
+
+    def _load(self, i: int) -> any:
+        start, end = struct.unpack_from("<2Q", self._buffer, self._table + _OFFSET.size * i)
+        return json.loads(self._buffer[start:end])
@@ -1,11 +1,17 @@
 import json
+import logging
+import time
+from collections import deque
 from json import JSONDecodeError
-from typing import Set, Dict
+from threading import BoundedSemaphore, Lock, Timer
+from typing import Set, Dict, Optional, List, Tuple, Deque, Hashable
+from weakref import WeakSet
 
 from channels.generic.websocket import WebsocketConsumer
 
-from socksync import socksync
+from socksync import socksync, profiling
 from socksync.errors import SockSyncErrors
+from socksync.utils import NameTrie, TokenBucket, json_depth_exceeds, encode_frame
 
 _Group = 'Group'
 _LocalGroup = 'LocalGroup'
@@ -14,37 +20,125 @@ _LocalVariable = 'LocalVariable'
 _LocalList = 'LocalList'
 _LocalFunction = 'LocalFunction'
 
+_logger = logging.getLogger(__name__)
+
+# Outgoing frames wait in one of these lanes, lower lanes are sent first.
+LANE_CONTROL, LANE_RPC, LANE_DELTA, LANE_BULK = range(4)
+
 
 class SockSyncSocket(WebsocketConsumer):
+    # Maximum number of remote function calls waiting for a return on this socket, None for no limit.
+    max_outstanding_calls: Optional[int] = None
+    # Limits on the messages received on this socket, None for no limit. Rate limits are token buckets given as
+    # (messages per second, burst), for all messages and per (type, func).
+    max_message_size: Optional[int] = None
+    max_message_depth: Optional[int] = None
+    rate_limit: Optional[Tuple[float, float]] = None
+    func_rate_limits: Dict[Tuple[str, str], Tuple[float, float]] = {}
+    # Seconds between pings, None to not send any. A socket that hasn't sent anything (like a pong) for
+    # heartbeat_timeout seconds, or that said it's idle, stops getting updates until it sends something again.
+    heartbeat_interval: Optional[float] = None
+    heartbeat_timeout: Optional[float] = None
+    # Lane of every outgoing func, anything not in here is a delta.
+    frame_lanes: Dict[str, int] = {
+        "error": LANE_CONTROL, "subscribe": LANE_CONTROL, "subscribe_many": LANE_CONTROL, "unsubscribe": LANE_CONTROL,
+        "unsubscribe_all": LANE_CONTROL, "get": LANE_CONTROL, "ping": LANE_CONTROL, "pong": LANE_CONTROL,
+        "idle": LANE_CONTROL, "active": LANE_CONTROL,
+        "call": LANE_RPC, "call_many": LANE_RPC, "return": LANE_RPC,
+        "set_all": LANE_BULK, "set_range": LANE_BULK, "extend": LANE_BULK
+    }
+    # Maximum number of items in a list set_all, the rest follow in extend frames. None to never split them.
+    bulk_chunk_size: Optional[int] = None
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        self._subscriber_groups: Set[_LocalGroup] = set()
-        self._subscription_groups: Set[_RemoteGroup] = set()
+        self._call_slots: Optional[BoundedSemaphore] = None
+        if self.max_outstanding_calls is not None:
+            self._call_slots = BoundedSemaphore(self.max_outstanding_calls)
+
+        self._rate_bucket: Optional[TokenBucket] = None
+        if self.rate_limit is not None:
+            self._rate_bucket = TokenBucket(*self.rate_limit)
+        self._func_buckets: Dict[Tuple[str, str], TokenBucket] = {}
+
+        self._last_received = time.monotonic()
+        # Why updates are held back: "idle" (the other side said so) or "timeout" (it stopped answering), None if not.
+        self._suspended: Optional[str] = None
+        self._suspend_lock = Lock()
+        self._heartbeat_timer: Optional[Timer] = None
+
+        # Frames queued by lane, and for each group how many of its frames are waiting in each lane. A frame never goes
+        # ahead of an earlier frame of the same group, it waits in the same lane instead.
+        self._lanes: List[Deque[Tuple[str, Optional[str], Optional[Hashable]]]] = [
+            deque() for _ in range(LANE_BULK + 1)]
+        self._queued: Dict[Hashable, List[int]] = {}
+        self._lanes_lock = Lock()
+        self._sending = False
+
+        self._subscriber_groups: Set[_LocalGroup] = WeakSet()
+        self._subscription_groups: Set[_RemoteGroup] = WeakSet()
 
-        self._registry: Dict[str, Dict[str, _LocalGroup]] = {"var": {}, "list": {}, "function": {}}
+        self._registry: Dict[str, Dict[str, _LocalGroup]] = {"var": {}, "list": {}, "function": {}, "stream": {}}
+        # Registered groups and pattern subscriptions ("prices.*") by name, so either side can find the other by prefix.
+        self._names: Dict[str, NameTrie] = {type_: NameTrie() for type_ in self._registry}
+        self._patterns: Dict[str, NameTrie] = {type_: NameTrie() for type_ in self._registry}
+        # Groups made by a group factory for this socket, with what to call once nobody is subscribed to them anymore.
+        self._created_groups: Dict[Tuple[str, str], Tuple[_LocalGroup, Optional[socksync.GroupRelease]]] = {}
 
     def register_group(self, var: _LocalGroup):
         self._registry[var.type][var.name] = var
+        self._names[var.type].add(var.name, var)
+        for request in list(self._patterns[var.type].prefixes_of(var.name)):
+            self._subscribe_matched(var, request)
+
+    def _unregister_group(self, group: _LocalGroup):
+        if self._registry[group.type].get(group.name) is group:
+            del self._registry[group.type][group.name]
+            self._names[group.type].discard(group.name)
 
     def connect(self):
         self.accept()
+        self._last_received = time.monotonic()
+        self._schedule_heartbeat()
         for handler in socksync._new_connection_handlers:
             handler(self)
 
     def disconnect(self, _):
+        if self._heartbeat_timer is not None:
+            self._heartbeat_timer.cancel()
+            self._heartbeat_timer = None
         self._remove_all_subscribers()
+        self._subscription_groups.clear()
         for r in self._registry.values():
+            for group in r.values():
+                group._socket_disconnected(self)
             r.clear()
+        for trie in [*self._names.values(), *self._patterns.values()]:
+            trie.clear()
 
     def receive(self, text_data: str = None, _=None):
+        self._last_received = time.monotonic()
+        if self.max_message_size is not None and len(text_data) > self.max_message_size:
+            self._send_error(SockSyncErrors.ERROR_OTHER, "Message is too large.")
+            return
+
+        if self._rate_bucket is not None and not self._rate_bucket.take():
+            self._send_error(SockSyncErrors.ERROR_OTHER, "Too many messages.")
+            return
+
+        if self.max_message_depth is not None and json_depth_exceeds(text_data, self.max_message_depth):
+            self._send_error(SockSyncErrors.ERROR_INVALID_JSON, "Message is nested too deeply.")
+            return
+
         try:
             request = json.loads(text_data)
-        except JSONDecodeError:
+        except (JSONDecodeError, RecursionError):
             self._send_error(SockSyncErrors.ERROR_INVALID_JSON, "Invalid json.")
             return
 
-        self._do_request(request)
+        with profiling.stage("dispatch", request.get("func") if isinstance(request, dict) else None):
+            self._do_request(request)
 
     def _do_request(self, request: dict):
         if "func" not in request:
@@ -53,13 +147,29 @@ class SockSyncSocket(WebsocketConsumer):
         else:
             func = request["func"]
 
-        if func == "error":
+        if func == "idle":
+            self._suspend("idle")
+            return
+
+        # Heartbeats only show the other side is still there, that doesn't mean it wants updates again after an idle.
+        if func not in ("ping", "pong") or self._suspended == "timeout":
+            self._resume()
+
+        if func == "ping":
+            self._send_json({"func": "pong"})
+            return
+
+        if func in ("pong", "active", "error"):
             return
 
         if func == "unsubscribe_all":
             self._remove_all_subscribers()
             return
 
+        if func == "subscribe_many":
+            self._subscribe_many(request)
+            return
+
         if "type" not in request:
             self._send_error(SockSyncErrors.ERROR_INVALID_TYPE, "type is required.")
             return
@@ -72,13 +182,137 @@ class SockSyncSocket(WebsocketConsumer):
         else:
             name = request["name"]
 
-        if type_ in self._registry:
-            if name in self._registry[type_]:
-                self._registry[type_][name]._handle_func(func, request, self)
+        if not self._take_func_token(type_, func):
+            self._send_error(SockSyncErrors.ERROR_OTHER, f"Too many {func} messages for {type_}.")
+            return
+
+        if type_ not in self._registry:
+            self._send_error(SockSyncErrors.ERROR_INVALID_TYPE, f"{type_} is not a valid type.")
+            return
+
+        group = self._registry[type_].get(name)
+        if group is None and func in ("subscribe", "get"):
+            group = self._create_group(type_, name)
+        if group is None:
+            self._send_error(SockSyncErrors.ERROR_INVALID_NAME, f"{name} is not registered.")
+            return
+
+        group._handle_func(func, request, self)
+        if (type_, name) in self._created_groups and not group._is_subscribed(self):
+            self._release_group(group)
+
+    def _create_group(self, type_: str, name: str) -> Optional[_LocalGroup]:
+        entry = socksync._find_group_factory(type_, name)
+        if entry is None:
+            return None
+
+        group = entry[2](self, name)
+        if group is None:
+            return None
+        self._created_groups[(type_, name)] = (group, entry[3])
+        self.register_group(group)
+        return group
+
+    def _release_group(self, group: _LocalGroup):
+        _, release = self._created_groups.pop((group.type, group.name))
+        self._unregister_group(group)
+        if release is not None and not group.subscribers:
+            release(group)
+
+    def _take_func_token(self, type_: str, func: str) -> bool:
+        limit = self.func_rate_limits.get((type_, func))
+        if limit is None:
+            return True
+
+        bucket = self._func_buckets.get((type_, func))
+        if bucket is None:
+            bucket = self._func_buckets[(type_, func)] = TokenBucket(*limit)
+        return bucket.take()
+
+    def _subscribe_many(self, request: dict):
+        if not isinstance(request.get("groups"), list):
+            self._send_error(SockSyncErrors.ERROR_MISSING_FIELD, "groups is required.")
+            return
+
+        for group_request in request["groups"]:
+            if not isinstance(group_request, dict):
+                self._send_error(SockSyncErrors.ERROR_OTHER, "groups must be a list of objects.")
+            elif isinstance(group_request.get("name"), str) and group_request["name"].endswith("*"):
+                self._subscribe_pattern(group_request)
             else:
-                self._send_error(SockSyncErrors.ERROR_INVALID_NAME, f"{name} is not registered.")
-        else:
+                self._do_request({**group_request, "func": "subscribe"})
+
+    def _subscribe_pattern(self, request: dict):
+        type_ = request.get("type")
+        if type_ not in self._patterns:
             self._send_error(SockSyncErrors.ERROR_INVALID_TYPE, f"{type_} is not a valid type.")
+            return
+
+        prefix = request["name"][:-1]
+        self._patterns[type_].add(prefix, request)
+        for group in list(self._names[type_].with_prefix(prefix)):
+            self._subscribe_matched(group, request)
+
+    def _subscribe_matched(self, group: _Group, request: dict):
+        # Patterns also match the remote groups registered on this socket, which can't be subscribed to.
+        if group._accepts("subscribe"):
+            group._handle_func("subscribe", {**request, "func": "subscribe", "name": group.name}, self)
+
+    def subscribe_many(self, groups: List[_RemoteGroup], snapshot: bool = True):
+        requests = []
+        for group in groups:
+            requests.append({**group._to_json(), **group._subscribe_args(snapshot)})
+            group._subscribed = True
+            self._add_subscription(group)
+        self._send_json({"func": "subscribe_many", "groups": requests})
+
+    def ping(self):
+        self._send_json({"func": "ping"})
+
+    def idle(self):
+        self._send_json({"func": "idle"})
+
+    def active(self):
+        self._send_json({"func": "active"})
+
+    @property
+    def suspended(self) -> bool:
+        return self._suspended is not None
+
+    def _schedule_heartbeat(self):
+        if self.heartbeat_interval is None:
+            return
+        self._heartbeat_timer = Timer(self.heartbeat_interval, self._heartbeat)
+        self._heartbeat_timer.daemon = True
+        self._heartbeat_timer.start()
+
+    def _heartbeat(self):
+        timeout = self.heartbeat_timeout if self.heartbeat_timeout is not None else 2 * self.heartbeat_interval
+        if time.monotonic() - self._last_received > timeout:
+            self._suspend("timeout")
+        self.ping()
+        if self._heartbeat_timer is not None:
+            self._schedule_heartbeat()
+
+    def _suspend(self, reason: str):
+        # The groups are told while still holding the lock, so a resume can't reach them before the suspend does.
+        with self._suspend_lock:
+            suspended = self._suspended is not None
+            # An idle socket stays idle even if it then stops answering.
+            if self._suspended != "idle":
+                self._suspended = reason
+            if suspended:
+                return
+            for group in list(self._subscriber_groups):
+                group._socket_suspended(self)
+
+    def _resume(self):
+        with self._suspend_lock:
+            if self._suspended is None:
+                return
+            self._suspended = None
+            for group in list(self._subscriber_groups):
+                group._socket_resumed(self)
 
     def unsubscribe_all(self):
         self._send_json({'func': "unsubscribe_all"})
@@ -88,21 +322,25 @@ class SockSyncSocket(WebsocketConsumer):
         self._subscription_groups.clear()
 
     def _remove_all_subscribers(self):
-        for group in self._subscriber_groups:
-            group._socket_unsubscribed(self)
+        for trie in self._patterns.values():
+            trie.clear()
+        for group in list(self._subscriber_groups):
+            group._socket_unsubscribed(None, self)
         self._subscriber_groups.clear()
+        for group, _ in list(self._created_groups.values()):
+            self._release_group(group)
 
     def _add_subscriber(self, group: _LocalGroup):
         self._subscriber_groups.add(group)
 
     def _remove_subscriber(self, group: _LocalGroup):
-        self._subscriber_groups.remove(group)
+        self._subscriber_groups.discard(group)
 
     def _add_subscription(self, group: _RemoteGroup):
         self._subscription_groups.add(group)
 
     def _remove_subscription(self, group: _RemoteGroup):
-        self._subscription_groups.remove(group)
+        self._subscription_groups.discard(group)
 
     def _send_error(self, error_code: int, message: str):
         self._send_json({
@@ -112,4 +350,37 @@ class SockSyncSocket(WebsocketConsumer):
         })
 
     def _send_json(self, data: dict):
-        self.send(json.dumps(data))
+        key = (data["type"], data["name"]) if "type" in data and "name" in data else None
+        self._send_encoded(encode_frame(data), data.get("func"), key)
+
+    def _send_encoded(self, text: str, func: str = None, key: Hashable = None):
+        lane = self.frame_lanes.get(func, LANE_DELTA)
+        with self._lanes_lock:
+            if key is not None:
+                queued = self._queued.setdefault(key, [0] * len(self._lanes))
+                lane = max([lane] + [i for i, count in enumerate(queued) if count > 0])
+                queued[lane] += 1
+            self._lanes[lane].append((text, func, key))
+            if self._sending:
+                return
+            self._sending = True
+
+        # Whoever finds nothing being sent sends everything queued, including what other threads queue meanwhile.
+        while True:
+            with self._lanes_lock:
+                lane = next((i for i, frames in enumerate(self._lanes) if frames), None)
+                if lane is None:
+                    self._sending = False
+                    return
+                text, func, key = self._lanes[lane].popleft()
+                if key is not None:
+                    queued = self._queued[key]
+                    queued[lane] -= 1
+                    if not any(queued):
+                        del self._queued[key]
+
+            try:
+                with profiling.stage("send", func):
+                    self.send(text)
+            except Exception:
+                _logger.exception("Sending a frame failed.")
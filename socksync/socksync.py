@@ -1,10 +1,20 @@
-from typing import Callable, Set
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Callable, Set, List, Tuple, Optional
 
 _SockSyncSocket = 'SockSyncSocket'
+_LocalGroup = 'LocalGroup'
 
 NewConnectionHandler = Callable[[_SockSyncSocket], None]
 _new_connection_handlers: Set[NewConnectionHandler] = set()
 
+GroupFactory = Callable[[_SockSyncSocket, str], Optional[_LocalGroup]]
+GroupRelease = Callable[[_LocalGroup], None]
+_group_factories: List[Tuple[str, str, GroupFactory, Optional[GroupRelease]]] = []
+
+# Sends the frames local groups queue, so the threads changing them never wait on a socket. None to send them on the
+# thread that changed the group instead.
+_sender: Optional[Executor] = ThreadPoolExecutor(thread_name_prefix="socksync-send")
+
 
 def add_new_connection_handler(on_new_connection: NewConnectionHandler):
     global _new_connection_handlers
@@ -16,4 +26,25 @@ def remove_new_connection_handler(on_new_connection: NewConnectionHandler):
     if on_new_connection in _new_connection_handlers:
         _new_connection_handlers.remove(on_new_connection)
 
-# TODO: filtering
+
+def set_sender(sender: Optional[Executor]):
+    global _sender
+    _sender = sender
+
+
+def add_group_factory(type_: str, name: str, factory: GroupFactory, release: GroupRelease = None):
+    global _group_factories
+    _group_factories.append((type_, name, factory, release))
+
+
+def remove_group_factory(factory: GroupFactory):
+    global _group_factories
+    _group_factories = [entry for entry in _group_factories if entry[2] is not factory]
+
+
+def _find_group_factory(type_: str, name: str) -> Optional[Tuple[str, str, GroupFactory, Optional[GroupRelease]]]:
+    for entry in _group_factories:
+        pattern = entry[1]
+        if entry[0] == type_ and (name == pattern or pattern.endswith("*") and name.startswith(pattern[:-1])):
+            return entry
+    return None
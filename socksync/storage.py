@@ -0,0 +1,313 @@
+import json
+from collections.abc import MutableSequence
+from threading import Thread, Event, RLock
+from typing import Dict, Optional, List, Iterator, Tuple
+from uuid import uuid4
+
+from socksync.utils import moved_index
+
+try:
+    from redis.exceptions import WatchError
+except ImportError:  # redis is only needed when a RedisStore is used with a real client
+    class WatchError(Exception):
+        pass
+
+_LocalGroup = 'LocalGroup'
+_Change = Tuple[str, Optional[int], any]
+
+# How many changes of a list are kept, so a worker that is behind can catch up without reloading the whole list.
+_LOG_LENGTH = 100
+
+
+def _encode(value: any) -> str:
+    return json.dumps(value, separators=(",", ":"))
+
+
+def _decode(value: Optional[bytes]) -> any:
+    return None if value is None else json.loads(value)
+
+
+class RedisStore:
+    def __init__(self, client, prefix: str = "socksync"):
+        self._client = client
+        self._prefix = prefix
+        self._id = str(uuid4())
+        self._channel = f"{prefix}:changes"
+        self._bindings: Dict[str, '_RedisBinding'] = {}
+
+        self._pubsub = client.pubsub()
+        self._pubsub.subscribe(self._channel)
+        self._listener: Optional[Thread] = None
+        self._stopped = Event()
+
+    def start(self):
+        if self._listener is not None:
+            return
+
+        self._stopped.clear()
+        self._listener = Thread(target=self._listen, daemon=True)
+        self._listener.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._listener is not None:
+            self._listener.join()
+            self._listener = None
+
+    def poll(self, timeout: float = 0):
+        while True:
+            message = self._pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+            if message is None:
+                return
+            self._handle_message(message)
+
+    def variable(self, group: _LocalGroup, default: any = None) -> 'RedisValue':
+        return self._bind(RedisValue(self, self._key(group), group, default))
+
+    def list(self, group: _LocalGroup, items: List[any] = None) -> 'RedisList':
+        return self._bind(RedisList(self, self._key(group), group, items))
+
+    def _key(self, group: _LocalGroup) -> str:
+        return f"{self._prefix}:{group.type}:{group.name}"
+
+    def _bind(self, binding: '_RedisBinding'):
+        self._bindings[binding.key] = binding
+        return binding
+
+    def _listen(self):
+        while not self._stopped.is_set():
+            message = self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            if message is not None:
+                self._handle_message(message)
+
+    def _publish(self, key: str, version: int, op: str, index: int = None, value: any = None):
+        self._client.publish(self._channel, _encode(
+            {"source": self._id, "key": key, "version": version, "op": op, "index": index, "value": value}))
+
+    def _handle_message(self, message: dict):
+        try:
+            data = json.loads(message["data"])
+        except (TypeError, ValueError):
+            return
+
+        if data.get("source") == self._id:
+            return
+        binding = self._bindings.get(data.get("key"))
+        if binding is not None:
+            binding._remote_change(data)
+
+
+class _RedisBinding:
+    def __init__(self, store: RedisStore, key: str, group: _LocalGroup):
+        self._store = store
+        self._client = store._client
+        self.key = key
+        self._group = group
+        self._lock = RLock()
+        self._version = 0
+
+    def _remote_change(self, data: dict):
+        pass
+
+
+class RedisValue(_RedisBinding):
+    def __init__(self, store: RedisStore, key: str, group: _LocalGroup, default: any = None):
+        super().__init__(store, key, group)
+        self._value = None
+        self._cached = False
+        self._client.hsetnx(key, "value", _encode(default))
+
+    def get(self) -> any:
+        with self._lock:
+            if not self._cached:
+                value, version = self._client.hmget(self.key, ["value", "version"])
+                self._value = _decode(value)
+                self._version = int(version or 0)
+                self._cached = True
+            return self._value
+
+    def set(self, value: any):
+        with self._lock:
+            pipe = self._client.pipeline()
+            pipe.hset(self.key, "value", _encode(value))
+            pipe.hincrby(self.key, "version", 1)
+            _, version = pipe.execute()
+            self._value = value
+            self._version = version
+            self._cached = True
+        self._store._publish(self.key, version, "set")
+
+    def _remote_change(self, data: dict):
+        with self._lock:
+            self._cached = False
+        self._group._store_changed("set")
+
+
+class RedisList(_RedisBinding, MutableSequence):
+    def __init__(self, store: RedisStore, key: str, group: _LocalGroup, items: List[any] = None):
+        super().__init__(store, key, group)
+        self._version_key = f"{key}:version"
+        self._log_key = f"{key}:log"
+        # Local copy of the list, None until it is read. Kept in sync with changes from other workers as long as no
+        # version is skipped, otherwise it's dropped and loaded again.
+        self._items: Optional[List[any]] = None
+        # Set when a write had to skip changes the group hasn't been told about yet.
+        self._reload = False
+
+        if self._client.setnx(self._version_key, 0) and items:
+            self._client.rpush(key, *(_encode(item) for item in items))
+
+    def __len__(self) -> int:
+        return len(self._cache())
+
+    def __iter__(self) -> Iterator[any]:
+        return iter(list(self._cache()))
+
+    def __getitem__(self, index):
+        return self._cache()[index]
+
+    def __setitem__(self, index: int, value: any):
+        with self._lock:
+            self._write("set", self._normalize_index(index), value)
+
+    def __delitem__(self, index: int):
+        with self._lock:
+            self._write("delete", self._normalize_index(index))
+
+    def insert(self, index: int, value: any):
+        with self._lock:
+            length = len(self._cache())
+            self._write("insert", max(0, min(index + length if index < 0 else index, length)), value)
+
+    def catch_up(self) -> Iterator[_Change]:
+        # Applies the changes other workers made that haven't reached this one yet, one at a time. Each is yielded once
+        # it's in the items, so it can be passed on before the next one changes them again.
+        with self._lock:
+            if self._reload:
+                self._reload = False
+                yield "reload", None, None
+                return
+            if self._items is None or int(self._client.get(self._version_key) or 0) == self._version:
+                return
+
+            changes = self._missed_changes(self._client)
+            if changes is None:
+                self._items = None
+                yield "reload", None, None
+                return
+            for version, op, at, value in changes:
+                self._change(op, at, value)
+                self._version = version
+                yield op, at, value
+
+    def _normalize_index(self, index: int) -> int:
+        length = len(self._cache())
+        if not -length <= index < length:
+            raise IndexError("list index out of range")
+        return index + length if index < 0 else index
+
+    def _write(self, op: str, index: int, value: any = None):
+        with self._client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(self.key, self._version_key, self._log_key)
+                    # A change of another worker can still slip in after the group caught up, the index is then
+                    # moved past it and the group reloads once the write is done.
+                    version = int(pipe.get(self._version_key) or 0) + 1
+                    skipped = version != self._version + 1
+                    length = len(self._items)
+                    if skipped:
+                        for _, change_op, at, _ in self._missed_changes(pipe) or []:
+                            index = moved_index(index, change_op, at, op == "insert")
+                            if index is None:
+                                raise IndexError("list item was deleted by another worker")
+                        length = pipe.llen(self.key)
+                    self._queue_write(pipe, version, op, index, value, length)
+                    pipe.execute()
+                    break
+                except WatchError:
+                    continue
+
+            if skipped:
+                self._items = None
+                self._reload = True
+            else:
+                self._change(op, index, value)
+                self._version = version
+        self._store._publish(self.key, version, op, index, value)
+
+    def _queue_write(self, pipe, version: int, op: str, index: int, value: any, length: int):
+        # Redis can't insert or delete by index, so everything before or after the index is moved, whichever is less.
+        # At either end nothing has to be moved.
+        end = length if op == "insert" else length - 1
+        moved = op != "set" and 0 < index < end
+        head = pipe.lrange(self.key, 0, index - 1) if moved and index <= length // 2 else []
+        tail = pipe.lrange(self.key, index, -1) if moved and not head else []
+        pipe.multi()
+        if op == "set":
+            pipe.lset(self.key, index, _encode(value))
+        elif op == "insert" and index == 0:
+            pipe.lpush(self.key, _encode(value))
+        elif op == "insert" and index == end:
+            pipe.rpush(self.key, _encode(value))
+        elif index == 0:
+            pipe.lpop(self.key)
+        elif index == end:
+            pipe.rpop(self.key)
+        elif head:
+            pipe.ltrim(self.key, index if op == "insert" else index + 1, -1)
+            head = [*head, _encode(value)] if op == "insert" else head
+            pipe.lpush(self.key, *reversed(head))
+        else:
+            pipe.ltrim(self.key, 0, index - 1)
+            tail = [_encode(value), *tail] if op == "insert" else tail[1:]
+            if tail:
+                pipe.rpush(self.key, *tail)
+        pipe.incr(self._version_key)
+        pipe.rpush(self._log_key, _encode({"version": version, "op": op, "index": index, "value": value}))
+        pipe.ltrim(self._log_key, -_LOG_LENGTH, -1)
+
+    def _missed_changes(self, client) -> Optional[List[Tuple[int, str, Optional[int], any]]]:
+        # None when the log doesn't go back far enough.
+        entries = [_decode(entry) for entry in client.lrange(self._log_key, 0, -1)]
+        changes = [(e["version"], e["op"], e["index"], e["value"]) for e in entries if e["version"] > self._version]
+        if not changes or changes[0][0] != self._version + 1:
+            return None
+        return changes
+
+    def _change(self, op: str, index: int, value: any):
+        if op == "set":
+            self._items[index] = value
+        elif op == "insert":
+            self._items.insert(index, value)
+        else:
+            self._items.pop(index)
+
+    def _cache(self) -> List[any]:
+        with self._lock:
+            if self._items is None:
+                pipe = self._client.pipeline()
+                pipe.lrange(self.key, 0, -1)
+                pipe.get(self._version_key)
+                items, version = pipe.execute()
+                self._items = [_decode(item) for item in items]
+                self._version = int(version or 0)
+            return self._items
+
+    def _remote_change(self, data: dict):
+        # The group is locked first, like it is when it writes, so its items don't change while it's sending them.
+        with self._group._locked(), self._lock:
+            op, index, value = data["op"], data.get("index"), data.get("value")
+            if self._items is not None and not self._reload and data["version"] <= self._version:
+                # Caught up with it before writing.
+                return
+
+            if self._items is None or self._reload or data["version"] != self._version + 1 or \
+                    op not in ("set", "insert", "delete"):
+                self._items = None
+                self._reload = False
+                op = "reload"
+            else:
+                self._change(op, index, value)
+                self._version = data["version"]
+            self._group._store_changed(op, index, value)
@@ -1,2 +1,211 @@
+import json
+import operator
+import re
+import time
+from typing import Callable, Dict, Any, Iterator, Optional
+
+from socksync import profiling
+
+
 def dict_without_none(d: dict) -> dict:
     return {k: v for k, v in d.items() if v is not None}
+
+
+def encode_frame(frame: dict) -> str:
+    with profiling.stage("encode", frame.get("func")):
+        return json.dumps(frame)
+
+
+_JSON_SPECIAL = re.compile(r'[\[\]{}"\\]')
+
+
+def json_depth_exceeds(text: str, max_depth: int) -> bool:
+    # Counting brackets is enough to rule out most messages without looking at them any closer.
+    if text.count("[") + text.count("{") <= max_depth:
+        return False
+
+    # A single pass over the characters that matter, brackets inside strings don't count.
+    depth = 0
+    in_string = False
+    escaped = -1
+    for match in _JSON_SPECIAL.finditer(text):
+        c = match.group()
+        if in_string:
+            if match.start() == escaped:
+                continue
+            if c == "\\":
+                escaped = match.start() + 1
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c == "[" or c == "{":
+            depth += 1
+            if depth > max_depth:
+                return True
+        elif c == "]" or c == "}":
+            depth -= 1
+    return False
+
+
+def moved_index(index: int, op: str, at: int, inserting: bool) -> Optional[int]:
+    # Where an index taken before another worker changed the list points to after it, None if its item was deleted.
+    if op == "insert" and at <= index:
+        return index + 1
+    if op == "delete" and at < index:
+        return index - 1
+    if op == "delete" and at == index and not inserting:
+        return None
+    return index
+
+
+def get_path(value: any, path: Optional[str]) -> any:
+    if path is None:
+        return value
+
+    for part in path.split("."):
+        if isinstance(value, dict):
+            value = value.get(part)
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return None
+    return value
+
+
+class ListFilter:
+    __slots__ = ("_conditions", "_expression", "_key")
+
+    OPERATORS: Dict[str, Callable[[Any, Any], bool]] = {
+        "eq": operator.eq,
+        "ne": operator.ne,
+        "lt": operator.lt,
+        "lte": operator.le,
+        "gt": operator.gt,
+        "gte": operator.ge,
+        "in": lambda a, b: a in b
+    }
+
+    def __init__(self, expression: dict):
+        if not isinstance(expression, dict):
+            raise ValueError("filter must be an object.")
+
+        self._conditions = []
+        for field, condition in expression.items():
+            if not isinstance(condition, dict):
+                condition = {"eq": condition}
+            for op, value in condition.items():
+                if op not in self.OPERATORS:
+                    raise ValueError(f"{op} is not a valid filter operator.")
+                if op == "in" and not isinstance(value, list):
+                    raise ValueError(f"{field}.in must be a list.")
+                self._conditions.append((field, self.OPERATORS[op], value))
+
+        self._expression = expression
+        self._key = json.dumps(expression, sort_keys=True)
+
+    @property
+    def expression(self) -> dict:
+        return self._expression
+
+    @property
+    def key(self) -> str:
+        return self._key
+
+    def matches(self, item: any) -> bool:
+        if not isinstance(item, dict):
+            return False
+
+        for field, op, value in self._conditions:
+            if field not in item:
+                return False
+            try:
+                if not op(item[field], value):
+                    return False
+            except TypeError:
+                return False
+        return True
+
+
+class _TrieNode:
+    __slots__ = ("children", "value", "has_value")
+
+    def __init__(self):
+        self.children: Dict[str, _TrieNode] = {}
+        self.value = None
+        self.has_value = False
+
+
+class NameTrie:
+    __slots__ = ("_root",)
+
+    def __init__(self):
+        self._root = _TrieNode()
+
+    def add(self, key: str, value: any):
+        node = self._root
+        for c in key:
+            node = node.children.setdefault(c, _TrieNode())
+        node.value = value
+        node.has_value = True
+
+    def discard(self, key: str):
+        path = [self._root]
+        for c in key:
+            if c not in path[-1].children:
+                return
+            path.append(path[-1].children[c])
+
+        path[-1].value = None
+        path[-1].has_value = False
+        for i in range(len(key), 0, -1):
+            if path[i].has_value or path[i].children:
+                break
+            del path[i - 1].children[key[i - 1]]
+
+    def clear(self):
+        self._root = _TrieNode()
+
+    def with_prefix(self, prefix: str) -> Iterator[any]:
+        node = self._root
+        for c in prefix:
+            node = node.children.get(c)
+            if node is None:
+                return
+
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.has_value:
+                yield node.value
+            stack.extend(node.children.values())
+
+    def prefixes_of(self, key: str) -> Iterator[any]:
+        node = self._root
+        if node.has_value:
+            yield node.value
+        for c in key:
+            node = node.children.get(c)
+            if node is None:
+                return
+            if node.has_value:
+                yield node.value
+
+
+class TokenBucket:
+    __slots__ = ("_rate", "_burst", "_tokens", "_updated")
+
+    def __init__(self, rate: float, burst: float):
+        self._rate = rate
+        self._burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+
+    def take(self, tokens: float = 1) -> bool:
+        now = time.monotonic()
+        self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+        if self._tokens < tokens:
+            return False
+        self._tokens -= tokens
+        return True
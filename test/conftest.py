@@ -1,10 +1,20 @@
 from pytest import fixture
 
+from socksync import socksync
 from socksync.groups import LocalFunction, LocalVariable, LocalList, RemoteFunction, RemoteVariable, RemoteList
 from socksync.sockets import SockSyncSocket
 from test import helpers
 
 
+@fixture(autouse=True)
+def inline_sends():
+    # Frames are sent right away, so each test can check them as soon as a group changed.
+    sender = socksync._sender
+    socksync.set_sender(None)
+    yield
+    socksync.set_sender(sender)
+
+
 @fixture
 def socket(mocker):
     mocker.patch("channels.generic.websocket.WebsocketConsumer.send")
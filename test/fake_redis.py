@@ -0,0 +1,167 @@
+from collections import deque
+from typing import Dict, List
+
+
+def _bytes(value) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode()
+
+
+class FakeRedisServer:
+    def __init__(self):
+        self.data: Dict[str, any] = {}
+        self.subscribers: List['FakePubSub'] = []
+
+
+class FakeRedis:
+    def __init__(self, server: FakeRedisServer = None):
+        self.server = server or FakeRedisServer()
+
+    @property
+    def _data(self):
+        return self.server.data
+
+    def exists(self, key):
+        return int(key in self._data)
+
+    def delete(self, key):
+        return int(self._data.pop(key, None) is not None)
+
+    def get(self, key):
+        return self._data.get(key)
+
+    def setnx(self, key, value):
+        if key in self._data:
+            return False
+        self._data[key] = _bytes(value)
+        return True
+
+    def incr(self, key):
+        value = int(self._data.get(key, 0)) + 1
+        self._data[key] = _bytes(value)
+        return value
+
+    def hsetnx(self, key, field, value):
+        h = self._data.setdefault(key, {})
+        if field in h:
+            return 0
+        h[field] = _bytes(value)
+        return 1
+
+    def hset(self, key, field, value):
+        self._data.setdefault(key, {})[field] = _bytes(value)
+        return 1
+
+    def hmget(self, key, fields):
+        h = self._data.get(key, {})
+        return [h.get(f) for f in fields]
+
+    def hincrby(self, key, field, amount=1):
+        h = self._data.setdefault(key, {})
+        h[field] = _bytes(int(h.get(field, 0)) + amount)
+        return int(h[field])
+
+    def _list(self, key) -> list:
+        return self._data.setdefault(key, [])
+
+    def rpush(self, key, *values):
+        lst = self._list(key)
+        lst.extend(_bytes(v) for v in values)
+        return len(lst)
+
+    def lpush(self, key, *values):
+        lst = self._list(key)
+        lst[:0] = [_bytes(v) for v in reversed(values)]
+        return len(lst)
+
+    def lpop(self, key):
+        lst = self._data.get(key)
+        return lst.pop(0) if lst else None
+
+    def rpop(self, key):
+        lst = self._data.get(key)
+        return lst.pop() if lst else None
+
+    def llen(self, key):
+        return len(self._data.get(key, []))
+
+    def lrange(self, key, start, end):
+        lst = self._data.get(key, [])
+        end = len(lst) if end == -1 else end + 1
+        return list(lst[start:end])
+
+    def ltrim(self, key, start, end):
+        if key in self._data:
+            lst = self._data[key]
+            end = len(lst) if end == -1 else end + 1
+            self._data[key] = lst[start:end]
+        return True
+
+    def lset(self, key, index, value):
+        self._data[key][index] = _bytes(value)
+        return True
+
+    def publish(self, channel, message):
+        for pubsub in self.server.subscribers:
+            if channel in pubsub.channels:
+                pubsub.messages.append({"type": "message", "channel": _bytes(channel), "data": _bytes(message)})
+        return len(self.server.subscribers)
+
+    def pubsub(self):
+        return FakePubSub(self.server)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, client: FakeRedis):
+        self._client = client
+        self._buffered = True
+        self._commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.reset()
+
+    def __getattr__(self, name):
+        command = getattr(self._client, name)
+
+        def call(*args, **kwargs):
+            if not self._buffered:
+                return command(*args, **kwargs)
+            self._commands.append((command, args, kwargs))
+            return self
+
+        return call
+
+    def watch(self, *keys):
+        self._buffered = False
+
+    def multi(self):
+        self._buffered = True
+
+    def execute(self):
+        results = [command(*args, **kwargs) for command, args, kwargs in self._commands]
+        self.reset()
+        return results
+
+    def reset(self):
+        self._commands = []
+        self._buffered = True
+
+
+class FakePubSub:
+    def __init__(self, server: FakeRedisServer):
+        self.channels = set()
+        self.messages = deque()
+        server.subscribers.append(self)
+
+    def subscribe(self, *channels):
+        self.channels.update(channels)
+
+    def get_message(self, ignore_subscribe_messages=False, timeout=0.0):
+        return self.messages.popleft() if self.messages else None
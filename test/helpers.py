@@ -1,6 +1,8 @@
 import json
+from collections import deque
 
 from socksync.groups import Group
+from socksync.sockets import SockSyncSocket
 from socksync.utils import dict_without_none
 
 
@@ -70,3 +72,24 @@ def init_remote_list(socket, remote_list, assert_success=True):
     if assert_success:
         assert_no_send(socket)
         reset_send(socket)
+
+
+class _LoopbackSocket(SockSyncSocket):
+    def send(self, text_data=None, bytes_data=None, close=False):
+        self.frames.append((self.peer, text_data))
+
+
+def socket_pair():
+    # Two sockets connected to each other. Frames wait in the returned queue until deliver is called, the same way they
+    # would wait on the network.
+    frames = deque()
+    a, b = _LoopbackSocket(scope=None), _LoopbackSocket(scope=None)
+    a.peer, b.peer = b, a
+    a.frames = b.frames = frames
+    return a, b, frames
+
+
+def deliver(frames):
+    while frames:
+        socket, text = frames.popleft()
+        socket.receive(text)
@@ -0,0 +1,134 @@
+import random
+from threading import Thread
+
+from socksync.computed import Sum, Count, Min, Max, TopK, ComputedVariable, ComputedList, DerivedVariable
+from socksync.groups import LocalList, LocalVariable, SortedLocalList
+from test import helpers
+
+
+def _subscribe(socket, group, args: dict = None):
+    socket.register_group(group)
+    helpers.receive_group_func(socket, "subscribe", group, args)
+    return group
+
+
+def test_aggregators_follow_changes():
+    aggregators = {"sum": Sum(), "count": Count(lambda v: v % 2 == 0), "min": Min(), "max": Max(), "top": TopK(3)}
+    lst = LocalList("l", [5, 3, 8])
+    computed = {name: ComputedVariable(name, lst, aggregator) for name, aggregator in aggregators.items()}
+
+    rng = random.Random(1)
+    for _ in range(300):
+        op = rng.random()
+        if op < 0.5 or len(list(lst.items)) == 0:
+            lst.insert(rng.randint(0, len(list(lst.items))), rng.randint(0, 50))
+        elif op < 0.75:
+            lst.delete(rng.randrange(len(list(lst.items))))
+        else:
+            lst.set(rng.randrange(len(list(lst.items))), rng.randint(0, 50))
+
+        items = list(lst.items)
+        assert computed["sum"].value == sum(items)
+        assert computed["count"].value == len([v for v in items if v % 2 == 0])
+        assert computed["min"].value == (min(items) if items else None)
+        assert computed["max"].value == (max(items) if items else None)
+        assert computed["top"].value == sorted(items, reverse=True)[:3]
+
+
+def test_aggregator_key():
+    lst = LocalList("l", [{"price": 2}, {"price": 5}])
+    total = ComputedVariable("total", lst, Sum(lambda item: item["price"]))
+    cheapest = ComputedVariable("cheapest", lst, Min(lambda item: item["price"]))
+    lst.append({"price": 1})
+    assert total.value == 8
+    assert cheapest.value == 1
+
+
+def test_computed_variable_only_sends_changes(socket):
+    lst = LocalList("l", [1, 5])
+    highest = _subscribe(socket, ComputedVariable("max", lst, Max()))
+    lst.append(3)
+    helpers.assert_no_send(socket)
+    lst.append(7)
+    helpers.assert_send_group_func(socket, "set", highest, {"value": 7})
+    lst.delete(3)
+    helpers.assert_send_group_func(socket, "set", highest, {"value": 5})
+
+
+def test_computed_variable_reload():
+    lst = SortedLocalList("l", [3, 1, 2])
+    total = ComputedVariable("sum", lst, Sum())
+    with lst._locked():
+        lst._items.append(5)
+        lst._mutated("reload", None, None, list(lst._items))
+        lst.add(4)
+    assert total.value == 15
+    lst.remove(1)
+    assert total.value == 14
+
+
+def test_computed_list_top_k(socket):
+    lst = LocalList("l", [5, 1, 3])
+    top = _subscribe(socket, ComputedList("top", lst, TopK(2)), {"get": {"page": 0, "page_size": 2}})
+    helpers.assert_send_group_func(socket, "set_all", top,
+                                   {"page": 0, "page_size": 2, "total_item_count": 2, "items": [5, 3]})
+
+    lst.append(4)
+    assert list(top.items) == [5, 4]
+    helpers.assert_send_group_func(socket, "set_count", top, {"total_item_count": 1}, True)
+    helpers.assert_send_group_func(socket, "delete", top, {"index": 1}, True)
+    helpers.assert_send_group_func(socket, "set_count", top, {"total_item_count": 2}, True)
+    helpers.assert_send_group_func(socket, "insert", top, {"index": 1, "value": 4})
+
+    lst.append(0)
+    helpers.assert_no_send(socket)
+
+    lst.delete(0)
+    assert list(top.items) == [4, 3]
+    lst.delete(0)
+    lst.delete(0)
+    lst.delete(0)
+    assert list(top.items) == [0]
+
+
+def test_derived_variable(socket):
+    a = LocalVariable("a", 1)
+    lst = LocalList("l", [1, 2])
+    derived = _subscribe(socket, DerivedVariable("d", [a, lst], lambda: a.value * len(list(lst.items))))
+    assert derived.value == 2
+
+    a.value = 3
+    helpers.assert_send_group_func(socket, "set", derived, {"value": 6})
+    lst.set(0, 10)
+    helpers.assert_no_send(socket)
+    lst.append(3)
+    helpers.assert_send_group_func(socket, "set", derived, {"value": 9})
+
+
+def test_mutation_listener_error(f):
+    lst = LocalList("l")
+
+    def fail(*_):
+        raise ValueError()
+
+    lst.add_mutation_listener(fail)
+    lst.add_mutation_listener(f)
+    lst.append(1)
+    f.assert_called_once_with("insert", 0, None, 1)
+    lst.remove_mutation_listener(f)
+    lst.append(2)
+    f.assert_called_once()
+
+
+def test_derived_variable_from_two_threads():
+    a = LocalList("a")
+    b = LocalList("b")
+    total = DerivedVariable("total", [a, b], lambda: sum(a.items) + sum(b.items))
+
+    threads = [Thread(target=lambda lst=lst: [lst.append(1) for _ in range(300)], daemon=True) for lst in (a, b)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+    assert not any(t.is_alive() for t in threads)
+    assert total.value == 600
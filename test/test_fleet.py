@@ -0,0 +1,88 @@
+import asyncio
+import json
+
+import pytest
+
+from socksync.errors import SockSyncErrors
+from socksync.fleet import FleetFunction, FleetVariable
+from socksync.sockets import SockSyncSocket
+from test import helpers
+
+
+@pytest.fixture
+def sockets(socket):
+    return [socket, SockSyncSocket(scope=None), SockSyncSocket(scope=None)]
+
+
+def _return(socket, value):
+    id_ = next(iter(socket._registry["function"]["f"]._calls))
+    helpers.receive_func(socket, "return", "function", "f", {"id": id_, "value": value})
+
+
+def test_fleet_function_sends_every_call_first(sockets):
+    fleet = FleetFunction("f", sockets)
+    helpers.reset_send(sockets[0])
+    completed = fleet.as_completed(timeout=5, x=1)
+    frames = [json.loads(call[0][0]) for call in sockets[0].send.call_args_list]
+    assert [frame["func"] for frame in frames] == ["call"] * 3
+    assert all(frame["args"] == {"x": 1} for frame in frames)
+
+    _return(sockets[1], 1)
+    _return(sockets[0], 0)
+    sockets[2].disconnect(None)
+    results = {socket: future for socket, future in completed}
+    assert results[sockets[0]].result() == 0
+    assert results[sockets[1]].result() == 1
+    assert isinstance(results[sockets[2]].exception(), ConnectionError)
+
+
+def test_fleet_function_deadline(sockets):
+    fleet = FleetFunction("f", sockets)
+    helpers.reset_send(sockets[0])
+    result = fleet.call(timeout=0.01)
+    assert not result.complete
+    assert result.results == {}
+    assert set(result.missing) == set(sockets)
+    assert all(not socket._registry["function"]["f"]._calls for socket in sockets)
+
+    helpers.reset_send(sockets[0])
+    helpers.receive_func(sockets[0], "return", "function", "f", {"id": "late", "value": 1})
+    helpers.assert_send_error(sockets[0], SockSyncErrors.ERROR_BAD_ID)
+
+
+def test_fleet_function_call_async(sockets):
+    fleet = FleetFunction("f", sockets)
+
+    async def call():
+        task = asyncio.ensure_future(fleet.call_async(timeout=0.05))
+        await asyncio.sleep(0)
+        _return(sockets[0], 0)
+        _return(sockets[1], 1)
+        return await task
+
+    result = asyncio.run(call())
+    assert result.results == {sockets[0]: 0, sockets[1]: 1}
+    assert result.missing == [sockets[2]]
+    assert result.errors == {}
+
+
+def test_fleet_variable(sockets, mocker):
+    helpers.reset_send(sockets[0])
+    fleet = FleetVariable("v", sockets[:2])
+    assert sockets[0].send.call_count == 2
+    listener = mocker.stub()
+    fleet.add_change_listener(listener)
+
+    helpers.receive_func(sockets[0], "set", "var", "v", {"value": 1})
+    listener.assert_called_once_with(fleet, sockets[0])
+    assert fleet.values == {sockets[0]: 1, sockets[1]: None}
+
+    fleet.remove_socket(sockets[0])
+    helpers.receive_func(sockets[0], "set", "var", "v", {"value": 2})
+    listener.assert_called_once()
+    assert fleet.values == {sockets[1]: None}
+
+    fleet.add_socket(sockets[0])
+    fleet.add_socket(sockets[0])
+    helpers.receive_func(sockets[0], "set", "var", "v", {"value": 3})
+    assert listener.call_count == 2
@@ -1,8 +1,18 @@
+import asyncio
 import json
 import time
-from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Event
+from weakref import WeakKeyDictionary
 
+import pytest
+
+from socksync import socksync
 from socksync.errors import SockSyncErrors
+from socksync.groups import LocalVariable, LocalList, SortedLocalList, KeyedLocalList, RemoteVariable, RemoteList, \
+    RemoteFunction, LocalFunction, LocalStream, RemoteStream
+from socksync.sockets import SockSyncSocket
+from socksync.utils import ListFilter
 from test import helpers
 
 
@@ -39,6 +49,59 @@ def test_subscribe_local(socket, local_groups):
         helpers.assert_no_send(socket)
 
 
+def test_constructor_subscribe_snapshot_remote(socket):
+    var = RemoteVariable("test", socket)
+    helpers.assert_send_group_func(socket, "subscribe", var, {"get": {}})
+
+    lst = RemoteList("test", socket, 5, filter_={"side": "buy"})
+    helpers.assert_send_group_func(socket, "subscribe", lst,
+                                   {"get": {"page": 0, "page_size": 5, "filter": {"side": "buy"}}})
+
+    fun = RemoteFunction("test", socket)
+    helpers.assert_send_group_func(socket, "subscribe", fun)
+
+
+def test_subscribe_snapshot_remote_list(socket, remote_list):
+    remote_list.get_range(2, 3)
+    helpers.receive_group_func(socket, "set_all", remote_list, {"offset": 2, "limit": 3, "total_item_count": 10,
+                                                                "items": [2, 3, 4]})
+    remote_list.unsubscribe()
+    helpers.reset_send(socket)
+    remote_list.subscribe(snapshot=True)
+    helpers.assert_send_group_func(socket, "subscribe", remote_list, {"get": {"offset": 2, "limit": 3}})
+
+
+def test_subscribe_snapshot_local(socket):
+    var = LocalVariable("test", 10)
+    lst = LocalList("test", [1, 2, 3])
+    socket.register_group(var)
+    socket.register_group(lst)
+
+    helpers.receive_group_func(socket, "subscribe", var, {"get": {}})
+    assert socket in var.subscribers
+    helpers.assert_send_group_func(socket, "set", var, {"value": 10})
+
+    helpers.receive_group_func(socket, "subscribe", lst, {"get": {"page": 0, "page_size": 2}})
+    assert socket in lst.subscribers
+    helpers.assert_send_group_func(socket, "set_all", lst,
+                                   {"page": 0, "page_size": 2, "total_item_count": 3, "items": [1, 2]})
+
+    lst.insert(0, 0)
+    helpers.assert_send_group_func(socket, "set_count", lst, {"total_item_count": 4}, True)
+    helpers.assert_send_group_func(socket, "delete", lst, {"index": 1}, True)
+    helpers.assert_send_group_func(socket, "insert", lst, {"index": 0, "value": 0})
+
+
+def test_subscribe_snapshot_local_invalid(socket, local_function_unsubscribed, local_variable_unsubscribed):
+    helpers.receive_group_func(socket, "subscribe", local_function_unsubscribed, {"get": {}})
+    helpers.assert_send_error(socket, SockSyncErrors.ERROR_INVALID_FUNC)
+    assert socket in local_function_unsubscribed.subscribers
+
+    helpers.receive_group_func(socket, "subscribe", local_variable_unsubscribed, {"get": 1})
+    helpers.assert_send_error(socket, SockSyncErrors.ERROR_OTHER)
+    assert socket in local_variable_unsubscribed.subscribers
+
+
 def test_unsubscribe_local(socket, local_groups):
     for group in local_groups:
         socket.register_group(group)
@@ -82,6 +145,91 @@ def test_local_variable_set(socket, local_variable):
     helpers.assert_send_group_func(socket, "set", local_variable, {"value": 20})
 
 
+def _path_variable(socket, path: str = "balances.BTC"):
+    var = LocalVariable("test", {"balances": {"BTC": 1, "ETH": 2}, "orders": [{"id": 1}]})
+    socket.register_group(var)
+    helpers.receive_group_func(socket, "subscribe", var, {"path": path})
+    return var
+
+
+def test_local_variable_path_get(socket):
+    var = _path_variable(socket)
+    helpers.receive_group_func(socket, "get", var)
+    helpers.assert_send_group_func(socket, "set", var, {"value": 1, "path": "balances.BTC"})
+    helpers.receive_group_func(socket, "get", var, {"path": "orders.0.id"})
+    helpers.assert_send_group_func(socket, "set", var, {"value": 1, "path": "orders.0.id"})
+    helpers.receive_group_func(socket, "get", var, {"path": "balances.XRP"})
+    helpers.assert_send_group_func(socket, "set", var, {"value": None, "path": "balances.XRP"})
+    helpers.receive_group_func(socket, "get", var, {"path": 1})
+    helpers.assert_send_error(socket, SockSyncErrors.ERROR_OTHER)
+
+
+def test_local_variable_path_subscribe_snapshot(socket):
+    var = LocalVariable("test", {"a": {"b": 1}})
+    socket.register_group(var)
+    helpers.receive_group_func(socket, "subscribe", var, {"path": "a", "get": {}})
+    helpers.assert_send_group_func(socket, "set", var, {"value": {"b": 1}, "path": "a"})
+
+
+def test_local_variable_path_set(socket):
+    var = _path_variable(socket)
+    whole = SockSyncSocket(scope=None)
+    whole.register_group(var)
+    helpers.receive_group_func(whole, "subscribe", var)
+
+    var.value = {"balances": {"BTC": 1, "ETH": 3}}
+    helpers.assert_send_group_func(socket, "set", var, {"value": {"balances": {"BTC": 1, "ETH": 3}}})
+
+    var.value = {"balances": {"BTC": 2, "ETH": 3}}
+    frames = [json.loads(c[0][0]) for c in socket.send.call_args_list]
+    assert {f.get("path"): f["value"] for f in frames} == {"balances.BTC": 2,
+                                                           None: {"balances": {"BTC": 2, "ETH": 3}}}
+    helpers.reset_send(socket)
+
+
+def test_local_variable_path_set_in_place(socket):
+    var = _path_variable(socket)
+    value = var.value
+    value["balances"]["BTC"] = 5
+    var.value = value
+    helpers.assert_send_group_func(socket, "set", var, {"value": 5, "path": "balances.BTC"})
+    var.value = value
+    helpers.assert_no_send(socket)
+
+
+def test_local_variable_path_encoded_once(socket, mocker):
+    var = _path_variable(socket)
+    others = [SockSyncSocket(scope=None) for _ in range(3)]
+    for other in others:
+        other.register_group(var)
+        helpers.receive_group_func(other, "subscribe", var, {"path": "balances.BTC"})
+
+    dumps = mocker.spy(json, "dumps")
+    var.value = {"balances": {"BTC": 2}}
+    assert dumps.call_count == 2
+    assert socket.send.call_count == 4
+
+
+def test_local_variable_path_resubscribe(socket):
+    var = _path_variable(socket)
+    helpers.receive_group_func(socket, "subscribe", var)
+    var.value = {"balances": {"BTC": 1}}
+    helpers.assert_send_group_func(socket, "set", var, {"value": {"balances": {"BTC": 1}}})
+
+    helpers.receive_group_func(socket, "subscribe", var, {"path": "balances.BTC"})
+    helpers.receive_group_func(socket, "unsubscribe", var)
+    var.value = {"balances": {"BTC": 2}}
+    helpers.assert_no_send(socket)
+
+
+def test_remote_variable_path(socket):
+    var = RemoteVariable("test", socket, path="balances.BTC")
+    helpers.assert_send_group_func(socket, "subscribe", var, {"path": "balances.BTC", "get": {"path": "balances.BTC"}})
+    helpers.receive_group_func(socket, "set", var, {"value": 2, "path": "balances.BTC"})
+    assert var.value == 2
+    assert var.path == "balances.BTC"
+
+
 def test_local_variable_set_unsubscribed(socket, local_variable_unsubscribed):
     local_variable_unsubscribed.value = 20
     helpers.assert_no_send(socket)
@@ -142,6 +290,13 @@ def test_remote_list_set_all_missing_field(socket, remote_list):
     helpers.assert_send_error(socket, SockSyncErrors.ERROR_MISSING_FIELD)
 
 
+def test_remote_list_extend(socket, remote_list):
+    helpers.init_remote_list(socket, remote_list)
+    helpers.receive_group_func(socket, "extend", remote_list, {"items": [4, 5]})
+    helpers.assert_no_send(socket)
+    assert list(remote_list.items) == [1, 2, 3, 4, 5]
+
+
 def test_remote_list_set_count(socket, remote_list):
     helpers.receive_group_func(socket, "set_count", remote_list, {"total_item_count": 50})
     helpers.assert_no_send(socket)
@@ -223,6 +378,18 @@ def test_local_list_get_page_1(socket, local_list):
                                    {"page": 1, "page_size": 2, "total_item_count": 3, "items": [3]})
 
 
+def test_local_list_get_chunked(socket, local_list, mocker):
+    mocker.patch.object(socket, "bulk_chunk_size", 2)
+    local_list.append(4)
+    local_list.append(5)
+    helpers.reset_send(socket)
+    helpers.receive_group_func(socket, "get", local_list, {"page": 0, "page_size": 5})
+    helpers.assert_send_group_func(socket, "set_all", local_list,
+                                   {"page": 0, "page_size": 5, "total_item_count": 5, "items": [1, 2]}, True)
+    helpers.assert_send_group_func(socket, "extend", local_list, {"items": [3, 4]}, True)
+    helpers.assert_send_group_func(socket, "extend", local_list, {"items": [5]})
+
+
 def test_local_list_get_unsubscribed(socket, local_list_unsubscribed):
     helpers.receive_group_func(socket, "get", local_list_unsubscribed, {"page": 0, "page_size": 5})
     helpers.assert_send_error(socket, SockSyncErrors.ERROR_INVALID_FUNC)
@@ -235,6 +402,13 @@ def test_local_list_set_count_insert(socket, local_list):
     helpers.assert_send_group_func(socket, "set_count", local_list, {"total_item_count": 4})
 
 
+def test_local_list_append(socket, local_list):
+    local_list.append(4)
+    assert list(local_list.items) == [1, 2, 3, 4]
+    helpers.assert_send_group_func(socket, "set_count", local_list, {"total_item_count": 4}, True)
+    helpers.assert_send_group_func(socket, "insert", local_list, {"index": 3, "value": 4})
+
+
 def test_local_list_set_count_delete(socket, local_list):
     helpers.receive_group_func(socket, "get", local_list, {"page": 0, "page_size": 2})
     helpers.reset_send(socket)
@@ -276,10 +450,37 @@ def test_local_list_insert_paged(socket, local_list):
     helpers.reset_send(socket)
     local_list.insert(0, "test")
     helpers.assert_send_group_func(socket, "set_count", local_list, {"total_item_count": 4}, True)
-    helpers.assert_send_group_func(socket, "delete", local_list, {"index": 1}, True)
     helpers.assert_send_group_func(socket, "insert", local_list, {"index": 0, "value": 2})
 
 
+def test_local_list_insert_paged_full(socket, local_list):
+    local_list.insert(0, 10)
+    helpers.receive_group_func(socket, "get", local_list, {"page": 0, "page_size": 2})
+    helpers.reset_send(socket)
+    local_list.insert(0, "test")
+    helpers.assert_send_group_func(socket, "set_count", local_list, {"total_item_count": 5}, True)
+    helpers.assert_send_group_func(socket, "delete", local_list, {"index": 1}, True)
+    helpers.assert_send_group_func(socket, "insert", local_list, {"index": 0, "value": "test"})
+
+
+def test_local_list_insert_cohorts(socket, mocker):
+    lst = LocalList("test", [1, 2, 3, 4])
+    sockets = [SockSyncSocket(scope=None) for _ in range(5)]
+    for i, s in enumerate(sockets):
+        s.register_group(lst)
+        page = 0 if i < 4 else 1
+        helpers.receive_group_func(s, "subscribe", lst, {"get": {"page": page, "page_size": 2}})
+    helpers.reset_send(socket)
+
+    dumps = mocker.spy(json, "dumps")
+    lst.insert(0, 0)
+    # set_count, delete and insert for each of the two windows.
+    assert dumps.call_count == 6
+    assert socket.send.call_count == 15
+    inserts = [json.loads(c[0][0]) for c in socket.send.call_args_list if '"insert"' in c[0][0]]
+    assert sorted(f["value"] for f in inserts) == [0, 0, 0, 0, 2]
+
+
 def test_local_list_insert_unsubscribed(socket, local_list_unsubscribed):
     local_list_unsubscribed.insert(0, "test")
     helpers.assert_no_send(socket)
@@ -339,6 +540,7 @@ def test_remote_function_call_unsubscribed(socket, remote_function_unsubscribed)
 def test_local_function_call(socket, local_function, f):
     f.return_value = "test_return"
     helpers.receive_group_func(socket, "call", local_function, {"id": "test_id", "args": {"arg1": 0, "arg2": "test"}})
+    _wait_for_send(socket)
     f.assert_called_once_with(**{"arg1": 0, "arg2": "test"})
     helpers.assert_send_group_func(socket, "return", local_function, {"id": "test_id", "value": "test_return"})
 
@@ -348,3 +550,967 @@ def test_local_function_call_unsubscribed(socket, local_function_unsubscribed, f
                                {"id": "test_id", "args": {"arg1": 0, "arg2": "test"}})
     f.assert_not_called()
     helpers.assert_send_error(socket, SockSyncErrors.ERROR_INVALID_FUNC)
+
+
+def test_groups_have_no_instance_dict(local_groups, remote_groups):
+    for group in local_groups + remote_groups:
+        assert not hasattr(group, "__dict__")
+
+
+def test_remote_list_get_filter(socket, remote_list):
+    remote_list.set_filter({"side": "buy"})
+    helpers.assert_send_group_func(socket, "get", remote_list, {"page": 0, "page_size": 5, "filter": {"side": "buy"}})
+    assert remote_list.filter == {"side": "buy"}
+
+
+def _filtered_list(socket):
+    lst = LocalList("test", [{"side": "buy", "price": 1}, {"side": "sell", "price": 2}, {"side": "buy", "price": 3}])
+    socket.register_group(lst)
+    helpers.receive_group_func(socket, "subscribe", lst)
+    helpers.receive_group_func(socket, "get", lst, {"page": 0, "page_size": 5, "filter": {"side": "buy"}})
+    return lst
+
+
+def test_local_list_get_filter(socket):
+    lst = _filtered_list(socket)
+    helpers.assert_send_group_func(socket, "set_all", lst, {
+        "page": 0, "page_size": 5, "total_item_count": 2, "filter": {"side": "buy"},
+        "items": [{"side": "buy", "price": 1}, {"side": "buy", "price": 3}]})
+
+
+def test_local_list_get_invalid_filter(socket, local_list):
+    helpers.receive_group_func(socket, "get", local_list, {"filter": {"price": {"like": 1}}})
+    helpers.assert_send_error(socket, SockSyncErrors.ERROR_OTHER)
+
+
+def test_local_list_filter_insert_matching(socket):
+    lst = _filtered_list(socket)
+    helpers.reset_send(socket)
+    lst.insert(2, {"side": "buy", "price": 4})
+    helpers.assert_send_group_func(socket, "set_count", lst, {"total_item_count": 3}, True)
+    helpers.assert_send_group_func(socket, "insert", lst, {"index": 1, "value": {"side": "buy", "price": 4}})
+
+
+def test_local_list_filter_insert_not_matching(socket):
+    lst = _filtered_list(socket)
+    helpers.reset_send(socket)
+    lst.insert(0, {"side": "sell", "price": 4})
+    helpers.assert_no_send(socket)
+    lst.delete(1)
+    helpers.assert_send_group_func(socket, "set_count", lst, {"total_item_count": 1}, True)
+    helpers.assert_send_group_func(socket, "delete", lst, {"index": 0})
+
+
+def test_local_list_filter_set_moves_in_and_out(socket):
+    lst = _filtered_list(socket)
+    helpers.reset_send(socket)
+    lst.set(1, {"side": "buy", "price": 2})
+    helpers.assert_send_group_func(socket, "set_count", lst, {"total_item_count": 3}, True)
+    helpers.assert_send_group_func(socket, "insert", lst, {"index": 1, "value": {"side": "buy", "price": 2}})
+    lst.set(0, {"side": "sell", "price": 1})
+    helpers.assert_send_group_func(socket, "set_count", lst, {"total_item_count": 2}, True)
+    helpers.assert_send_group_func(socket, "delete", lst, {"index": 0})
+    lst.set(2, {"side": "buy", "price": 5})
+    helpers.assert_send_group_func(socket, "set", lst, {"index": 1, "value": {"side": "buy", "price": 5}})
+
+
+def test_local_list_filter_tested_once_per_filter(socket, mocker):
+    lst = _filtered_list(socket)
+    other = SockSyncSocket(scope=None)
+    other.register_group(lst)
+    helpers.receive_group_func(other, "subscribe", lst)
+    helpers.receive_group_func(other, "get", lst, {"filter": {"side": "buy"}})
+    helpers.reset_send(socket)
+
+    matches = mocker.spy(ListFilter, "matches")
+    lst.insert(0, {"side": "buy", "price": 0})
+    assert matches.call_count == 1
+    assert socket.send.call_count == 4
+
+
+def test_local_list_filter_view_dropped(socket):
+    lst = _filtered_list(socket)
+    helpers.receive_group_func(socket, "get", lst)
+    helpers.reset_send(socket)
+    lst.insert(0, 10)
+    assert len(lst._views) == 1
+
+
+def _sorted_list(socket, items):
+    lst = SortedLocalList("test", items, key=lambda v: v["price"])
+    socket.register_group(lst)
+    helpers.receive_group_func(socket, "subscribe", lst)
+    return lst
+
+
+def test_sorted_local_list_constructor_sorts(socket):
+    lst = _sorted_list(socket, [{"price": 3}, {"price": 1}, {"price": 2}])
+    assert [v["price"] for v in lst.items] == [1, 2, 3]
+
+
+def test_sorted_local_list_add(socket):
+    lst = _sorted_list(socket, [{"price": 1}, {"price": 3}])
+    assert lst.add({"price": 2}) == 1
+    helpers.assert_send_group_func(socket, "set_count", lst, {"total_item_count": 3}, True)
+    helpers.assert_send_group_func(socket, "insert", lst, {"index": 1, "value": {"price": 2}})
+    assert lst.add({"price": 5}) == 3
+    assert [v["price"] for v in lst.items] == [1, 2, 3, 5]
+
+
+def test_sorted_local_list_set_same_position(socket):
+    lst = _sorted_list(socket, [{"price": 1}, {"price": 3}, {"price": 5}])
+    helpers.reset_send(socket)
+    assert lst.set(1, {"price": 4}) == 1
+    helpers.assert_send_group_func(socket, "set", lst, {"index": 1, "value": {"price": 4}})
+
+
+def test_sorted_local_list_set_moves(socket):
+    lst = _sorted_list(socket, [{"price": 1}, {"price": 3}, {"price": 5}])
+    helpers.reset_send(socket)
+    assert lst.set(0, {"price": 6}) == 2
+    helpers.assert_send_group_func(socket, "set_count", lst, {"total_item_count": 2}, True)
+    helpers.assert_send_group_func(socket, "delete", lst, {"index": 0}, True)
+    helpers.assert_send_group_func(socket, "set_count", lst, {"total_item_count": 3}, True)
+    helpers.assert_send_group_func(socket, "insert", lst, {"index": 2, "value": {"price": 6}})
+    assert [v["price"] for v in lst.items] == [3, 5, 6]
+
+
+def test_sorted_local_list_remove(socket):
+    lst = _sorted_list(socket, [{"price": 1, "id": 1}, {"price": 1, "id": 2}, {"price": 2, "id": 3}])
+    lst.remove({"price": 1, "id": 2})
+    assert [v["id"] for v in lst.items] == [1, 3]
+    with pytest.raises(ValueError):
+        lst.remove({"price": 1, "id": 2})
+
+
+def test_sorted_local_list_insert(socket):
+    lst = _sorted_list(socket, [])
+    with pytest.raises(TypeError):
+        lst.insert(0, {"price": 1})
+
+
+def test_remote_list_get_range(socket, remote_list):
+    remote_list.get_range(3, 4)
+    helpers.assert_send_group_func(socket, "get", remote_list, {"offset": 3, "limit": 4})
+
+
+def test_remote_list_set_all_range(socket, remote_list):
+    helpers.receive_group_func(socket, "set_all", remote_list,
+                               {"offset": 2, "limit": 3, "total_item_count": 20, "items": [1, 2, 3]})
+    assert remote_list.offset == 2
+    assert remote_list.limit == 3
+    remote_list.get()
+    helpers.assert_send_group_func(socket, "get", remote_list, {"offset": 2, "limit": 3})
+
+
+def test_remote_list_grow_slide(socket, remote_list):
+    helpers.receive_group_func(socket, "set_all", remote_list,
+                               {"offset": 2, "limit": 3, "total_item_count": 20, "items": [1, 2, 3]})
+    remote_list.grow(2)
+    helpers.assert_send_group_func(socket, "get", remote_list, {"offset": 2, "limit": 5})
+    remote_list.slide(-1)
+    helpers.assert_send_group_func(socket, "get", remote_list, {"offset": 1, "limit": 3})
+
+
+def test_remote_list_set_range(socket, remote_list):
+    helpers.receive_group_func(socket, "set_all", remote_list,
+                               {"offset": 2, "limit": 3, "total_item_count": 20, "items": [2, 3, 4]})
+    helpers.receive_group_func(socket, "set_range", remote_list,
+                               {"offset": 1, "limit": 5, "total_item_count": 20, "keep": [0, 3],
+                                "before": [1], "after": [5]})
+    helpers.assert_no_send(socket)
+    assert list(remote_list.items) == [1, 2, 3, 4, 5]
+    assert remote_list.offset == 1
+    assert remote_list.limit == 5
+
+
+def _ranged_list(socket, size=10):
+    lst = LocalList("test", list(range(size)))
+    socket.register_group(lst)
+    helpers.receive_group_func(socket, "subscribe", lst)
+    helpers.receive_group_func(socket, "get", lst, {"offset": 2, "limit": 3})
+    return lst
+
+
+def test_local_list_get_range(socket):
+    lst = _ranged_list(socket)
+    helpers.assert_send_group_func(socket, "set_all", lst,
+                                   {"offset": 2, "limit": 3, "total_item_count": 10, "items": [2, 3, 4]})
+
+
+def test_local_list_get_range_grow(socket):
+    lst = _ranged_list(socket)
+    helpers.reset_send(socket)
+    helpers.receive_group_func(socket, "get", lst, {"offset": 2, "limit": 5})
+    helpers.assert_send_group_func(socket, "set_range", lst,
+                                   {"offset": 2, "limit": 5, "total_item_count": 10, "keep": [0, 3], "before": [],
+                                    "after": [5, 6]})
+
+
+def test_local_list_get_range_slide(socket):
+    lst = _ranged_list(socket)
+    helpers.reset_send(socket)
+    helpers.receive_group_func(socket, "get", lst, {"offset": 1, "limit": 3})
+    helpers.assert_send_group_func(socket, "set_range", lst,
+                                   {"offset": 1, "limit": 3, "total_item_count": 10, "keep": [0, 2], "before": [1],
+                                    "after": []})
+
+
+def test_local_list_get_range_no_overlap(socket):
+    lst = _ranged_list(socket)
+    helpers.reset_send(socket)
+    helpers.receive_group_func(socket, "get", lst, {"offset": 7, "limit": 3})
+    helpers.assert_send_group_func(socket, "set_all", lst,
+                                   {"offset": 7, "limit": 3, "total_item_count": 10, "items": [7, 8, 9]})
+
+
+def test_local_list_get_range_not_synced(socket, local_list):
+    helpers.receive_group_func(socket, "get", local_list, {"offset": 0, "limit": 2})
+    helpers.assert_send_group_func(socket, "set_all", local_list,
+                                   {"offset": 0, "limit": 2, "total_item_count": 3, "items": [1, 2]})
+
+
+def test_local_list_range_insert_delete(socket):
+    lst = _ranged_list(socket)
+    helpers.reset_send(socket)
+    lst.insert(3, "test")
+    helpers.assert_send_group_func(socket, "set_count", lst, {"total_item_count": 11}, True)
+    helpers.assert_send_group_func(socket, "delete", lst, {"index": 2}, True)
+    helpers.assert_send_group_func(socket, "insert", lst, {"index": 1, "value": "test"})
+    lst.delete(0)
+    helpers.assert_send_group_func(socket, "set_count", lst, {"total_item_count": 10}, True)
+    helpers.assert_send_group_func(socket, "delete", lst, {"index": 0}, True)
+    helpers.assert_send_group_func(socket, "insert", lst, {"index": 2, "value": 4})
+
+
+def _cached_list(socket, **kwargs):
+    lst = RemoteList("test", socket, 2, **kwargs)
+    helpers.reset_send(socket)
+    return lst
+
+
+def test_remote_list_cache_page(socket):
+    lst = _cached_list(socket, cache_pages=2)
+    helpers.receive_group_func(socket, "set_all", lst, {"page": 0, "page_size": 2, "total_item_count": 6,
+                                                        "items": [1, 2]})
+    lst.get_page(1)
+    helpers.assert_send_group_func(socket, "get", lst, {"page": 1, "page_size": 2})
+    assert lst.page == 0
+    helpers.receive_group_func(socket, "set_all", lst, {"page": 1, "page_size": 2, "total_item_count": 6,
+                                                        "items": [3, 4]})
+    assert lst.cached_pages == [0]
+
+    lst.get_page(0)
+    assert lst.page == 0
+    assert list(lst.items) == [1, 2]
+    helpers.assert_send_group_func(socket, "get", lst, {"page": 0, "page_size": 2})
+
+
+def test_remote_list_cache_lru(socket):
+    lst = _cached_list(socket, cache_pages=1)
+    for page in range(3):
+        helpers.receive_group_func(socket, "set_all", lst, {"page": page, "page_size": 2, "total_item_count": 6,
+                                                            "items": [page, page]})
+    assert lst.cached_pages == [1]
+
+
+def test_remote_list_cache_invalidated(socket):
+    lst = _cached_list(socket, cache_pages=3)
+    for page in [0, 2, 1]:
+        helpers.receive_group_func(socket, "set_all", lst, {"page": page, "page_size": 2, "total_item_count": 6,
+                                                            "items": [page, page]})
+    assert sorted(lst.cached_pages) == [0, 2]
+    helpers.receive_group_func(socket, "set", lst, {"index": 1, "value": 10})
+    assert sorted(lst.cached_pages) == [0, 2]
+    helpers.receive_group_func(socket, "insert", lst, {"index": 1, "value": 10})
+    assert lst.cached_pages == [0]
+    helpers.receive_group_func(socket, "delete", lst, {"index": 0})
+    assert lst.cached_pages == []
+
+
+def test_remote_list_cache_set_count(socket):
+    lst = _cached_list(socket, cache_pages=3)
+    for page in [2, 0]:
+        helpers.receive_group_func(socket, "set_all", lst, {"page": page, "page_size": 2, "total_item_count": 6,
+                                                            "items": [page, page]})
+    helpers.receive_group_func(socket, "set_count", lst, {"total_item_count": 4})
+    assert lst.cached_pages == []
+
+
+def test_remote_list_prefetch(socket):
+    lst = RemoteList("test", socket, 2, prefetch_pages=1)
+    helpers.assert_send_group_func(socket, "subscribe", lst, {"get": {"offset": 0, "limit": 4}})
+    helpers.receive_group_func(socket, "set_all", lst, {"offset": 0, "limit": 4, "total_item_count": 10,
+                                                        "items": [0, 1, 2, 3]})
+    assert list(lst.items) == [0, 1]
+
+    lst.get_page(1)
+    assert lst.page == 1
+    assert list(lst.items) == [2, 3]
+    helpers.assert_send_group_func(socket, "get", lst, {"offset": 0, "limit": 6})
+    helpers.receive_group_func(socket, "set_range", lst, {"offset": 0, "limit": 6, "total_item_count": 10,
+                                                          "keep": [0, 4], "before": [], "after": [4, 5]})
+    assert list(lst.items) == [2, 3]
+
+    lst.get_page(1)
+    helpers.assert_no_send(socket)
+    lst.get_page(0)
+    assert list(lst.items) == [0, 1]
+    helpers.assert_send_group_func(socket, "get", lst, {"offset": 0, "limit": 4})
+
+
+
+def test_remote_list_prefetch_capped_by_owner():
+    server, client, frames = helpers.socket_pair()
+    server.register_group(LocalList("test", list(range(100)), max_page_size=25))
+    lst = RemoteList("test", client, 25, prefetch_pages=1)
+    helpers.deliver(frames)
+    assert list(lst.items) == list(range(25))
+
+    for page in [1, 3, 2, 0]:
+        lst.get_page(page)
+        helpers.deliver(frames)
+        assert lst.page == page
+        assert list(lst.items) == list(range(page * 25, page * 25 + 25))
+
+
+def test_remote_list_prefetch_page_bigger_than_owner_allows():
+    server, client, frames = helpers.socket_pair()
+    server.register_group(LocalList("test", list(range(20)), max_page_size=4))
+    lst = RemoteList("test", client, 5, prefetch_pages=1)
+    helpers.deliver(frames)
+    assert lst.page_size == 4
+    assert list(lst.items) == [0, 1, 2, 3]
+
+
+def test_remote_list_prefetch_with_room_for_neighbours():
+    server, client, frames = helpers.socket_pair()
+    server.register_group(LocalList("test", list(range(100)), max_page_size=40))
+    lst = RemoteList("test", client, 10, prefetch_pages=2)
+    helpers.deliver(frames)
+    assert list(lst.items) == list(range(10))
+
+    lst.get_page(5)
+    helpers.deliver(frames)
+    assert list(lst.items) == list(range(50, 60))
+    assert (lst.offset, lst.limit) == (30, 40)
+    lst.get_page(6)
+    assert list(lst.items) == list(range(60, 70))
+
+    lst.get_page(9)
+    helpers.deliver(frames)
+    assert list(lst.items) == list(range(90, 100))
+    assert (lst.offset, lst.limit) == (80, 20)
+
+
+def test_remote_variable_change_listener(socket, remote_variable, f):
+    remote_variable.add_change_listener(f)
+    helpers.receive_group_func(socket, "set", remote_variable, {"value": 10})
+    f.assert_called_once_with(remote_variable)
+    remote_variable.remove_change_listener(f)
+    helpers.receive_group_func(socket, "set", remote_variable, {"value": 11})
+    f.assert_called_once()
+
+
+def test_remote_variable_change_listener_error(socket, remote_variable):
+    def listener(_):
+        raise ValueError("test")
+
+    remote_variable.add_change_listener(listener)
+    helpers.receive_group_func(socket, "set", remote_variable, {"value": 10})
+    helpers.assert_no_send(socket)
+    assert remote_variable.value == 10
+
+
+def test_remote_list_change_listener(socket, remote_list, f):
+    remote_list.add_change_listener(f)
+    helpers.init_remote_list(socket, remote_list)
+    helpers.receive_group_func(socket, "insert", remote_list, {"index": 0, "value": 0})
+    assert f.call_count == 2
+
+
+def test_remote_variable_wait_for_change(socket, remote_variable):
+    async def wait():
+        waiter = asyncio.ensure_future(remote_variable.wait_for_change(timeout=5))
+        await asyncio.sleep(0)
+        Thread(target=helpers.receive_group_func, args=(socket, "set", remote_variable, {"value": 10})).start()
+        assert await waiter is remote_variable
+
+    asyncio.run(wait())
+    assert remote_variable.value == 10
+
+
+def test_remote_variable_wait_for_change_timeout(socket, remote_variable):
+    async def wait():
+        with pytest.raises(asyncio.TimeoutError):
+            await remote_variable.wait_for_change(timeout=.01)
+
+    asyncio.run(wait())
+    assert len(remote_variable._waiters) == 0
+
+
+def test_remote_list_wait_until(socket, remote_list):
+    async def wait():
+        waiter = asyncio.ensure_future(remote_list.wait_until(lambda lst: lst.count >= 2, timeout=5))
+        await asyncio.sleep(0)
+        helpers.receive_group_func(socket, "set_count", remote_list, {"total_item_count": 1})
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        helpers.receive_group_func(socket, "set_count", remote_list, {"total_item_count": 2})
+        assert await waiter is remote_list
+        assert await remote_list.wait_until(lambda lst: lst.count >= 2) is remote_list
+
+    asyncio.run(wait())
+
+
+def _wait_for_send(socket, count: int = 1):
+    timeout = time.time() + 10
+    while socket.send.call_count < count:
+        time.sleep(.01)
+        assert time.time() < timeout
+
+
+def test_remote_function_call_many(socket, remote_function):
+    result = []
+    t = Thread(target=lambda: result.append(remote_function.call_many([{"a": 1}, {"a": 2}])))
+    t.start()
+    _wait_for_send(socket)
+
+    calls = json.loads(socket.send.call_args[0][0])["calls"]
+    helpers.assert_send_group_func(socket, "call_many", remote_function, {"calls": calls})
+    assert [c["args"] for c in calls] == [{"a": 1}, {"a": 2}]
+    helpers.receive_group_func(socket, "return", remote_function, {"id": calls[1]["id"], "value": 2})
+    helpers.receive_group_func(socket, "return", remote_function, {"id": calls[0]["id"], "value": 1})
+    t.join()
+    assert result[0] == [1, 2]
+    assert len(remote_function._calls) == 0
+
+
+def test_remote_function_call_async(socket, remote_function):
+    async def call():
+        task = asyncio.ensure_future(remote_function.call_async(a=1))
+        await asyncio.sleep(0)
+        call_id = json.loads(socket.send.call_args[0][0])["id"]
+        helpers.receive_group_func(socket, "return", remote_function, {"id": call_id, "value": "test"})
+        assert await task == "test"
+
+    asyncio.run(call())
+
+
+def test_remote_function_concurrent_calls(socket, remote_function):
+    results = {}
+    threads = [Thread(target=lambda i=i: results.update({i: remote_function.call(i=i)})) for i in range(10)]
+    for t in threads:
+        t.start()
+    _wait_for_send(socket, 10)
+
+    for args in socket.send.call_args_list:
+        data = json.loads(args[0][0])
+        helpers.receive_group_func(socket, "return", remote_function, {"id": data["id"], "value": data["args"]["i"]})
+    for t in threads:
+        t.join()
+    assert results == {i: i for i in range(10)}
+
+
+def test_remote_function_return_twice(socket, remote_function):
+    t = Thread(target=lambda: remote_function.call())
+    t.start()
+    _wait_for_send(socket)
+    call_id = json.loads(socket.send.call_args[0][0])["id"]
+    helpers.reset_send(socket)
+    helpers.receive_group_func(socket, "return", remote_function, {"id": call_id})
+    t.join()
+    helpers.receive_group_func(socket, "return", remote_function, {"id": call_id})
+    helpers.assert_send_error(socket, SockSyncErrors.ERROR_BAD_ID)
+
+
+def test_remote_function_outstanding_limit(socket):
+    class LimitedSocket(SockSyncSocket):
+        max_outstanding_calls = 1
+
+    limited = LimitedSocket(scope=None)
+    fun = RemoteFunction("test", limited)
+    helpers.reset_send(limited)
+
+    result = []
+    t = Thread(target=lambda: result.append(fun.call_many([{"a": 1}, {"a": 2}])))
+    t.start()
+    _wait_for_send(limited)
+    time.sleep(.05)
+    assert limited.send.call_count == 1
+    first = json.loads(limited.send.call_args[0][0])
+    assert first["func"] == "call"
+    helpers.reset_send(limited)
+
+    helpers.receive_group_func(limited, "return", fun, {"id": first["id"], "value": 1})
+    _wait_for_send(limited)
+    second = json.loads(limited.send.call_args[0][0])
+    helpers.receive_group_func(limited, "return", fun, {"id": second["id"], "value": 2})
+    t.join()
+    assert result[0] == [1, 2]
+
+
+def test_remote_function_disconnect(socket, remote_function):
+    result = []
+
+    def call():
+        try:
+            remote_function.call()
+        except ConnectionError as e:
+            result.append(e)
+
+    t = Thread(target=call)
+    t.start()
+    _wait_for_send(socket)
+    socket.disconnect(None)
+    t.join()
+    assert len(result) == 1
+
+
+def test_local_function_call_many(socket, local_function, f):
+    f.return_value = "test_return"
+    helpers.receive_group_func(socket, "call_many", local_function,
+                               {"calls": [{"id": "a", "args": {"x": 1}}, {"id": "b", "args": {"x": 2}}]})
+    _wait_for_send(socket, 2)
+    assert f.call_count == 2
+    returns = sorted(json.loads(c[0][0])["id"] for c in socket.send.call_args_list)
+    assert returns == ["a", "b"]
+    helpers.reset_send(socket)
+
+
+def test_local_function_call_many_missing_id(socket, local_function, f):
+    helpers.receive_group_func(socket, "call_many", local_function, {"calls": [{"args": {}}]})
+    f.assert_not_called()
+    helpers.assert_send_error(socket, SockSyncErrors.ERROR_MISSING_FIELD)
+
+
+def _cached_function(socket, f, **kwargs):
+    f.return_value = 1
+    fun = LocalFunction("test", f, cache=True, **kwargs)
+    socket.register_group(fun)
+    helpers.receive_group_func(socket, "subscribe", fun)
+    return fun
+
+
+def _call(socket, fun, id_, args, sends=1):
+    helpers.receive_group_func(socket, "call", fun, {"id": id_, "args": args})
+    _wait_for_send(socket, sends)
+
+
+def test_local_function_cache(socket, f):
+    fun = _cached_function(socket, f)
+    f.return_value = "test_return"
+    _call(socket, fun, "a", {"x": 1, "y": 2})
+    helpers.assert_send_group_func(socket, "return", fun, {"id": "a", "value": "test_return"})
+    helpers.receive_group_func(socket, "call", fun, {"id": "b", "args": {"y": 2, "x": 1}})
+    helpers.assert_send_group_func(socket, "return", fun, {"id": "b", "value": "test_return"})
+    f.assert_called_once_with(x=1, y=2)
+
+
+def test_local_function_cache_ttl(socket, f, mocker):
+    monotonic = mocker.patch("socksync.groups.time").monotonic
+    monotonic.return_value = 100
+    fun = _cached_function(socket, f, cache_ttl=10)
+    _call(socket, fun, "a", {"x": 1})
+    monotonic.return_value = 105
+    _call(socket, fun, "b", {"x": 1}, 2)
+    assert f.call_count == 1
+    monotonic.return_value = 111
+    _call(socket, fun, "c", {"x": 1}, 3)
+    assert f.call_count == 2
+    helpers.reset_send(socket)
+
+
+def test_local_function_cache_size(socket, f):
+    fun = _cached_function(socket, f, cache_size=1)
+    _call(socket, fun, "a", {"x": 1})
+    _call(socket, fun, "b", {"x": 2}, 2)
+    _call(socket, fun, "c", {"x": 1}, 3)
+    assert f.call_count == 3
+    helpers.reset_send(socket)
+
+
+def test_local_function_cache_invalidate(socket, f):
+    fun = _cached_function(socket, f)
+    _call(socket, fun, "a", {"x": 1})
+    fun.invalidate(x=1)
+    _call(socket, fun, "b", {"x": 1}, 2)
+    fun.invalidate_all()
+    _call(socket, fun, "c", {"x": 1}, 3)
+    assert f.call_count == 3
+    helpers.reset_send(socket)
+
+
+def test_local_function_cache_collapses_calls(socket, f):
+    release = Event()
+    f.side_effect = lambda **kwargs: release.wait(5) and "test_return"
+    fun = _cached_function(socket, f)
+    helpers.receive_group_func(socket, "call", fun, {"id": "a", "args": {"x": 1}})
+    helpers.receive_group_func(socket, "call", fun, {"id": "b", "args": {"x": 1}})
+    release.set()
+    _wait_for_send(socket, 2)
+    f.assert_called_once_with(x=1)
+    returns = sorted(json.loads(c[0][0])["id"] for c in socket.send.call_args_list)
+    assert returns == ["a", "b"]
+    helpers.reset_send(socket)
+
+
+def test_local_function_cache_error(socket, f):
+    f.side_effect = ValueError("test")
+    fun = _cached_function(socket, f)
+    _call(socket, fun, "a", {"x": 1})
+    helpers.assert_send_error(socket, SockSyncErrors.ERROR_OTHER)
+    assert len(fun._cache) == 0
+
+
+def _batched_list(socket):
+    lst = LocalList("test", [1, 2, 3], batch_interval=60)
+    socket.register_group(lst)
+    helpers.receive_group_func(socket, "subscribe", lst)
+    helpers.receive_group_func(socket, "get", lst, {"page": 0, "page_size": 2})
+    helpers.reset_send(socket)
+    return lst
+
+
+def test_local_list_batch_burst_sends_set_all(socket):
+    lst = _batched_list(socket)
+    for i in range(10):
+        lst.insert(0, i)
+    helpers.assert_no_send(socket)
+    lst.flush()
+    helpers.assert_send_group_func(socket, "set_all", lst,
+                                   {"page": 0, "page_size": 2, "total_item_count": 13, "items": [9, 8]})
+
+
+def test_local_list_batch_small_change_sends_ops(socket):
+    lst = _batched_list(socket)
+    lst.set(0, "test")
+    lst.flush()
+    helpers.assert_send_group_func(socket, "set", lst, {"index": 0, "value": "test"})
+
+
+def test_local_list_batch_keeps_last_count(socket):
+    lst = _batched_list(socket)
+    lst.insert(3, 4)
+    lst.insert(4, 5)
+    lst.flush()
+    helpers.assert_send_group_func(socket, "set_count", lst, {"total_item_count": 5})
+
+
+def test_local_list_batch_flushed_before_get(socket):
+    lst = _batched_list(socket)
+    lst.set(0, "test")
+    helpers.receive_group_func(socket, "get", lst, {"offset": 0, "limit": 2})
+    helpers.assert_send_group_func(socket, "set", lst, {"index": 0, "value": "test"}, True)
+    helpers.assert_send_group_func(socket, "set_range", lst, {"offset": 0, "limit": 2, "total_item_count": 3,
+                                                              "keep": [0, 2], "before": [], "after": []})
+
+
+def test_local_list_batch_timer(socket):
+    lst = LocalList("test", [1, 2, 3], batch_interval=.01)
+    socket.register_group(lst)
+    helpers.receive_group_func(socket, "subscribe", lst)
+    lst.set(0, "test")
+    _wait_for_send(socket)
+    helpers.assert_send_group_func(socket, "set", lst, {"index": 0, "value": "test"})
+
+
+def _keyed_list(socket, count=3):
+    lst = KeyedLocalList("test", [{"id": i, "v": i} for i in range(count)])
+    socket.register_group(lst)
+    helpers.receive_group_func(socket, "subscribe", lst)
+    return lst
+
+
+def test_keyed_local_list_update(socket):
+    lst = _keyed_list(socket)
+    lst.update(1, {"id": 1, "v": 10})
+    helpers.assert_send_group_func(socket, "set", lst, {"index": 1, "key": 1, "value": {"id": 1, "v": 10}})
+    assert lst.get(1) == {"id": 1, "v": 10}
+
+
+def test_keyed_local_list_remove(socket):
+    lst = _keyed_list(socket)
+    lst.remove(0)
+    helpers.reset_send(socket)
+    assert 0 not in lst
+    assert lst.index(2) == 1
+    with pytest.raises(KeyError):
+        lst.update(0, {"id": 0})
+
+
+def test_keyed_local_list_insert(socket):
+    lst = _keyed_list(socket)
+    lst.insert(0, {"id": 10})
+    lst.add({"id": 11})
+    helpers.reset_send(socket)
+    assert [lst.index(k) for k in [10, 0, 1, 2, 11]] == [0, 1, 2, 3, 4]
+    with pytest.raises(ValueError):
+        lst.add({"id": 11})
+
+
+def test_keyed_local_list_set_changes_key(socket):
+    lst = _keyed_list(socket)
+    lst.set(0, {"id": 5})
+    helpers.reset_send(socket)
+    assert 0 not in lst
+    assert lst.index(5) == 0
+    with pytest.raises(ValueError):
+        lst.set(1, {"id": 5})
+
+
+def test_keyed_local_list_duplicate_keys():
+    with pytest.raises(ValueError):
+        KeyedLocalList("test", [{"id": 1}, {"id": 1}])
+
+
+def test_keyed_local_list_lookup_is_constant(socket, mocker):
+    lst = _keyed_list(socket, 1000)
+    assert lst.index(999) == 999
+    reindex = mocker.spy(KeyedLocalList, "_reindex")
+    for i in range(1000):
+        lst.update(i, {"id": i, "v": -i})
+    lst.add({"id": 1000})
+    lst.update(1000, {"id": 1000, "v": 1})
+    assert reindex.call_count == 0
+    helpers.reset_send(socket)
+
+
+def test_remote_list_set_by_key(socket):
+    lst = RemoteList("test", socket, 5, key_field="id")
+    helpers.reset_send(socket)
+    helpers.receive_group_func(socket, "set_all", lst, {"page": 0, "page_size": 5, "total_item_count": 2,
+                                                        "items": [{"id": "a"}, {"id": "b"}]})
+    helpers.receive_group_func(socket, "set", lst, {"index": 0, "key": "b", "value": {"id": "b", "v": 1}})
+    helpers.assert_no_send(socket)
+    assert list(lst.items) == [{"id": "a"}, {"id": "b", "v": 1}]
+
+
+def _stream(socket, capacity: int = 3, batch_interval: float = None, tail: int = None):
+    stream = LocalStream("test", capacity, batch_interval)
+    socket.register_group(stream)
+    helpers.receive_group_func(socket, "subscribe", stream, None if tail is None else {"get": {"tail": tail}})
+    return stream
+
+
+def test_local_stream_ring_buffer(socket):
+    stream = _stream(socket)
+    stream.extend([1, 2, 3, 4])
+    stream.append(5)
+    assert list(stream.items) == [3, 4, 5]
+    assert stream.sequence == 5
+    helpers.assert_send_group_func(socket, "append", stream, {"sequence": 0, "items": [1, 2, 3, 4]}, True)
+    helpers.assert_send_group_func(socket, "append", stream, {"sequence": 4, "items": [5]})
+
+
+def test_local_stream_get_tail(socket):
+    stream = _stream(socket, capacity=5)
+    stream.extend([1, 2, 3, 4])
+    helpers.reset_send(socket)
+    helpers.receive_group_func(socket, "get", stream, {"tail": 2})
+    helpers.assert_send_group_func(socket, "set_all", stream, {"sequence": 2, "items": [3, 4]})
+    helpers.receive_group_func(socket, "get", stream, {"tail": 10})
+    helpers.assert_send_group_func(socket, "set_all", stream, {"sequence": 0, "items": [1, 2, 3, 4]})
+    helpers.receive_group_func(socket, "get", stream)
+    helpers.assert_send_group_func(socket, "set_all", stream, {"sequence": 0, "items": [1, 2, 3, 4]})
+
+
+def test_local_stream_subscribe_snapshot(socket):
+    stream = LocalStream("test")
+    stream.extend([1, 2, 3])
+    socket.register_group(stream)
+    helpers.receive_group_func(socket, "subscribe", stream, {"get": {"tail": 1}})
+    helpers.assert_send_group_func(socket, "set_all", stream, {"sequence": 2, "items": [3]})
+
+
+def test_local_stream_unsubscribed(socket):
+    stream = LocalStream("test")
+    socket.register_group(stream)
+    stream.append(1)
+    helpers.assert_no_send(socket)
+    helpers.receive_group_func(socket, "get", stream)
+    helpers.assert_send_error(socket, SockSyncErrors.ERROR_INVALID_FUNC)
+
+
+def test_local_stream_batch(socket):
+    stream = _stream(socket, batch_interval=60)
+    stream.append(1)
+    stream.extend([2, 3])
+    helpers.assert_no_send(socket)
+    stream.flush()
+    helpers.assert_send_group_func(socket, "append", stream, {"sequence": 0, "items": [1, 2, 3]})
+    stream.flush()
+    helpers.assert_no_send(socket)
+
+
+def test_local_stream_batch_timer(socket):
+    stream = _stream(socket, batch_interval=0.01)
+    stream.append(1)
+    _wait_for_send(socket)
+    helpers.assert_send_group_func(socket, "append", stream, {"sequence": 0, "items": [1]})
+
+
+def test_remote_stream(socket):
+    stream = RemoteStream("test", socket, 3)
+    helpers.assert_send_group_func(socket, "subscribe", stream, {"get": {"tail": 3}})
+    helpers.receive_group_func(socket, "set_all", stream, {"sequence": 4, "items": [4, 5]})
+    assert list(stream.items) == [4, 5]
+    assert stream.sequence == 6
+
+    helpers.receive_group_func(socket, "append", stream, {"sequence": 5, "items": [5, 6, 7]})
+    assert list(stream.items) == [5, 6, 7]
+    assert stream.sequence == 8
+    helpers.receive_group_func(socket, "append", stream, {"sequence": 6, "items": [6, 7]})
+    assert list(stream.items) == [5, 6, 7]
+    helpers.assert_no_send(socket)
+
+
+def test_remote_stream_gap(socket):
+    stream = RemoteStream("test", socket, 3)
+    helpers.receive_group_func(socket, "set_all", stream, {"sequence": 0, "items": [0, 1]})
+    helpers.reset_send(socket)
+
+    helpers.receive_group_func(socket, "append", stream, {"sequence": 3, "items": [3]})
+    helpers.assert_send_group_func(socket, "get", stream, {"tail": 3})
+    helpers.receive_group_func(socket, "append", stream, {"sequence": 5, "items": [5]})
+    helpers.assert_no_send(socket)
+    assert list(stream.items) == [1, 3, 5]
+
+    helpers.receive_group_func(socket, "set_all", stream, {"sequence": 4, "items": [4, 5]})
+    assert list(stream.items) == [4, 5]
+    helpers.receive_group_func(socket, "append", stream, {"sequence": 7, "items": [7]})
+    helpers.assert_send_group_func(socket, "get", stream, {"tail": 3})
+
+
+def test_remote_stream_unsubscribed(socket):
+    stream = RemoteStream("test", socket, subscribe=False)
+    helpers.receive_group_func(socket, "append", stream, {"sequence": 0, "items": [0]})
+    helpers.assert_send_error(socket, SockSyncErrors.ERROR_INVALID_FUNC)
+
+
+def test_local_list_concurrent_producers(socket):
+    lst = LocalList("test", max_page_size=5)
+    socket.register_group(lst)
+    helpers.receive_group_func(socket, "subscribe", lst, {"get": {"page": 0, "page_size": 5}})
+    helpers.reset_send(socket)
+
+    others = [SockSyncSocket(scope=None) for _ in range(4)]
+
+    def produce(i: int):
+        for j in range(200):
+            lst.append(i * 1000 + j)
+
+    def churn():
+        for _ in range(50):
+            for other in others:
+                other.register_group(lst)
+                helpers.receive_group_func(other, "subscribe", lst, {"get": {"offset": 0, "limit": 3}})
+            for other in others:
+                helpers.receive_group_func(other, "unsubscribe", lst)
+
+    threads = [Thread(target=produce, args=(i,)) for i in range(4)] + [Thread(target=churn)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(list(lst.items)) == 800
+    for i in range(4):
+        assert [item for item in lst.items if item // 1000 == i] == [i * 1000 + j for j in range(200)]
+    frames = [json.loads(c[0][0]) for c in socket.send.call_args_list]
+    counts = [f["total_item_count"] for f in frames if f["func"] == "set_count" and f["name"] == "test"]
+    assert len(frames) > 800
+    assert not [f for f in frames if f["func"] == "error"]
+    assert sorted(counts) == counts
+    assert counts[-1] == 800
+
+
+def test_local_group_error_queued_behind_frames(socket, local_list):
+    helpers.reset_send(socket)
+    with local_list._locked():
+        local_list.append(4)
+        helpers.receive_group_func(socket, "subscribe", local_list, {"get": 1})
+        helpers.assert_no_send(socket)
+    frames = [json.loads(c[0][0]) for c in socket.send.call_args_list]
+    assert [frame["func"] for frame in frames] == ["set_count", "insert", "error"]
+
+
+def test_local_group_mutation_does_not_wait_for_send(socket):
+    var = LocalVariable("test", 0)
+    socket.register_group(var)
+    helpers.receive_group_func(socket, "subscribe", var)
+
+    sending, release = Event(), Event()
+
+    def slow_send(_):
+        sending.set()
+        release.wait(10)
+
+    socket.send.side_effect = slow_send
+    t = Thread(target=lambda: setattr(var, "value", 1))
+    t.start()
+    assert sending.wait(10)
+
+    var.value = 2
+    assert var.value == 2
+    release.set()
+    t.join()
+
+    assert [json.loads(c[0][0])["value"] for c in socket.send.call_args_list] == [1, 2]
+
+
+def test_local_group_sender_sends_for_producers(socket):
+    lst = LocalList("test", [])
+    socket.register_group(lst)
+    helpers.receive_group_func(socket, "subscribe", lst)
+
+    release = Event()
+    socket.send.side_effect = lambda _: release.wait(10)
+    sender = ThreadPoolExecutor(1)
+    socksync.set_sender(sender)
+    try:
+        producers = [Thread(target=lst.append, args=(i,)) for i in range(2)]
+        for producer in producers:
+            producer.start()
+        for producer in producers:
+            producer.join(1)
+            assert not producer.is_alive()
+        lst.append(2)
+        release.set()
+    finally:
+        sender.shutdown()
+        socksync.set_sender(None)
+
+    frames = [json.loads(c[0][0]) for c in socket.send.call_args_list]
+    assert sorted(frame["value"] for frame in frames if frame["func"] == "insert") == [0, 1, 2]
+
+
+def test_local_list_batched_changes_flushed_before_new_range():
+    server, client, frames = helpers.socket_pair()
+    lst = LocalList("test", list(range(20)), batch_interval=60)
+    server.register_group(lst)
+    remote = RemoteList("test", client, 10, subscribe=False)
+    remote.subscribe()
+    remote.get_range(0, 10)
+    helpers.deliver(frames)
+    for i in range(1000, 1010):
+        lst.insert(0, i)
+    remote.get_range(5, 10)
+    helpers.deliver(frames)
+    assert list(remote.items) == [1004, 1003, 1002, 1001, 1000, 0, 1, 2, 3, 4]
+    lst.flush()
+
+
+def test_local_list_unsubscribe_holds_lock(socket, local_list):
+    helpers.receive_group_func(socket, "get", local_list)
+    locked = []
+
+    class Pages(WeakKeyDictionary):
+        def pop(self, *args):
+            locked.append(local_list._lock._is_owned())
+            return super().pop(*args)
+
+    local_list._subscriber_pages = Pages(local_list._subscriber_pages)
+    socket.disconnect(None)
+    assert locked == [True]
+    assert socket not in local_list._subscriber_pages
@@ -0,0 +1,76 @@
+import pstats
+
+import pytest
+
+from socksync import profiling
+from socksync.profiling import ProfilingHook, SamplingProfiler
+from test import helpers
+
+
+class _RecordingHook(ProfilingHook):
+    def __init__(self):
+        self.events = []
+
+    def before(self, stage, detail):
+        self.events.append(("before", stage, detail))
+
+    def after(self, stage, detail, elapsed):
+        assert elapsed >= 0
+        self.events.append(("after", stage, detail))
+
+
+@pytest.fixture
+def hook():
+    hook = _RecordingHook()
+    profiling.add_hook(hook)
+    yield hook
+    profiling.remove_hook(hook)
+    profiling.set_sample_rate(1)
+
+
+def test_stage_without_hooks():
+    assert profiling.stage("encode") is profiling.stage("send")
+
+
+def test_hook_stages(socket, local_variable, hook):
+    helpers.reset_send(socket)
+    helpers.receive_group_func(socket, "get", local_variable)
+    helpers.assert_send_group_func(socket, "set", local_variable, {"value": 10})
+    assert hook.events == [
+        ("before", "dispatch", "get"),
+        ("before", "send_function", "set"),
+        ("after", "send_function", "set"),
+        ("before", "encode", "set"),
+        ("after", "encode", "set"),
+        ("before", "send", "set"),
+        ("after", "send", "set"),
+        ("after", "dispatch", "get")
+    ]
+
+
+def test_hook_sample_rate(socket, local_variable, hook):
+    profiling.set_sample_rate(0)
+    helpers.receive_group_func(socket, "get", local_variable)
+    assert hook.events == []
+
+
+def test_sampling_profiler(socket, local_variable, tmp_path):
+    profiler = SamplingProfiler()
+    with pytest.raises(ValueError):
+        profiler.dump_stats(str(tmp_path / "empty.prof"))
+
+    profiling.add_hook(profiler)
+    try:
+        helpers.receive_group_func(socket, "get", local_variable)
+        local_variable.value = 11
+    finally:
+        profiling.remove_hook(profiler)
+
+    assert profiler.timings[("dispatch", "get")][0] == 1
+    assert profiler.timings[("encode", "set")][0] == 2
+    assert profiler.timings[("send", "set")][0] == 2
+
+    path = str(tmp_path / "socksync.prof")
+    profiler.dump_stats(path)
+    functions = [function for _, _, function in pstats.Stats(path).stats]
+    assert "_do_request" in functions
@@ -0,0 +1,98 @@
+import json
+
+import pytest
+
+from socksync.groups import LocalVariable, LocalList, KeyedLocalList, LocalFunction
+from socksync.snapshots import SnapshotStore, save_snapshot
+from test import helpers
+
+
+def _save(tmp_path, groups, version=None) -> str:
+    path = str(tmp_path / "groups.snapshot")
+    save_snapshot(path, groups, version)
+    return path
+
+
+def test_restore(tmp_path):
+    path = _save(tmp_path, [LocalVariable("v", {"a": 1}), LocalList("l", [1, "two", {"three": 3}])], 42)
+    store = SnapshotStore(path)
+    assert store.version == 42
+    assert sorted(store.groups) == ["list:l", "var:v"]
+
+    var = LocalVariable("v", store=store)
+    lst = LocalList("l", store=store)
+    assert var.value == {"a": 1}
+    assert list(lst.items) == [1, "two", {"three": 3}]
+
+
+def test_restore_missing(tmp_path):
+    store = SnapshotStore(str(tmp_path / "missing"))
+    assert store.version is None
+    assert LocalVariable("v", 1, store=store).value == 1
+    assert list(LocalList("l", [1, 2], store=store).items) == [1, 2]
+
+
+def test_restore_invalid(tmp_path):
+    path = tmp_path / "invalid"
+    path.write_bytes(b"not a snapshot at all")
+    with pytest.raises(ValueError):
+        SnapshotStore(str(path))
+
+
+def test_save_unsupported_group(tmp_path):
+    with pytest.raises(ValueError):
+        _save(tmp_path, [LocalFunction("f")])
+
+
+def test_restore_is_lazy(tmp_path, mocker):
+    path = _save(tmp_path, [LocalList("l", list(range(1000)))])
+    loads = mocker.spy(json, "loads")
+    lst = LocalList("l", store=SnapshotStore(path))
+    assert loads.call_count == 1
+    assert lst._items[500] == 500
+    assert loads.call_count == 2
+
+
+def test_restored_list_changes(socket, tmp_path):
+    path = _save(tmp_path, [LocalList("l", [1, 2, 3])])
+    lst = LocalList("l", store=SnapshotStore(path))
+    socket.register_group(lst)
+    helpers.receive_group_func(socket, "subscribe", lst, {"get": {"page": 0, "page_size": 2}})
+    helpers.assert_send_group_func(socket, "set_all", lst,
+                                   {"page": 0, "page_size": 2, "total_item_count": 3, "items": [1, 2]})
+
+    lst.insert(0, 0)
+    lst.set(2, 20)
+    lst.delete(-1)
+    lst.append(4)
+    assert list(lst.items) == [0, 1, 20, 4]
+
+
+def test_restored_keyed_list(tmp_path):
+    path = _save(tmp_path, [KeyedLocalList("k", [{"id": 1, "v": 1}, {"id": 2, "v": 2}])])
+    lst = KeyedLocalList("k", store=SnapshotStore(path))
+    lst.update(2, {"id": 2, "v": 3})
+    assert lst.get(2) == {"id": 2, "v": 3}
+    assert lst.index(1) == 0
+
+
+def test_restored_keyed_list_is_lazy(tmp_path, mocker):
+    path = _save(tmp_path, [KeyedLocalList("k", [{"id": i} for i in range(1000)])])
+    loads = mocker.spy(json, "loads")
+    lst = KeyedLocalList("k", store=SnapshotStore(path))
+    assert loads.call_count == 1
+    lst.append({"id": 1000})
+    assert loads.call_count == 1001
+    assert lst.index(1000) == 1000
+
+
+def test_save_over_restored(tmp_path):
+    path = _save(tmp_path, [LocalList("l", [1, 2, 3])], 1)
+    lst = LocalList("l", store=SnapshotStore(path))
+    lst.append(4)
+    _save(tmp_path, [lst], 2)
+    assert list(lst.items) == [1, 2, 3, 4]
+
+    store = SnapshotStore(path)
+    assert store.version == 2
+    assert list(LocalList("l", store=store).items) == [1, 2, 3, 4]
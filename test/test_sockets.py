@@ -1,10 +1,14 @@
+import gc
 import json
+import tracemalloc
+import weakref
 
 import pytest
 
 from socksync import socksync
 from socksync.errors import SockSyncErrors
-from socksync.groups import LocalVariable, LocalList, LocalFunction
+from socksync.groups import LocalVariable, LocalList, LocalFunction, RemoteVariable, RemoteList, RemoteFunction
+from socksync.sockets import SockSyncSocket
 from test import helpers
 
 
@@ -104,3 +108,367 @@ def test_unsubscribe_all(socket, remote_groups):
     helpers.assert_send_func(socket, "unsubscribe_all")
     for g in remote_groups:
         assert not g.subscribed
+
+
+def test_receive_unsubscribe_all_subscribed(socket, local_groups):
+    for g in local_groups:
+        socket.register_group(g)
+        helpers.receive_group_func(socket, "subscribe", g)
+    helpers.receive_func(socket, "unsubscribe_all")
+    helpers.assert_no_send(socket)
+    for g in local_groups:
+        assert len(g.subscribers) == 0
+
+
+def test_receive_subscribe_many(socket):
+    var, lst = LocalVariable("a", 1), LocalList("b", [1, 2, 3])
+    socket.register_group(var)
+    socket.register_group(lst)
+    helpers.receive_func(socket, "subscribe_many", args={"groups": [
+        {"type": "var", "name": "a", "get": {}},
+        {"type": "list", "name": "b"}
+    ]})
+    helpers.assert_send_group_func(socket, "set", var, {"value": 1})
+    assert socket in var.subscribers
+    assert socket in lst.subscribers
+
+
+def test_receive_subscribe_many_invalid(socket):
+    helpers.receive_func(socket, "subscribe_many")
+    helpers.assert_send_error(socket, SockSyncErrors.ERROR_MISSING_FIELD)
+    helpers.receive_func(socket, "subscribe_many", args={"groups": [1]})
+    helpers.assert_send_error(socket, SockSyncErrors.ERROR_OTHER)
+    helpers.receive_func(socket, "subscribe_many", args={"groups": [{"type": "var", "name": "missing"}]})
+    helpers.assert_send_error(socket, SockSyncErrors.ERROR_INVALID_NAME)
+    helpers.receive_func(socket, "subscribe_many", args={"groups": [{"type": "invalid", "name": "a.*"}]})
+    helpers.assert_send_error(socket, SockSyncErrors.ERROR_INVALID_TYPE)
+
+
+def test_receive_subscribe_pattern(socket):
+    a, b, other = LocalVariable("prices.a", 1), LocalVariable("prices.b", 2), LocalVariable("orders.a", 3)
+    for g in [a, other]:
+        socket.register_group(g)
+    RemoteVariable("prices.remote", socket, False)
+
+    helpers.receive_func(socket, "subscribe_many", args={"groups": [{"type": "var", "name": "prices.*"}]})
+    helpers.assert_no_send(socket)
+    assert socket in a.subscribers
+    assert socket not in other.subscribers
+
+    socket.register_group(b)
+    assert socket in b.subscribers
+    socket.register_group(LocalList("prices.c"))
+    assert len(socket._subscriber_groups) == 2
+
+
+def test_receive_subscribe_pattern_snapshot(socket):
+    helpers.receive_func(socket, "subscribe_many", args={"groups": [{"type": "list", "name": "*",
+                                                                      "get": {"page": 0, "page_size": 1}}]})
+    lst = LocalList("a", [1, 2])
+    socket.register_group(lst)
+    helpers.assert_send_group_func(socket, "set_all", lst,
+                                   {"page": 0, "page_size": 1, "total_item_count": 2, "items": [1]})
+
+
+def test_receive_unsubscribe_all_patterns(socket):
+    helpers.receive_func(socket, "subscribe_many", args={"groups": [{"type": "var", "name": "prices.*"}]})
+    helpers.receive_func(socket, "unsubscribe_all")
+    group = LocalVariable("prices.a")
+    socket.register_group(group)
+    assert len(group.subscribers) == 0
+
+
+def test_subscribe_many(socket):
+    var = RemoteVariable("a", socket, False)
+    lst = RemoteList("b", socket, 5, False)
+    fun = RemoteFunction("c", socket, False)
+    socket.subscribe_many([var, lst, fun])
+    helpers.assert_send_func(socket, "subscribe_many", args={"groups": [
+        {"type": "var", "name": "a", "get": {}},
+        {"type": "list", "name": "b", "get": {"page": 0, "page_size": 5}},
+        {"type": "function", "name": "c"}
+    ]})
+    assert var.subscribed and lst.subscribed and fun.subscribed
+
+
+@pytest.mark.parametrize("group", [LocalVariable("g"), LocalList("g"), LocalFunction("g")])
+def test_disconnect_unsubscribes(socket, group):
+    socket.register_group(group)
+    helpers.receive_group_func(socket, "subscribe", group)
+    socket.disconnect(None)
+    assert len(group.subscribers) == 0
+
+
+def test_dropped_socket_is_released(socket):
+    group = LocalList("g")
+    dropped = SockSyncSocket(scope=None)
+    dropped.register_group(group)
+    helpers.receive_group_func(dropped, "subscribe", group)
+    ref = weakref.ref(dropped)
+    del dropped
+    gc.collect()
+    assert ref() is None
+    assert len(group.subscribers) == 0
+
+
+def test_connect_disconnect_memory_bounded(socket):
+    groups = [LocalVariable("g"), LocalList("g"), LocalFunction("g")]
+
+    def cycle(count: int):
+        for _ in range(count):
+            s = SockSyncSocket(scope=None)
+            for g in groups:
+                s.register_group(g)
+                helpers.receive_group_func(s, "subscribe", g)
+            s.disconnect(None)
+        gc.collect()
+
+    cycle(200)
+    tracemalloc.start()
+    try:
+        cycle(200)
+        before = tracemalloc.get_traced_memory()[0]
+        cycle(2000)
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+    for g in groups:
+        assert len(g.subscribers) == 0
+    assert after - before < 64 * 1024
+
+
+class _GuardedSocket(SockSyncSocket):
+    max_message_size = 200
+    max_message_depth = 3
+    rate_limit = (1, 5)
+    func_rate_limits = {("var", "get"): (1, 2)}
+
+
+@pytest.fixture
+def clock(mocker):
+    clock = mocker.patch("socksync.utils.time")
+    clock.monotonic.return_value = 0
+    return clock
+
+
+@pytest.fixture
+def guarded_socket(socket, clock):
+    return _GuardedSocket(scope=None)
+
+
+def test_receive_too_large(guarded_socket):
+    helpers.receive_func(guarded_socket, "error", args={"message": "a" * 200})
+    helpers.assert_send_error(guarded_socket, SockSyncErrors.ERROR_OTHER)
+
+
+def test_receive_too_deep(guarded_socket):
+    helpers.receive_func(guarded_socket, "error", args={"message": [{"a": "[[[["}]})
+    helpers.assert_no_send(guarded_socket)
+    helpers.receive_func(guarded_socket, "error", args={"message": [{"a": []}]})
+    helpers.assert_send_error(guarded_socket, SockSyncErrors.ERROR_INVALID_JSON)
+
+
+def test_receive_recursion(socket):
+    socket.receive("[" * 100000 + "]" * 100000)
+    helpers.assert_send_error(socket, SockSyncErrors.ERROR_INVALID_JSON)
+
+
+def test_receive_rate_limit(guarded_socket, clock):
+    for _ in range(5):
+        helpers.receive_func(guarded_socket, "error")
+    helpers.assert_no_send(guarded_socket)
+    helpers.receive_func(guarded_socket, "error")
+    helpers.assert_send_error(guarded_socket, SockSyncErrors.ERROR_OTHER)
+
+    clock.monotonic.return_value = 2
+    helpers.receive_func(guarded_socket, "error")
+    helpers.receive_func(guarded_socket, "error")
+    helpers.assert_no_send(guarded_socket)
+
+
+def test_receive_func_rate_limit(guarded_socket):
+    var = LocalVariable("a", 1)
+    guarded_socket.register_group(var)
+    helpers.receive_group_func(guarded_socket, "subscribe", var)
+    for _ in range(2):
+        helpers.receive_group_func(guarded_socket, "get", var)
+        helpers.assert_send_group_func(guarded_socket, "set", var, {"value": 1})
+    helpers.receive_group_func(guarded_socket, "get", var)
+    helpers.assert_send_error(guarded_socket, SockSyncErrors.ERROR_OTHER)
+    helpers.receive_group_func(guarded_socket, "unsubscribe", var)
+    helpers.assert_no_send(guarded_socket)
+
+
+def test_receive_ping(socket):
+    helpers.receive_func(socket, "ping")
+    helpers.assert_send_func(socket, "pong")
+    helpers.receive_func(socket, "pong")
+    helpers.assert_no_send(socket)
+
+
+def test_idle_socket_skips_updates(socket, local_variable, local_list):
+    helpers.reset_send(socket)
+    helpers.receive_func(socket, "idle")
+    assert socket.suspended
+    local_variable.value = 11
+    local_list.append(4)
+    helpers.assert_no_send(socket)
+
+    helpers.receive_func(socket, "active")
+    assert not socket.suspended
+    assert socket.send.call_count == 2
+    frames = [json.loads(call[0][0]) for call in socket.send.call_args_list]
+    assert {"func": "set", "type": "var", "name": "test", "value": 11} in frames
+    assert {"func": "set_all", "type": "list", "name": "test", "page": 0, "page_size": 25, "total_item_count": 4,
+            "items": [1, 2, 3, 4]} in frames
+    helpers.reset_send(socket)
+
+    local_variable.value = 12
+    helpers.assert_send_group_func(socket, "set", local_variable, {"value": 12})
+
+
+class _HeartbeatSocket(SockSyncSocket):
+    heartbeat_interval = 10
+
+
+def test_heartbeat_timeout_suspends(socket, local_variable, mocker):
+    clock = mocker.patch("socksync.sockets.time")
+    clock.monotonic.return_value = 0
+    heartbeat_socket = _HeartbeatSocket(scope=None)
+    local_variable._handle_func("subscribe", {}, heartbeat_socket)
+    helpers.reset_send(socket)
+
+    clock.monotonic.return_value = 10
+    heartbeat_socket._heartbeat()
+    helpers.assert_send_func(socket, "ping")
+    assert not heartbeat_socket.suspended
+
+    clock.monotonic.return_value = 21
+    heartbeat_socket._heartbeat()
+    helpers.assert_send_func(socket, "ping")
+    assert heartbeat_socket.suspended
+
+    helpers.receive_func(heartbeat_socket, "pong")
+    assert not heartbeat_socket.suspended
+    helpers.assert_send_group_func(socket, "set", local_variable, {"value": 10})
+
+
+
+def test_idle_socket_stays_idle_on_heartbeat(socket, local_list, mocker):
+    clock = mocker.patch("socksync.sockets.time")
+    clock.monotonic.return_value = 0
+    heartbeat_socket = _HeartbeatSocket(scope=None)
+    local_list._handle_func("subscribe", {}, heartbeat_socket)
+    helpers.receive_func(heartbeat_socket, "idle")
+    helpers.reset_send(socket)
+
+    for now in (10, 20, 30):
+        clock.monotonic.return_value = now
+        heartbeat_socket._heartbeat()
+        helpers.assert_send_func(socket, "ping")
+        helpers.receive_func(heartbeat_socket, "pong")
+        helpers.receive_func(heartbeat_socket, "ping")
+        helpers.assert_send_func(socket, "pong")
+        assert heartbeat_socket.suspended
+
+    clock.monotonic.return_value = 100
+    heartbeat_socket._heartbeat()
+    helpers.receive_func(heartbeat_socket, "pong")
+    assert heartbeat_socket.suspended
+    helpers.reset_send(socket)
+
+    helpers.receive_func(heartbeat_socket, "active")
+    assert not heartbeat_socket.suspended
+    helpers.assert_send_group_func(socket, "set_all", local_list,
+                                   {"page": 0, "page_size": 25, "total_item_count": 3, "items": [1, 2, 3]})
+
+def test_send_lanes(socket):
+    sent = []
+
+    def send(text):
+        # Frames queued by other threads while this one is sending.
+        if not sent:
+            socket._send_encoded("bulk a", "set_all", ("list", "a"))
+            socket._send_encoded("delta a", "insert", ("list", "a"))
+            socket._send_encoded("delta b", "insert", ("list", "b"))
+            socket._send_encoded("return", "return", ("function", "c"))
+            socket._send_encoded("error", "error")
+        sent.append(text)
+
+    socket.send.side_effect = send
+    socket._send_encoded("first", "set_all", ("list", "b"))
+    assert sent == ["first", "error", "return", "delta b", "bulk a", "delta a"]
+    assert socket._queued == {}
+
+
+@pytest.fixture
+def group_factory(mocker):
+    created = []
+    release = mocker.stub()
+
+    def factory(socket, name):
+        if name == "orders.none":
+            return None
+        created.append(LocalVariable(name, name))
+        return created[-1]
+
+    socksync.add_group_factory("var", "orders.*", factory, release)
+    yield created, release
+    socksync.remove_group_factory(factory)
+
+
+def test_group_factory_subscribe(socket, group_factory):
+    created, release = group_factory
+    helpers.receive_func(socket, "subscribe", "var", "orders.1", {"get": {}})
+    helpers.assert_send_func(socket, "set", "var", "orders.1", {"value": "orders.1"})
+    helpers.receive_func(socket, "get", "var", "orders.1")
+    helpers.assert_send_func(socket, "set", "var", "orders.1", {"value": "orders.1"})
+    assert len(created) == 1
+    assert created[0].subscribers == [socket]
+
+    helpers.receive_func(socket, "unsubscribe", "var", "orders.1")
+    release.assert_called_once_with(created[0])
+    helpers.receive_func(socket, "unsubscribe", "var", "orders.1")
+    helpers.assert_send_error(socket, SockSyncErrors.ERROR_INVALID_NAME)
+
+
+def test_group_factory_released_without_subscription(socket, group_factory):
+    created, release = group_factory
+    helpers.receive_func(socket, "get", "var", "orders.1")
+    helpers.assert_send_error(socket, SockSyncErrors.ERROR_INVALID_FUNC)
+    release.assert_called_once_with(created[0])
+    assert "orders.1" not in socket._registry["var"]
+
+
+def test_group_factory_no_match(socket, group_factory):
+    created, release = group_factory
+    helpers.receive_func(socket, "subscribe", "var", "trades.1")
+    helpers.assert_send_error(socket, SockSyncErrors.ERROR_INVALID_NAME)
+    helpers.receive_func(socket, "subscribe", "var", "orders.none")
+    helpers.assert_send_error(socket, SockSyncErrors.ERROR_INVALID_NAME)
+    helpers.receive_func(socket, "subscribe", "list", "orders.1")
+    helpers.assert_send_error(socket, SockSyncErrors.ERROR_INVALID_NAME)
+    assert created == []
+
+
+def test_group_factory_released_on_disconnect(socket, group_factory):
+    created, release = group_factory
+    helpers.receive_func(socket, "subscribe", "var", "orders.1")
+    helpers.receive_func(socket, "subscribe", "var", "orders.2")
+    socket.disconnect(None)
+    assert release.call_count == 2
+    assert created[0].subscribers == []
+
+
+def test_suspend_and_resume_reach_groups_in_order(socket, local_variable, mocker):
+    calls = []
+    for hook in ("_socket_suspended", "_socket_resumed"):
+        original = getattr(LocalVariable, hook)
+        mocker.patch.object(LocalVariable, hook, lambda group, s, hook=hook, original=original: (
+            calls.append((hook, socket._suspend_lock.locked())), original(group, s)))
+
+    socket._suspend("timeout")
+    helpers.receive_func(socket, "active")
+    assert calls == [("_socket_suspended", True), ("_socket_resumed", True)]
+    assert socket in local_variable._subscriber_sockets
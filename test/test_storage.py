@@ -0,0 +1,266 @@
+from unittest.mock import patch
+
+import pytest
+
+from socksync.groups import LocalVariable, LocalList, KeyedLocalList, SortedLocalList, RemoteList
+from socksync.storage import RedisStore, RedisList
+from test import helpers
+from test.fake_redis import FakeRedis, FakeRedisServer
+
+
+def _stores(count: int = 2):
+    server = FakeRedisServer()
+    return [RedisStore(FakeRedis(server)) for _ in range(count)]
+
+
+def _subscribe(socket, group, args: dict = None):
+    socket.register_group(group)
+    helpers.receive_group_func(socket, "subscribe", group)
+    if args is not None:
+        helpers.receive_group_func(socket, "get", group, args)
+    helpers.reset_send(socket)
+    return group
+
+
+def test_variable_shared_between_workers(socket):
+    a, b = _stores()
+    var_a = LocalVariable("v", 1, store=a)
+    var_b = _subscribe(socket, LocalVariable("v", 5, store=b))
+    assert var_b.value == 1
+
+    var_a.value = 2
+    helpers.assert_no_send(socket)
+    b.poll()
+    helpers.assert_send_group_func(socket, "set", var_b, {"value": 2})
+    assert var_b.value == 2
+
+
+def test_variable_read_through_cache(socket, mocker):
+    store, = _stores(1)
+    var = LocalVariable("v", 1, store=store)
+    hmget = mocker.spy(FakeRedis, "hmget")
+    assert var.value == 1
+    assert var.value == 1
+    var.value = 3
+    assert var.value == 3
+    assert hmget.call_count == 1
+
+
+def test_list_initial_items_only_written_once():
+    a, b = _stores()
+    LocalList("l", [1, 2, 3], store=a)
+    lst = LocalList("l", [4, 5], store=b)
+    assert list(lst.items) == [1, 2, 3]
+
+
+def test_list_changes_reach_other_workers(socket):
+    a, b = _stores()
+    lst_a = LocalList("l", [1, 2, 3], store=a)
+    lst_b = _subscribe(socket, LocalList("l", store=b), {"page": 0, "page_size": 2})
+
+    lst_a.insert(0, 0)
+    b.poll()
+    helpers.assert_send_group_func(socket, "set_count", lst_b, {"total_item_count": 4}, True)
+    helpers.assert_send_group_func(socket, "delete", lst_b, {"index": 1}, True)
+    helpers.assert_send_group_func(socket, "insert", lst_b, {"index": 0, "value": 0})
+
+    lst_a.set(1, 10)
+    lst_a.delete(3)
+    b.poll()
+    helpers.assert_send_group_func(socket, "set", lst_b, {"index": 1, "value": 10}, True)
+    helpers.assert_send_group_func(socket, "set_count", lst_b, {"total_item_count": 3})
+    assert list(lst_b.items) == [0, 10, 2]
+    assert list(lst_a.items) == [0, 10, 2]
+
+
+def test_list_missed_change_reloads(socket):
+    a, b = _stores()
+    lst_a = LocalList("l", [1, 2, 3], store=a)
+    lst_b = _subscribe(socket, LocalList("l", store=b), {"page": 0, "page_size": 2})
+    lst_a.insert(0, 0)
+    lst_a.insert(0, -1)
+    b._pubsub.messages.popleft()
+    b.poll()
+    helpers.assert_send_group_func(socket, "set_all", lst_b,
+                                   {"page": 0, "page_size": 2, "total_item_count": 5, "items": [-1, 0]})
+
+
+def test_list_own_change_after_missed_change(socket):
+    a, b = _stores()
+    lst_a = LocalList("l", [1, 2, 3], store=a)
+    lst_b = LocalList("l", store=b)
+    assert list(lst_b.items) == [1, 2, 3]
+    lst_a.delete(0)
+    lst_b.insert(3, 4)
+    assert list(lst_b.items) == [2, 3, 4]
+
+
+def test_list_filtered_view_follows_other_workers(socket):
+    a, b = _stores()
+    lst_a = LocalList("l", [{"v": 1}, {"v": 2}], store=a)
+    lst_b = _subscribe(socket, LocalList("l", store=b), {"filter": {"v": {"gte": 2}}})
+    lst_a.insert(0, {"v": 3})
+    b.poll()
+    helpers.assert_send_group_func(socket, "set_count", lst_b, {"total_item_count": 2}, True)
+    helpers.assert_send_group_func(socket, "insert", lst_b, {"index": 0, "value": {"v": 3}})
+
+
+def test_keyed_and_sorted_lists_follow_other_workers():
+    a, b = _stores()
+    keyed_a = KeyedLocalList("k", [{"id": 1}, {"id": 2}], store=a)
+    keyed_b = KeyedLocalList("k", store=b)
+    keyed_a.remove(1)
+    b.poll()
+    assert keyed_b.index(2) == 0
+
+    sorted_a = SortedLocalList("s", [3, 1, 2], store=a)
+    sorted_b = SortedLocalList("s", store=b)
+    sorted_a.add(0)
+    b.poll()
+    assert sorted_b.add(4) == 4
+    assert list(sorted_b.items) == [0, 1, 2, 3, 4]
+
+
+def test_list_write_catches_up_first(socket):
+    a, b = _stores()
+    lst_a = _subscribe(socket, LocalList("l", ["x", "y"], store=a), {"page": 0, "page_size": 3})
+    lst_b = LocalList("l", store=b)
+    lst_b.insert(0, "new")
+    lst_a.set(0, "x2")
+    helpers.assert_send_group_func(socket, "set_count", lst_a, {"total_item_count": 3}, True)
+    helpers.assert_send_group_func(socket, "insert", lst_a, {"index": 0, "value": "new"}, True)
+    helpers.assert_send_group_func(socket, "set", lst_a, {"index": 1, "value": "x2"})
+    a.poll()
+    helpers.assert_no_send(socket)
+    b.poll()
+    assert list(lst_a.items) == ["new", "x2", "y"]
+    assert list(lst_b.items) == ["new", "x2", "y"]
+
+    lst_b.delete(0)
+    with pytest.raises(IndexError):
+        lst_a.delete(0)
+    assert list(lst_a.items) == ["x2", "y"]
+
+
+def test_list_write_after_change_slipped_in(socket):
+    a, b = _stores()
+    lst_a = _subscribe(socket, LocalList("l", ["x", "y"], store=a), {"page": 0, "page_size": 3})
+    lst_b = LocalList("l", store=b)
+    lst_b.insert(0, "new")
+    # Another worker's change lands between catching up and writing.
+    with patch.object(RedisList, "catch_up", lambda self: iter(())):
+        lst_a.set(0, "x2")
+    assert list(lst_a.items) == ["new", "x2", "y"]
+    helpers.reset_send(socket)
+    a.poll()
+    helpers.assert_send_group_func(socket, "set_all", lst_a,
+                                   {"page": 0, "page_size": 3, "total_item_count": 3, "items": ["new", "x2", "y"]})
+
+
+def test_list_remote_change_locks_group(mocker):
+    a, b = _stores()
+    lst_a = LocalList("l", [1], store=a)
+    lst_b = LocalList("l", store=b)
+    assert list(lst_b.items) == [1]
+    locked = []
+    change = RedisList._change
+    mocker.patch.object(RedisList, "_change", lambda self, *args: (locked.append(lst_b._lock._is_owned()),
+                                                                   change(self, *args)))
+    lst_a.append(2)
+    locked.clear()
+    b.poll()
+    assert locked == [True]
+    assert list(lst_b.items) == [1, 2]
+
+
+def test_list_writes_move_the_shorter_side(mocker):
+    store, = _stores(1)
+    lst = LocalList("l", list(range(10)), store=store)
+    expected = list(range(10))
+    assert list(lst.items) == expected
+    lrange = mocker.spy(FakeRedis, "lrange")
+    lst.insert(0, "a")
+    lst.append("b")
+    lst.delete(0)
+    lst.delete(-1)
+    assert lrange.call_count == 0
+
+    for op, index in [("insert", 2), ("insert", 9), ("delete", 1), ("delete", 8), ("insert", 5), ("delete", 5)]:
+        if op == "insert":
+            lst.insert(index, op + str(index))
+            expected.insert(index, op + str(index))
+        else:
+            lst.delete(index)
+            expected.pop(index)
+    moved = [call.args[2:] for call in lrange.call_args_list if call.args[1] == "socksync:list:l"]
+    assert moved == [(0, 1), (9, -1), (0, 0), (8, -1), (0, 4), (0, 4)]
+    assert list(LocalList("l", store=RedisStore(FakeRedis(store._client.server))).items) == expected
+
+
+def test_keyed_list_remote_changes_only_reindex_after_them(mocker):
+    a, b = _stores()
+    keyed_a = KeyedLocalList("k", [{"id": i} for i in range(6)], store=a)
+    keyed_b = KeyedLocalList("k", store=b)
+    assert keyed_b.index(5) == 5
+    keyed_a.update(4, {"id": 10})
+    keyed_a.remove(2)
+    keyed_a.insert(1, {"id": 11})
+    reindex = mocker.spy(KeyedLocalList, "_reindex")
+    b.poll()
+    assert reindex.call_count == 0
+    assert keyed_b.index(0) == 0
+    assert reindex.call_count == 0
+    assert keyed_b.index(10) == 4
+    assert keyed_b.index(11) == 1
+    assert 4 not in keyed_b
+    assert 2 not in keyed_b
+    assert [keyed_b.index(key) for key in (0, 11, 1, 3, 10, 5)] == list(range(6))
+
+
+def test_sorted_list_remote_changes_keep_keys(mocker):
+    a, b = _stores()
+    sorted_a = SortedLocalList("s", [5, 1, 3], store=a)
+    key = mocker.stub()
+    key.side_effect = lambda value: value
+    sorted_b = SortedLocalList("s", key=key, store=b)
+    sorted_a.add(2)
+    sorted_a.remove(5)
+    sorted_a.set(0, 0)
+    key.reset_mock()
+    b.poll()
+    assert key.call_count == 2
+    assert sorted_b.add(4) == 3
+    assert list(sorted_b.items) == [0, 2, 3, 4]
+
+
+def _client(lst, page_size: int = 10):
+    server, client, frames = helpers.socket_pair()
+    server.register_group(lst)
+    remote = RemoteList(lst.name, client, page_size)
+    helpers.deliver(frames)
+    return remote, frames
+
+
+def test_list_caught_up_changes_sent_one_by_one():
+    stores = _stores(3)
+    lists = [LocalList("l", list(range(4)), store=store) for store in stores]
+    remote, frames = _client(lists[1])
+    lists[0].insert(2, 110)
+    lists[2].insert(0, 111)
+    lists[1].insert(2, 113)
+    helpers.deliver(frames)
+    assert list(remote.items) == [111, 0, 1, 110, 113, 2, 3]
+    assert list(lists[1].items) == [111, 0, 1, 110, 113, 2, 3]
+
+
+def test_list_caught_up_changes_sent_before_deleted_item_raises():
+    a, b = _stores()
+    lst_a = LocalList("l", [0, 1, 2], store=a)
+    lst_b = LocalList("l", store=b)
+    remote, frames = _client(lst_b)
+    lst_a.delete(0)
+    with pytest.raises(IndexError):
+        lst_b.delete(0)
+    b.poll()
+    helpers.deliver(frames)
+    assert list(remote.items) == [1, 2]
@@ -1,4 +1,8 @@
-from socksync.utils import dict_without_none
+import time
+
+import pytest
+
+from socksync.utils import dict_without_none, ListFilter, NameTrie, get_path, json_depth_exceeds
 
 
 def test_dict_without_none_empty():
@@ -15,3 +19,88 @@ def test_dict_without_none_with_none():
 
 def test_dict_without_none_with_both():
     assert dict_without_none({"test": 1, "test2": None}) == {"test": 1}
+
+
+def test_list_filter_equality():
+    f = ListFilter({"side": "buy"})
+    assert f.matches({"side": "buy", "price": 1})
+    assert not f.matches({"side": "sell", "price": 1})
+    assert not f.matches({"price": 1})
+    assert not f.matches(1)
+
+
+def test_list_filter_range():
+    f = ListFilter({"price": {"gte": 10, "lt": 20}})
+    assert f.matches({"price": 10})
+    assert f.matches({"price": 19})
+    assert not f.matches({"price": 20})
+    assert not f.matches({"price": "abc"})
+
+
+def test_list_filter_in():
+    f = ListFilter({"side": {"in": ["buy", "sell"]}})
+    assert f.matches({"side": "sell"})
+    assert not f.matches({"side": "hold"})
+
+
+def test_list_filter_key_is_canonical():
+    assert ListFilter({"a": 1, "b": {"gt": 2}}).key == ListFilter({"b": {"gt": 2}, "a": 1}).key
+
+
+def test_list_filter_invalid():
+    with pytest.raises(ValueError):
+        ListFilter({"a": {"like": 1}})
+    with pytest.raises(ValueError):
+        ListFilter([1])
+
+
+def test_name_trie_prefix():
+    trie = NameTrie()
+    for name in ["prices.a", "prices.b", "prices", "orders.a"]:
+        trie.add(name, name)
+    assert sorted(trie.with_prefix("prices.")) == ["prices.a", "prices.b"]
+    assert sorted(trie.with_prefix("")) == ["orders.a", "prices", "prices.a", "prices.b"]
+    assert list(trie.with_prefix("trades")) == []
+
+
+def test_name_trie_prefixes_of():
+    trie = NameTrie()
+    for prefix in ["", "prices.", "prices.a", "orders."]:
+        trie.add(prefix, prefix)
+    assert list(trie.prefixes_of("prices.ab")) == ["", "prices.", "prices.a"]
+    assert list(trie.prefixes_of("trades")) == [""]
+
+
+def test_name_trie_discard():
+    trie = NameTrie()
+    trie.add("ab", 1)
+    trie.add("abc", 2)
+    trie.discard("abc")
+    trie.discard("missing")
+    assert list(trie.with_prefix("a")) == [1]
+    trie.discard("ab")
+    assert list(trie.with_prefix("")) == []
+
+
+def test_get_path():
+    value = {"balances": {"BTC": 1, "ETH": [2, 3]}}
+    assert get_path(value, None) is value
+    assert get_path(value, "balances.BTC") == 1
+    assert get_path(value, "balances.ETH.1") == 3
+    assert get_path(value, "balances.ETH.2") is None
+    assert get_path(value, "balances.BTC.x") is None
+    assert get_path(value, "missing") is None
+
+
+def test_json_depth_exceeds():
+    assert not json_depth_exceeds('{"a": [1, {"b": 2}]}', 3)
+    assert json_depth_exceeds('{"a": [1, {"b": [2]}]}', 3)
+    assert not json_depth_exceeds('{"a": "[[[[{{{{", "b": "\\"[[[["}', 1)
+    assert not json_depth_exceeds('[[1], [2], [3], [4]]', 2)
+    assert json_depth_exceeds('["\\\\", [[1]]]', 2)
+
+
+def test_json_depth_exceeds_unclosed_string_is_linear():
+    start = time.perf_counter()
+    assert not json_depth_exceeds('"\\' * 20000 + '[]' * 40, 3)
+    assert time.perf_counter() - start < 0.5